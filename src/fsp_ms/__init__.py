@@ -1,9 +1,50 @@
-from .config import Config
-from .utils.logger import get_logger
-from .validation.validator import Validator
-from .data.etl import ETL_pipeline
-from .validation.schema_cleaned import SchemaSales
-from .features.build_features import BuildFeatures
-from .validation.scheme_features import SchemaFeatures
-from .data.split import Split
-from .models.XGB_model import XGB_model
+# Public classes are imported on first attribute access (PEP 562): ``import fsp_ms`` or
+# ``from fsp_ms.config import Config`` does not pull in pandas, xgboost or pandera.
+import importlib
+from typing import TYPE_CHECKING
+
+_lazy_imports = {
+    'Config':              '.config',
+    'get_logger':          '.utils.logger',
+    'StageCache':          '.utils.cache',
+    'StageProfiler':       '.utils.profiler',
+    'Validator':           '.validation.validator',
+    'ETL_pipeline':        '.data.etl',
+    'SchemaSales':         '.validation.schema_cleaned',
+    'BuildFeatures':       '.features.build_features',
+    'IncrementalFeatures': '.features.incremental',
+    'SchemaFeatures':      '.validation.scheme_features',
+    'Split':               '.data.split',
+    'SyntheticData':       '.data.synthetic',
+    'XGB_model':           '.models.XGB_model',
+}
+
+__all__ = list(_lazy_imports)
+
+
+def __getattr__(name: str):
+    if name not in _lazy_imports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_lazy_imports[name], __name__), name)
+    globals()[name] = value # next access does not go through __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if TYPE_CHECKING:
+    from .config import Config
+    from .utils.logger import get_logger
+    from .utils.cache import StageCache
+    from .utils.profiler import StageProfiler
+    from .validation.validator import Validator
+    from .data.etl import ETL_pipeline
+    from .validation.schema_cleaned import SchemaSales
+    from .features.build_features import BuildFeatures
+    from .features.incremental import IncrementalFeatures
+    from .validation.scheme_features import SchemaFeatures
+    from .data.split import Split
+    from .data.synthetic import SyntheticData
+    from .models.XGB_model import XGB_model
@@ -1,8 +1,10 @@
+from __future__ import annotations
+
 from pathlib import Path
 
 class Config:
 
-    def __init__(self, base_dir: Path = None, **custom_paths):
+    def __init__(self, base_dir: Path = None, create_dirs: bool = True, **custom_paths):
         self.base_dir = base_dir or Path(__file__).resolve().parents[2] / 'data' # store all data in dedicated folder ⚠️
         self.models_dir = base_dir or Path(__file__).resolve().parents[2] / 'models'
 
@@ -23,9 +25,15 @@ class Config:
 
         '''
 
+        # Directories are not created here: get() creates the directory a key lives in the first time the key is read
+        # (create_dirs=False never touches the file system), so building a Config for its paths has no side effects.
+        self.create_dirs = create_dirs
+        self._dirs: list[Path] = []
+        self._created: set[Path] = set()
+
         def override_or_default(key: str, default: Path):
             path =  Path(custom_paths.get(key, default)) # if key exists in custom_path - return it as path, else take 'defatult' var
-            path.mkdir(parents=True, exist_ok=True)
+            self._dirs.append(path)
             return path
 
         logs_dir      = override_or_default('logs_dir', self.base_dir / '07_logs')
@@ -45,6 +53,9 @@ class Config:
             'log_file_build_features':  logs_dir / 'build_features.log',
             'log_file_split':           logs_dir / 'split.log',
             'log_file_model':           logs_dir / 'model.log',
+            'log_file_stage_cache':     logs_dir / 'stage_cache.log',
+            'log_file_profiler':        logs_dir / 'profiler.log',
+            'profiles':                 logs_dir / 'profiles', # JSON stage reports of StageProfiler, one per run
 
             # Expirements logging
             'log_ml_flow':              logs_dir / 'ml_flow.log',
@@ -52,6 +63,9 @@ class Config:
             # Models
             'models_dir':               models_dir,
             'xgb_model':                models_dir / 'xgb_model.pkl',
+            'xgb_model_ubj':            models_dir / 'xgb_model.ubj', # native XGBoost formats, loaded into a Booster
+            'xgb_model_json':           models_dir / 'xgb_model.json',
+            'xgb_model_meta':           models_dir / 'xgb_model.meta.json', # features and categories of the native model
 
             # Validation Schems _07
             'validation_schema_cleaned':   logs_dir / 'validation_schema_cleaned.log',
@@ -67,16 +81,24 @@ class Config:
             'train_x':                  processed_dir / 'train_x.parquet',
             'train_y':                  processed_dir / 'train_y.parquet',
             'inference':                processed_dir / 'inference.parquet',
+            'feature_index':            processed_dir / 'feature_index', # inference rows keyed by (shop_id, item_id), memory-mapped columns
+            'feature_matrix':           processed_dir / 'feature_matrix', # float32 column-major train/inference matrices of FeatureMatrix
 
             # Features _04
             'features_dir':             features_dir,
             'features':                 features_dir / 'full_features.parquet',
+            'features_dataset':         features_dir / 'full_features', # Partitioned by date_block_num
 
             # Interim _03
             'interim_dir':              interim_dir,
             'sales_for_eda':            interim_dir / 'sales_for_eda.parquet', # DQC Notebook output with merged dicts
             'interim_parquet':          interim_dir / 'data_checkpoint_full_df_feature_engineering.parquet', # Feature engineering debugging
             'full_df_test_csv':         interim_dir / 'full_df_test_csv.csv', # Test for features validation schema
+            'features_state':           interim_dir / 'features_state', # Running state for incremental month append
+            'stage_cache':              interim_dir / 'stage_cache', # Content-hashed intermediate frames of ETL and feature stages
+            'xgb_external_memory':      interim_dir / 'xgb_external_memory', # DMatrix pages of XGB_model.train(train_data='external')
+            'column_cache':             interim_dir / 'column_cache', # Memory-mapped .npy columns of train_x, train_y and inference
+            'etl_spill':                interim_dir / 'etl_spill', # Per-month spill files of streaming ETL
             'cleaned_test_schema_csv':  interim_dir / 'cleaned_test_schema.csv', # Test for cleaned validation schema
 
             # Cleaned _02
@@ -141,7 +163,20 @@ class Config:
     def get(self, key : str) -> Path:
             if key not in self._config:
                 raise KeyError(f"Config key '{key}' not found.\nPossible keys: {self.keys()}")
-            return self._config[key]
+            path = self._config[key]
+            if self.create_dirs:
+                self.ensure_dir(path)
+            return path
+
+    def ensure_dir(self, path: Path) -> None:
+            # Creates the deepest base directory (raw_dir, ..., logs_dir, models_dir) containing `path`, once
+            owners = [d for d in self._dirs if path == d or path.is_relative_to(d)]
+            if not owners:
+                return
+            directory = max(owners, key=lambda d: len(d.parts))
+            if directory not in self._created:
+                directory.mkdir(parents=True, exist_ok=True)
+                self._created.add(directory)
 
     def set(self, key: str, value: Path | str) -> None:
             if 'dir' in key:
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+class ColumnCache():
+    '''
+    Columns of a parquet file (train_x, train_y, inference) as raw .npy files, memory-mapped on load.
+
+    read(source, columns) decodes a column from parquet only the first time it is asked for: it is saved as
+    <column_cache>/<source stem>/<column>.npy and listed in manifest.json with its dtype. Later reads
+    np.load(mmap_mode='r') the files and wrap them in a DataFrame without a copy, so repeated train/predict runs
+    skip parquet decoding and every process reading the cache shares the same page cache pages.
+
+    The manifest records size and mtime of the source parquet and its number of rows: when the source is rewritten
+    (Split, BuildFeatures) the entry is dropped and rebuilt on the next read. Only numeric and bool columns can
+    be cached (the feature files hold nothing else).
+
+    Example:
+        cache = ColumnCache(config, logger)
+        X = cache.read(config.get('train_x'), columns=config.get_xgb('important_features'))
+        model = XGB_model(config, logger, column_cache=cache)
+    '''
+
+    def __init__(self, config, logger):
+        self.config = config
+        self.logger = logger
+        self.path = Path(config.get('column_cache'))
+
+    def entry_path(self, source) -> Path:
+        return self.path / Path(source).stem
+
+    def source_state(self, source) -> dict:
+        stat = os.stat(source)
+        return {'source': str(Path(source).resolve()), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def manifest(self, source) -> dict:
+        # Manifest of a valid entry, a new empty one if there is no entry or the source parquet changed
+        state = self.source_state(source)
+        manifest_path = self.entry_path(source) / 'manifest.json'
+        if manifest_path.exists():
+            with open(manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if all(manifest.get(key) == value for key, value in state.items()):
+                return manifest
+            self.logger.info(f'{source} has changed since it was cached, column cache entry is rebuilt')
+            shutil.rmtree(self.entry_path(source), ignore_errors=True)
+        metadata = pq.read_metadata(source)
+        return {**state, 'rows': metadata.num_rows, 'source_columns': metadata.schema.to_arrow_schema().names, 'columns': {}}
+
+    def save_manifest(self, source, manifest: dict):
+        temp = self.entry_path(source) / f'manifest.json.{os.getpid()}.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp, temp.with_name('manifest.json')) # readers never see a half written manifest
+
+    def add_columns(self, source, manifest: dict, columns: list[str]):
+        self.logger.info(f'Caching {len(columns)} columns of {source}...')
+        entry = self.entry_path(source)
+        entry.mkdir(parents=True, exist_ok=True)
+        df = pd.read_parquet(source, columns=columns)
+        for column in columns:
+            values = df[column].to_numpy()
+            if values.dtype.kind not in 'biuf':
+                raise ValueError(f"Column '{column}' of {source} has dtype {values.dtype}, only numeric columns can be cached")
+            temp = entry / f'{column}.{os.getpid()}.tmp.npy'
+            np.save(temp, values)
+            os.replace(temp, entry / f'{column}.npy')
+            manifest['columns'][column] = {'dtype': values.dtype.str, 'file': f'{column}.npy'}
+        self.save_manifest(source, manifest)
+
+    def read(self, source, columns: list[str] | None = None) -> pd.DataFrame:
+        # columns=None reads every column of the source, in parquet order
+        manifest = self.manifest(source)
+        columns = manifest['source_columns'] if columns is None else list(columns)
+        unknown = [column for column in columns if column not in manifest['source_columns']]
+        if unknown:
+            raise ValueError(f'Columns {unknown} are not in {source}')
+        missing = [column for column in columns if column not in manifest['columns']]
+        if missing:
+            self.add_columns(source, manifest, missing)
+        entry = self.entry_path(source)
+        mmap_mode = 'r' if manifest['rows'] else None # an empty array can not be mapped
+        arrays = {column: np.load(entry / manifest['columns'][column]['file'], mmap_mode=mmap_mode) for column in columns}
+        return pd.DataFrame(arrays, copy=False)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.logger.info(f'Column cache {self.path} cleared')
@@ -1,41 +1,82 @@
+from __future__ import annotations
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
 
+from ..utils.quantile_sketch import QuantileSketch
+from ..utils.profiler import profile_stage
+
 class ETL_pipeline():
 
+    shop_replacements = {10: 11, 1: 58, 0: 57, 40: 39} # duplicated shops -> kept shop id
+
     def __init__(self, config, logger):
         self.config = config
         self.logger = logger
 
-    def outliers_filtration(self, df, column: str):
+    def outlier_bounds(self, df, column: str, sketch_error: float | None = None, chunksize: int = 1_000_000,
+                       compare_exact: bool = False) -> tuple[float, float]:
+        if sketch_error is None:
+            return df[column].quantile(0.01), df[column].quantile(0.99)
+
+        # Quantile sketch is updated chunk by chunk, as in streaming mode
+        values = df[column].to_numpy()
+        sketch = QuantileSketch(error=sketch_error)
+        for start in range(0, len(values), chunksize):
+            sketch.update(values[start:start + chunksize])
+        q01, q99 = sketch.quantile(0.01), sketch.quantile(0.99)
+        self.logger.info(f'{column}: quantiles from sketch, guaranteed rank error <= {sketch.rank_error:.5f} (target {sketch_error})')
+        if compare_exact:
+            self.compare_exact_bounds(column, values, (q01, q99))
+        return q01, q99
+
+    def compare_exact_bounds(self, column: str, values: np.ndarray, bounds: tuple[float, float]):
+        # Exact quantile and actual rank of the sketch bounds. A value repeated in the data covers a range of ranks,
+        # rank error is the distance of q from that range (0 when q falls inside it)
+        for q, estimate in zip((0.01, 0.99), bounds):
+            exact = np.quantile(values, q)
+            low, high = (values < estimate).mean(), (values <= estimate).mean()
+            self.logger.info(f'{column}: q{q}: sketch = {estimate:.4f}, exact = {exact:.4f}, '
+                             f'ranks of sketch value = [{low:.5f}, {high:.5f}], rank error = {max(low - q, q - high, 0):.5f}')
+
+    def filter_outliers(self, df, column: str, q01: float, q99: float):
+        # Single pass over the column: counts, non-positive filter, outlier flag and clipping from the same masks
+        values = df[column].to_numpy()
+        positive = values > 0
+        above = values > q99
+        counts = {'above': int(above.sum()), 'below': int((values < q01).sum()), 'negative_zero': int((~positive).sum())}
+
+        was_column_outlier = f'was_{column}_outlier'
+        df = df[positive].copy()
+        df[was_column_outlier] = above[positive].astype('int8')
+        df[column] = df[column].clip(0, q99)
+        return df, counts
+
+    def outliers_filtration(self, df, column: str, sketch_error: float | None = None, compare_exact: bool = False):
         self.logger.info(f'\n\n Starting Outliers Filtration for {column} : \n')
 
         # Column feature filtration:
-        q99 = df[column].quantile(0.99)
-        q01 = df[column].quantile(0.01)
-        count_above = df[df[column] > q99].shape[0]
-        count_below = df[df[column] < q01].shape[0]
-        self.logger.info(f'{column}: 99th percentile = {q99:.2f}, amount of outliers above = {count_above}')
-        self.logger.info(f'{column}: 1st percentile = {q01:.2f}, amount of outliers below = {count_below}')
+        q01, q99 = self.outlier_bounds(df, column, sketch_error=sketch_error, compare_exact=compare_exact)
+        df, counts = self.filter_outliers(df, column, q01, q99)
+        self.logger.info(f"{column}: 99th percentile = {q99:.2f}, amount of outliers above = {counts['above']}")
+        self.logger.info(f"{column}: 1st percentile = {q01:.2f}, amount of outliers below = {counts['below']}")
 
         # Column negatives
-        df_negative_zero = df[df[column] <= 0].shape[0]
-        self.logger.info(f'Amount of observations with zero value of {column} column or below: {df_negative_zero}')
-        df = df[df[column] > 0].copy()
+        self.logger.info(f"Amount of observations with zero value of {column} column or below: {counts['negative_zero']}")
         self.logger.info('Observations with zero or negative values have been removed')
 
         # Column high values - clipping and marking
         was_column_outlier = f'was_{column}_outlier'
-        df[was_column_outlier] = (df[column] > q99).astype('int8')
-        df[column] = df[column].clip(0, q99)
         self.logger.info(f"{column} outliers have been marked as '{was_column_outlier}' binary feature")
         self.logger.info(f'Observations higher than 99th {column} percentile have been clipped to upper bound: {q99}\n')
         return df
 
     def normalize_shop_ids(self, df):
         self.logger.info('Starting to check duplicated shops')
-        replacements = {10: 11, 1: 58, 0: 57, 40: 39}
-        df['shop_id'] = df['shop_id'].replace(replacements)
+        df['shop_id'] = df['shop_id'].replace(self.shop_replacements)
         self.logger.info('Duplicated shops have been replaced')
         self.logger.info(f'Amount of duplicates after dicts similar shops replacement : {df.duplicated().sum()}')
         self.logger.info('Grouping duplicated shops and sum item_cnt_value...')
@@ -55,16 +96,93 @@ class ETL_pipeline():
         self.logger.info(f"Dropped {dup_count} duplicated rows, cols are : {subset_dup}")
         return sales
 
-    def transform(self, sales):
+    def pack_keys(self, columns: list[np.ndarray]) -> list[np.ndarray]:
+        # Mixed-radix packing of order-preserving codes: tuple order == numeric order of the packed keys.
+        # A new int64 key is started whenever the product of cardinalities would overflow.
+        keys, packed, radix = [], None, 1
+        for values in columns:
+            codes, uniques = pd.factorize(values, sort=True, use_na_sentinel=False)
+            if packed is not None and radix * len(uniques) >= 2 ** 62:
+                keys.append(packed)
+                packed, radix = None, 1
+            packed = codes.astype(np.int64) if packed is None else packed * len(uniques) + codes
+            radix *= len(uniques)
+        keys.append(packed)
+        return keys
+
+    def dedup_aggregate_fused(self, sales: pd.DataFrame) -> tuple[pd.DataFrame, dict]:
+        '''
+        duplicates_filtration + normalize_shop_ids in one sort pass over compact integer keys.
+
+        (day number, date_block_num, normalized shop, item, price code, count code, original shop) are packed
+        into int64 keys and sorted once. In this order exact duplicates, duplicates after shop replacement and
+        groups to sum are all runs of adjacent rows, distinguished by how many leading fields are equal.
+        Result rows and order are the same as groupby(['date', 'date_block_num', 'shop_id', 'item_id', 'item_price']).
+        '''
+        days = sales['date'].to_numpy().astype('datetime64[D]').astype(np.int32)
+        original_shops = sales['shop_id'].to_numpy()
+        shops = pd.Series(original_shops).replace(self.shop_replacements).to_numpy()
+        items = sales['item_id'].to_numpy()
+        prices = sales['item_price'].to_numpy()
+        item_counts = sales['item_cnt_day'].to_numpy()
+
+        # Prefixes: group = first 5 fields, after replacement = + count, exact = + original shop
+        group_keys = self.pack_keys([days, sales['date_block_num'].to_numpy(), shops, items, prices])
+        count_codes = pd.factorize(item_counts, sort=True, use_na_sentinel=False)[0]
+        shop_codes = pd.factorize(original_shops, sort=True, use_na_sentinel=False)[0]
+        order = np.lexsort([shop_codes, count_codes] + group_keys[::-1])
+
+        def starts(*keys):
+            # True where the row differs from the previous row of the sorted order in any of keys
+            new = np.zeros(len(order), dtype=bool)
+            new[:1] = True
+            for key in keys:
+                key = key[order]
+                new[1:] |= key[1:] != key[:-1]
+            return new
+
+        new_exact = starts(*group_keys, count_codes, shop_codes)
+        new_replaced = starts(*group_keys, count_codes)
+        new_group = starts(*group_keys)
+        counts = {
+            'duplicates': int((~new_exact).sum()),
+            'duplicates_after_replacement': int((~new_replaced[new_exact]).sum()),
+            'duplicates_after_grouping': 0, # groups are unique by construction
+        }
+
+        kept = order[new_exact]
+        group_starts = np.flatnonzero(new_group[new_exact])
+        first = kept[group_starts]
+        result = pd.DataFrame({
+            'date': sales['date'].to_numpy()[first],
+            'date_block_num': sales['date_block_num'].to_numpy()[first],
+            'shop_id': shops[first],
+            'item_id': items[first],
+            'item_price': prices[first],
+            'item_cnt_day': np.add.reduceat(item_counts[kept], group_starts) if len(kept) else item_counts[:0],
+        })
+        return result, counts
+
+    def transform(self, sales, sketch_error: float | None = None, fused: bool = True, compare_exact: bool = False):
 
         # Basic preprocessing
         initial_len = sales.shape[0]
         self.logger.info(f'Initial sales shape: {sales.shape}')
         sales = self.date_conversion(sales)
-        sales = self.duplicates_filtration(sales)
-        sales = self.normalize_shop_ids(sales)
-        sales = self.outliers_filtration(sales, 'item_price')
-        sales = self.outliers_filtration(sales, 'item_cnt_day')
+        if fused:
+            subset_dup = list(sales.columns)
+            sales, counts = self.dedup_aggregate_fused(sales)
+            self.logger.info(f"Dropped {counts['duplicates']} duplicated rows, cols are : {subset_dup}")
+            self.logger.info('Starting to check duplicated shops')
+            self.logger.info('Duplicated shops have been replaced')
+            self.logger.info(f"Amount of duplicates after dicts similar shops replacement : {counts['duplicates_after_replacement']}")
+            self.logger.info('Grouping duplicated shops and sum item_cnt_value...')
+            self.logger.info(f"Number of duplicates after grouping : {counts['duplicates_after_grouping']}")
+        else:
+            sales = self.duplicates_filtration(sales)
+            sales = self.normalize_shop_ids(sales)
+        sales = self.outliers_filtration(sales, 'item_price', sketch_error=sketch_error, compare_exact=compare_exact)
+        sales = self.outliers_filtration(sales, 'item_cnt_day', sketch_error=sketch_error, compare_exact=compare_exact)
 
         # Resetting indexes and evalueate overall preprocessing
         sales = sales.reset_index(drop=True)
@@ -86,17 +204,169 @@ class ETL_pipeline():
         self.logger.info('Data loaded successfully')
         return sales
 
-    def run(self, validator_object=None, validation_schema=None, dry_run: bool=True):
+    # Streaming mode: frames are bounded by chunk size and the largest month, not by file size. Outlier bounds come from
+    # merged per-month sketches (O(1/error) values); exact bounds (exact_bounds=True) keep item_price and item_cnt_day
+    # of every row (12 bytes per row)
+    streaming_sketch_error = 0.001
+
+    # item_price stays float64: float32 would change prices (227.7 -> 227.6999969482422) used as dedup/grouping keys
+    # and for outlier quantiles. Counts are small integers, exact in float32.
+    sales_dtypes = {'date': 'object', 'date_block_num': 'int16', 'shop_id': 'int16', 'item_id': 'int32',
+                    'item_price': 'float64', 'item_cnt_day': 'float32'}
+    cleaned_dtypes = {'date_block_num': 'int64', 'shop_id': 'int64', 'item_id': 'int64',
+                      'item_price': 'float64', 'item_cnt_day': 'float64'} # same output as in-memory transform
+
+    def extract_chunks(self, chunksize: int):
+        return pd.read_csv(self.config.get('sales'), dtype=self.sales_dtypes, chunksize=chunksize)
+
+    def spill_by_month(self, chunksize: int) -> dict[int, Path]:
+        # Pass 1: typed chunks with parsed dates are spilled into one parquet file per month.
+        # All dedup/grouping keys contain the date, so rows of different months never collide.
+        spill_dir = Path(self.config.get('etl_spill'))
+        spill_dir.mkdir(parents=True, exist_ok=True)
+        writers, paths, rows = {}, {}, 0
+        for chunk in self.extract_chunks(chunksize):
+            chunk['date'] = pd.to_datetime(chunk['date'], format='%d.%m.%Y')
+            rows += len(chunk)
+            for month, month_chunk in chunk.groupby('date_block_num', sort=False):
+                table = pa.Table.from_pandas(month_chunk, preserve_index=False)
+                if month not in writers:
+                    paths[month] = spill_dir / f'raw_month_{month}.parquet'
+                    writers[month] = pq.ParquetWriter(paths[month], table.schema)
+                writers[month].write_table(table)
+        for writer in writers.values():
+            writer.close()
+        self.logger.info(f'Read {rows} rows in chunks of {chunksize}, dates parsed per chunk, spilled into {len(paths)} months')
+        return dict(sorted(paths.items()))
+
+    def normalize_month(self, sales: pd.DataFrame, stats: dict) -> pd.DataFrame:
+        # duplicates_filtration + normalize_shop_ids for one month, counts are accumulated in stats
+        sales, counts = self.dedup_aggregate_fused(sales)
+        for key, value in counts.items():
+            stats[key] += value
+        return sales
+
+    def run_streaming(self, validator_object=None, validation_schema=None, dry_run: bool=True, chunksize: int=1_000_000,
+                      sketch_error: float | None = None, exact_bounds: bool = False, compare_exact: bool = False):
+        '''
+        Three passes over month spill files (see docs/etl.md). Frames in memory are bounded by `chunksize` and the largest
+        month. Outlier bounds come from merged per-month sketches (`sketch_error`, default `streaming_sketch_error`).
+        exact_bounds=True gives the same output as transform() but concatenates item_price and item_cnt_day of all rows,
+        so that part grows with the file. compare_exact=True keeps the values too, to log the rank error of every sketch bound.
+        '''
+        sketch_error = None if exact_bounds else (sketch_error or self.streaming_sketch_error)
+        self.logger.info(f'\n\n\n=== ETL process started (streaming, chunksize={chunksize}) ===')
+        raw_months = self.spill_by_month(chunksize)
+
+        # Pass 2: dedup + shop normalization month by month, only columns for outlier bounds are kept
+        stats = {'duplicates': 0, 'duplicates_after_replacement': 0, 'duplicates_after_grouping': 0}
+        normalized_months, prices, counts = {}, [], []
+        keep_values = sketch_error is None or compare_exact
+        price_values, count_values = [], []
+        for month, path in raw_months.items():
+            sales = self.normalize_month(pd.read_parquet(path), stats)
+            normalized_months[month] = path.with_name(f'normalized_month_{month}.parquet')
+            sales.to_parquet(normalized_months[month], index=False)
+            # item_cnt_day bounds are taken after item_price filtering, as in transform
+            month_prices = sales['item_price'].to_numpy()
+            month_counts = sales['item_cnt_day'].to_numpy()[month_prices > 0]
+            if keep_values:
+                price_values.append(month_prices)
+                count_values.append(month_counts)
+            if sketch_error is not None: # one sketch per month, merged as they would be across workers
+                prices.append(QuantileSketch(error=sketch_error).update(month_prices))
+                counts.append(QuantileSketch(error=sketch_error).update(month_counts))
+            path.unlink()
+        self.logger.info(f"Dropped {stats['duplicates']} duplicated rows, cols are : {list(self.sales_dtypes)}")
+        self.logger.info(f"Amount of duplicates after dicts similar shops replacement : {stats['duplicates_after_replacement']}")
+        self.logger.info(f"Number of duplicates after grouping : {stats['duplicates_after_grouping']}")
+
+        # Outlier bounds over all months
+        bounds = {}
+        for column, parts, values in (('item_price', prices, price_values), ('item_cnt_day', counts, count_values)):
+            values = np.concatenate(values) if keep_values else None
+            if sketch_error is None:
+                bounds[column] = (np.quantile(values, 0.01), np.quantile(values, 0.99))
+            else:
+                sketch = parts[0]
+                for part in parts[1:]:
+                    sketch.merge(part)
+                bounds[column] = (sketch.quantile(0.01), sketch.quantile(0.99))
+                self.logger.info(f'{column}: quantiles from merged sketches, guaranteed rank error <= {sketch.rank_error:.5f}')
+                if compare_exact:
+                    self.compare_exact_bounds(column, values, bounds[column])
+            self.logger.info(f'{column}: 1st percentile = {bounds[column][0]:.2f}, 99th percentile = {bounds[column][1]:.2f}')
+        del prices, counts, price_values, count_values, values
+
+        # Pass 3: filtering, clipping, validation and writing row group by row group
+        writer, rows = None, 0
+        outliers = {column: {'above': 0, 'below': 0, 'negative_zero': 0} for column in bounds}
+        for month, path in normalized_months.items():
+            sales = pd.read_parquet(path)
+            for column, (q01, q99) in bounds.items():
+                sales, counts = self.filter_outliers(sales, column, q01, q99)
+                outliers[column] = {k: outliers[column][k] + v for k, v in counts.items()}
+            sales = sales.astype(self.cleaned_dtypes).reset_index(drop=True)
+
+            if validator_object and validation_schema:
+                sales = validator_object.validate(schema = validation_schema, df = sales, scheme_name=f'sales_cleaned month {month}')
+            if not dry_run:
+                table = pa.Table.from_pandas(sales, preserve_index=False)
+                if writer is None:
+                    Path(self.config.get('cleaned_dir')).mkdir(parents=True, exist_ok=True)
+                    writer = pq.ParquetWriter(self.config.get('cleaned_parquet'), table.schema)
+                writer.write_table(table)
+            rows += len(sales)
+            path.unlink()
+        for column, counts in outliers.items():
+            self.logger.info(f"{column}: amount of outliers above = {counts['above']}, below = {counts['below']}, "
+                             f"zero or below (removed) = {counts['negative_zero']}")
+        if writer is not None:
+            writer.close()
+            self.logger.info(f"Saved cleaned sales to {self.config.get('cleaned_parquet')}")
+        if not (validator_object and validation_schema):
+            self.logger.warning('!!! No validation schema passed to etl pipeline\
+                                Pipeline made transformations without validation.')
+        self.logger.info(f'Final sales rows: {rows}')
+        self.logger.info("\n=== ETL process finished ===\n\n\n\n")
+
+    def run(self, validator_object=None, validation_schema=None, dry_run: bool=True, cache=None,
+            streaming: bool=False, chunksize: int=1_000_000, sketch_error: float | None = None, fused: bool=True,
+            profiler=None, exact_bounds: bool=False, compare_exact: bool=False):
+        # sketch_error=None: exact outlier bounds in memory, a sketch of streaming_sketch_error in streaming mode
+        # unless exact_bounds=True. compare_exact=True logs exact quantiles and rank errors of sketch bounds
+        if streaming:
+            with profile_stage(profiler, 'etl.streaming', inputs=[self.config.get('sales')],
+                               outputs=[] if dry_run else [self.config.get('cleaned_parquet')]):
+                return self.run_streaming(validator_object, validation_schema, dry_run=dry_run, chunksize=chunksize,
+                                          sketch_error=sketch_error, exact_bounds=exact_bounds, compare_exact=compare_exact)
         self.logger.info('\n\n\n=== ETL process started ===')
-        sales = self.extract()
-        sales = self.transform(sales)
+        sales = None
+        if cache is not None: # StageCache: skip extract and transform if raw sales and code didn't change
+            key = cache.key('etl_transform', inputs=[self.config.get('sales')], params={'sketch_error': sketch_error, 'fused': fused},
+                            code=[type(self), QuantileSketch])
+            with profile_stage(profiler, 'etl.cache_load') as record:
+                sales = cache.load('etl_transform', key)
+                record['rows_out'] = None if sales is None else len(sales)
+        if sales is None:
+            with profile_stage(profiler, 'etl.extract', inputs=[self.config.get('sales')]) as record:
+                sales = self.extract()
+                record['rows_out'] = len(sales)
+            with profile_stage(profiler, 'etl.transform', rows_in=len(sales)) as record:
+                sales = self.transform(sales, sketch_error=sketch_error, fused=fused, compare_exact=compare_exact)
+                record['rows_out'] = len(sales)
+            if cache is not None:
+                cache.save('etl_transform', key, sales)
 
         if validator_object and validation_schema:
-            sales = validator_object.validate(schema = validation_schema, df = sales, scheme_name='sales_cleaned')
+            with profile_stage(profiler, 'etl.validate', rows_in=len(sales)) as record:
+                sales = validator_object.validate(schema = validation_schema, df = sales, scheme_name='sales_cleaned')
+                record['rows_out'] = len(sales)
         else:
             self.logger.warning('!!! No validation schema passed to etl pipeline\
                                 Pipeline made transformations without validation.')
 
         if not dry_run:
-            self.load(sales)
+            with profile_stage(profiler, 'etl.load', rows_in=len(sales), outputs=[self.config.get('cleaned_parquet')]):
+                self.load(sales)
         self.logger.info("\n=== ETL process finished ===\n\n\n\n")
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+INDEX_KEYS = ['shop_id', 'item_id']
+
+
+def pair_keys(shop_ids, item_ids) -> np.ndarray:
+    # (shop_id, item_id) -> one int64, ordered by shop_id first: rows of a shop are one contiguous range
+    return np.asarray(shop_ids, dtype=np.int64) << 32 | np.asarray(item_ids, dtype=np.int64)
+
+
+class FeatureIndex():
+    '''
+    Inference features of the latest month keyed by (shop_id, item_id).
+
+    build() sorts inference.parquet rows by the packed pair key and writes every column as a separate .npy file
+    (config 'feature_index'), with the original row position (the ID of XGB_model.save_prediction) and
+    the categories of categorical columns over the whole month in meta.json. Columns are opened memory-mapped:
+    a lookup is a binary search over the sorted keys and a gather of the found rows, only their pages are read.
+
+    Example:
+        index = FeatureIndex(config, logger).build()        # after Split wrote inference.parquet
+        rows = index.lookup(shop_ids=[5, 5], item_ids=[5037, 5320])
+        rows = index.shops([5, 42])                          # every pair of these shops
+    '''
+
+    def __init__(self, config, logger):
+        self.config = config
+        self.logger = logger
+        self.path = Path(config.get('feature_index'))
+        self.meta = None
+        self.arrays = {}
+
+    def build(self, categorical: list[str] = ['shop_id', 'item_id', 'item_category_id', 'city']):
+        self.logger.info(f"Building feature index from {self.config.get('inference')}...")
+        df = pd.read_parquet(self.config.get('inference'))
+        keys = pair_keys(df['shop_id'], df['item_id'])
+        order = np.argsort(keys, kind='stable')
+        if len(keys) and (np.diff(keys[order]) == 0).any():
+            raise ValueError('Inference data has duplicated (shop_id, item_id) pairs, index can not be built')
+
+        temp = self.path.with_name(self.path.name + '.tmp')
+        shutil.rmtree(temp, ignore_errors=True)
+        temp.mkdir(parents=True)
+        np.save(temp / '__key.npy', keys[order])
+        np.save(temp / '__id.npy', order.astype(np.int64))
+        for column in df.columns:
+            np.save(temp / f'{column}.npy', df[column].to_numpy()[order])
+        meta = {
+            'rows': len(df),
+            'columns': list(df.columns),
+            'categories': {c: np.sort(df[c].unique()).tolist() for c in categorical if c in df.columns},
+        }
+        with open(temp / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        shutil.rmtree(self.path, ignore_errors=True)
+        temp.rename(self.path)
+
+        self.meta, self.arrays = None, {}
+        self.logger.info(f'Feature index saved to {self.path}: {len(df)} rows, {len(df.columns)} columns')
+        return self.open()
+
+    def open(self):
+        if self.meta is None:
+            with open(self.path / 'meta.json', encoding='utf-8') as f:
+                self.meta = json.load(f)
+        return self
+
+    def array(self, name: str) -> np.ndarray:
+        # Memory-mapped column, opened on first use
+        if name not in self.arrays:
+            self.arrays[name] = np.load(self.path / f'{name}.npy', mmap_mode='r')
+        return self.arrays[name]
+
+    def categories(self) -> dict[str, list]:
+        return self.open().meta['categories']
+
+    def rows(self, positions: np.ndarray, columns: list[str] | None = None) -> pd.DataFrame:
+        # Gathers sorted-order `positions` from the memory-mapped columns, 'ID' is the row position in inference.parquet
+        columns = columns or self.open().meta['columns']
+        positions = np.asarray(positions, dtype=np.int64)
+        frame = pd.DataFrame({column: self.array(column)[positions] for column in columns})
+        frame.insert(0, 'ID', self.array('__id')[positions])
+        return frame
+
+    def lookup(self, shop_ids, item_ids, columns: list[str] | None = None) -> pd.DataFrame:
+        # Rows of the requested pairs in request order, pairs missing from the month are skipped (logged)
+        keys = self.array('__key')
+        wanted = pair_keys(shop_ids, item_ids)
+        positions = np.minimum(np.searchsorted(keys, wanted), max(len(keys) - 1, 0))
+        found = keys[positions] == wanted if len(keys) else np.zeros(len(wanted), dtype=bool)
+        if not found.all():
+            self.logger.warning(f'!!! {int((~found).sum())} of {len(wanted)} pairs are not in the feature index')
+        return self.rows(positions[found], columns)
+
+    def shops(self, shop_ids, columns: list[str] | None = None) -> pd.DataFrame:
+        # Every pair of `shop_ids`: each shop is one contiguous range of the sorted keys
+        keys = self.array('__key')
+        shop_ids = np.asarray(shop_ids, dtype=np.int64)
+        starts = np.searchsorted(keys, shop_ids << 32)
+        ends = np.searchsorted(keys, (shop_ids + 1) << 32)
+        positions = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)]) if len(shop_ids) \
+            else np.empty(0, dtype=np.int64)
+        return self.rows(positions, columns)
@@ -0,0 +1,107 @@
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+TEST_MONTH = 34
+
+
+class FeatureMatrix():
+    '''
+    Model features as preallocated column-major float32 matrices, the matrix-oriented output of BuildFeatures.
+
+    build() allocates train_x (months before 34) and inference_x (month 34) as Fortran-order float32 .npy files
+    sized rows x selected features (config 'feature_matrix'), plus train_y, and writes every selected column of
+    full_df straight into its column of the memory-mapped matrix. Categorical columns are stored as category codes,
+    categories (sorted values of the part, as astype('category') of XGB_model.select_features) go to meta.json
+    with the feature names and XGBoost feature types. Rows are in month order, as Split writes them.
+
+    XGBoost reads the matrices through the array interface (strided float32, no conversion), so
+    xgb.QuantileDMatrix(matrix.array('train_x'), ...) is built without another copy of the features:
+    no parquet round-trip, no pandas frame, no astype('category').
+
+    Example:
+        FeatureMatrix(config, logger).build(full_df, features=config.get_xgb('important_features'))
+        matrix = FeatureMatrix(config, logger).open()
+        X, y = matrix.array('train_x'), matrix.array('train_y')
+    '''
+
+    def __init__(self, config, logger):
+        self.config = config
+        self.logger = logger
+        self.path = Path(config.get('feature_matrix'))
+        self.meta = None
+        self.arrays = {}
+
+    def build(self, full_df, features: list[str], categorical: list[str] = ['shop_id', 'item_id', 'item_category_id', 'city'],
+              target: str = 'target'):
+        # full_df: pandas DataFrame or pyarrow Table (both return numpy from frame[column].to_numpy())
+        columns = full_df.column_names if hasattr(full_df, 'column_names') else list(full_df.columns)
+        missing = [column for column in [*features, target, 'date_block_num'] if column not in columns]
+        if missing:
+            raise ValueError(f'Columns {missing} are not in full_df, feature matrix can not be built')
+        months = np.asarray(full_df['date_block_num'].to_numpy())
+        order = np.argsort(months, kind='stable') # month order, as the partitioned features store is read by Split
+        positions = {'train': order[months[order] != TEST_MONTH], 'inference': order[months[order] == TEST_MONTH]}
+        self.logger.info(f"Building feature matrix: {len(features)} features, {len(positions['train'])} train and "
+                         f"{len(positions['inference'])} inference rows...")
+
+        temp = self.path.with_name(self.path.name + '.tmp')
+        shutil.rmtree(temp, ignore_errors=True)
+        temp.mkdir(parents=True)
+        matrices = {part: open_memmap(temp / f'{part}_x.npy', mode='w+', dtype=np.float32, shape=(len(rows), len(features)),
+                                      fortran_order=True) for part, rows in positions.items()}
+        categories = {part: {} for part in positions}
+        for j, column in enumerate(features):
+            values = full_df[column].to_numpy()
+            for part, rows in positions.items():
+                part_values = values[rows]
+                if column in categorical: # codes of the sorted categories of this part
+                    categories[part][column] = np.unique(part_values).tolist()
+                    part_values = np.searchsorted(categories[part][column], part_values)
+                matrices[part][:, j] = part_values
+            del values
+        train_y = open_memmap(temp / 'train_y.npy', mode='w+', dtype=np.float32, shape=(len(positions['train']),))
+        train_y[:] = full_df[target].to_numpy()[positions['train']]
+        for array in [*matrices.values(), train_y]:
+            array.flush()
+        del matrices, train_y
+
+        meta = {
+            'features': list(features),
+            'feature_types': ['c' if column in categorical else 'q' for column in features],
+            'rows': {part: len(rows) for part, rows in positions.items()},
+            'categories': categories,
+        }
+        with open(temp / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        shutil.rmtree(self.path, ignore_errors=True)
+        temp.rename(self.path)
+
+        self.meta, self.arrays = None, {}
+        size_mb = sum(f.stat().st_size for f in self.path.glob('*.npy')) / 1024 ** 2
+        self.logger.info(f'Feature matrix saved to {self.path}: {size_mb:.1f} MB')
+        return self.open()
+
+    def open(self):
+        if self.meta is None:
+            with open(self.path / 'meta.json', encoding='utf-8') as f:
+                self.meta = json.load(f)
+        return self
+
+    def array(self, name: str) -> np.ndarray:
+        # 'train_x', 'train_y' or 'inference_x', memory-mapped on first use
+        if name not in self.arrays:
+            self.arrays[name] = np.load(self.path / f'{name}.npy', mmap_mode='r')
+        return self.arrays[name]
+
+    def features(self) -> list[str]:
+        return self.open().meta['features']
+
+    def feature_types(self) -> list[str]:
+        return self.open().meta['feature_types']
+
+    def categories(self, part: str = 'train') -> dict[str, list]:
+        return self.open().meta['categories'][part]
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+PARTITION_COLUMN = 'date_block_num'
+ROW_GROUP_SIZE = 256 * 1024 # rows, ~1 row group per 256k rows inside every month file
+
+partitioning = ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.int32())]), flavor='hive')
+
+
+def write_features(df: pd.DataFrame | pa.Table, path: Path, row_group_size: int = ROW_GROUP_SIZE):
+    '''
+    Writes features as a dataset partitioned by date_block_num (path/date_block_num=N/part-0.parquet).
+    Only the months present in `df` are replaced, other partitions are kept.
+    '''
+    if isinstance(df, pa.Table):
+        table = df
+    else: # from_pandas shares numeric buffers with df: the dataset writer gets a copy in Arrow-owned memory,
+          # writing pandas-owned buffers aborts the interpreter at exit ("terminate called without an active exception")
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = pa.Table.from_batches([batch.copy_to(pa.default_cpu_memory_manager()) for batch in table.to_batches()],
+                                      schema=table.schema)
+    table = table.set_column(table.schema.get_field_index(PARTITION_COLUMN), PARTITION_COLUMN,
+                             table[PARTITION_COLUMN].cast(pa.int32()))
+    ds.write_dataset(table, Path(path), format='parquet', partitioning=partitioning,
+                     max_rows_per_group=row_group_size, min_rows_per_group=min(row_group_size, 64 * 1024),
+                     existing_data_behavior='delete_matching')
+
+
+def features_dataset(path: Path) -> ds.Dataset:
+    # Month files in numeric month order (directory listing is lexicographic: 1, 10, 11, ..., 2)
+    dataset = ds.dataset(Path(path), format='parquet', partitioning=partitioning)
+    month_of = lambda file: int(Path(file).parent.name.split('=')[1])
+    return ds.dataset(sorted(dataset.files, key=month_of), format='parquet',
+                      partitioning=partitioning, partition_base_dir=str(Path(path)))
+
+
+def features_columns(path: Path) -> list[str]:
+    # Original column order: partition column goes first as it was written by BuildFeatures
+    names = features_dataset(path).schema.names
+    return [PARTITION_COLUMN] + [c for c in names if c != PARTITION_COLUMN]
+
+
+def read_features(path: Path, columns: list[str] | None = None, months: list[int] | None = None,
+                  exclude_months: list[int] | None = None, filter: ds.Expression | None = None) -> pd.DataFrame:
+    '''
+    Reads the partitioned features store with column projection and partition/predicate pushdown:
+    only month directories matching `months`/`exclude_months` are opened, only `columns` are decoded,
+    `filter` (pyarrow expression) is additionally pushed down to row group statistics.
+    '''
+    expression = filter
+    if months is not None:
+        month_filter = ds.field(PARTITION_COLUMN).isin(list(months))
+        expression = month_filter if expression is None else expression & month_filter
+    if exclude_months is not None:
+        month_filter = ~ds.field(PARTITION_COLUMN).isin(list(exclude_months))
+        expression = month_filter if expression is None else expression & month_filter
+
+    columns = columns or features_columns(path)
+    table = features_dataset(path).to_table(columns=columns, filter=expression)
+    return table.to_pandas()
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+MIN_ZERO_SHARE = 0.5 # quantitative columns with at least this share of zeros are stored sparse
+CHUNK_ROWS = 1 << 18
+
+
+def dense_block(X, start: int, stop: int) -> np.ndarray:
+    # Rows start:stop as a C-order float32 block: a FeatureMatrix array or a frame of select_features() (categories -> codes)
+    if isinstance(X, pd.DataFrame):
+        block = X.iloc[start:stop]
+        columns = [block[c].cat.codes.to_numpy() if isinstance(block[c].dtype, pd.CategoricalDtype) else block[c].to_numpy() \
+                   for c in block.columns]
+        return np.column_stack(columns).astype(np.float32) if columns else np.empty((stop - start, 0), dtype=np.float32)
+    return np.ascontiguousarray(X[start:stop], dtype=np.float32)
+
+
+def zero_shares(X: np.ndarray) -> np.ndarray:
+    # Share of zeros of every column, one column of the memory-mapped matrix at a time
+    if not len(X):
+        return np.zeros(X.shape[1])
+    return np.array([np.count_nonzero(X[:, j] == 0) / len(X) for j in range(X.shape[1])])
+
+
+def sparse_columns(X: np.ndarray, features: list[str], feature_types: list[str], min_zero_share: float = MIN_ZERO_SHARE) -> list[str]:
+    # Zero-dominated quantitative columns; categorical ones stay dense, code 0 is a category and not a missing value
+    shares = zero_shares(X)
+    return [f for f, t, share in zip(features, feature_types, shares) if t != 'c' and share >= min_zero_share]
+
+
+def to_csr(X, sparse_mask: np.ndarray, chunk_rows: int = CHUNK_ROWS) -> 'scipy.sparse.csr_matrix':
+    '''
+    float32 CSR matrix of X where zeros of the `sparse_mask` columns are not stored, every other value is (zeros too).
+
+    XGBoost treats entries missing from a sparse matrix as missing values: a zero of a sparse column follows
+    the default direction learned for missing values, a stored zero of a dense column is compared as a value.
+    Built in row chunks, X is never densified as a whole (a memory-mapped matrix is read chunk by chunk).
+    scipy is an optional dependency (dev extras), it is imported only here, when a sparse model is trained or used.
+    '''
+    try:
+        from scipy import sparse
+    except ImportError as e:
+        raise ImportError("train_data='sparse' needs scipy: pip install scipy") from e
+    n_rows, n_columns = X.shape
+    keep = ~np.asarray(sparse_mask, dtype=bool)
+    data, indices, indptr = [], [], [np.zeros(1, dtype=np.int64)]
+    stored = 0
+    for start in range(0, n_rows, chunk_rows):
+        block = dense_block(X, start, min(start + chunk_rows, n_rows))
+        rows, columns = np.nonzero((block != 0) | keep)
+        data.append(block[rows, columns])
+        indices.append(columns.astype(np.int32))
+        indptr.append(stored + np.cumsum(np.bincount(rows, minlength=len(block))))
+        stored += len(rows)
+        del block, rows, columns
+    return sparse.csr_matrix((np.concatenate(data) if data else np.empty(0, dtype=np.float32),
+                              np.concatenate(indices) if indices else np.empty(0, dtype=np.int32),
+                              np.concatenate(indptr)), shape=(n_rows, n_columns))
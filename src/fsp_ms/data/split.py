@@ -1,14 +1,29 @@
+from __future__ import annotations
+
 import pandas as pd
 
+from .features_store import read_features, ROW_GROUP_SIZE
+from .feature_index import FeatureIndex
+from ..utils.profiler import profile_stage
+
 class Split():
 
     def __init__(self, config, logger):
         self.config = config
         self.logger = logger
-    def extract(self):
+    def extract(self, columns: list[str] | None = None, months: list[int] | None = None, exclude_months: list[int] | None = None):
         self.logger.info('Extracting full_df to split it...')
-        full_df = pd.read_parquet(self.config.get('features'), engine='pyarrow')
-        self.logger.info('Data has been extracted successfully')
+        dataset_path = self.config.get('features_dataset')
+        if dataset_path.exists(): # partitioned store: only needed months and columns are read
+            full_df = read_features(dataset_path, columns=columns, months=months, exclude_months=exclude_months)
+        else:
+            filters = []
+            if months is not None:
+                filters.append(('date_block_num', 'in', list(months)))
+            if exclude_months is not None:
+                filters.append(('date_block_num', 'not in', list(exclude_months)))
+            full_df = pd.read_parquet(self.config.get('features'), engine='pyarrow', columns=columns, filters=filters or None)
+        self.logger.info(f'Data has been extracted successfully, shape: {full_df.shape}')
         return full_df
 
     def split(self,full_df):
@@ -25,14 +40,28 @@ class Split():
 
     def load(self, train_x, train_y, predict):
         self.logger.info(f"Starting to save data to {self.config.get('processed_dir')}...")
-        train_x.to_parquet(self.config.get('train_x'), engine='pyarrow')
-        train_y.to_parquet(self.config.get('train_y'), engine='pyarrow')
-        predict.to_parquet(self.config.get('inference'), engine='pyarrow')
+        # Row groups follow month order of the store, so readers can skip them by statistics
+        train_x.to_parquet(self.config.get('train_x'), engine='pyarrow', row_group_size=ROW_GROUP_SIZE)
+        train_y.to_parquet(self.config.get('train_y'), engine='pyarrow', row_group_size=ROW_GROUP_SIZE)
+        predict.to_parquet(self.config.get('inference'), engine='pyarrow', row_group_size=ROW_GROUP_SIZE)
         self.logger.info('Data for training and prediction has been saved')
 
-    def run(self):
+    def run(self, profiler=None, build_index: bool=False):
         self.logger.info('\n=== SPLITTING process started ===\n')
-        self.load(*self.split(self.extract()))
+        # Train and inference months are read separately, the whole store is never in memory at once
+        source = self.config.get('features_dataset') if self.config.get('features_dataset').exists() else self.config.get('features')
+        with profile_stage(profiler, 'split.train', inputs=[source]) as record:
+            train_x, train_y, _ = self.split(self.extract(exclude_months=[34]))
+            record['rows_out'] = len(train_x)
+        with profile_stage(profiler, 'split.inference') as record:
+            _, _, predict = self.split(self.extract(months=[34]))
+            record['rows_out'] = len(predict)
+        outputs = [self.config.get(key) for key in ('train_x', 'train_y', 'inference')]
+        with profile_stage(profiler, 'split.load', rows_in=len(train_x) + len(predict), outputs=outputs):
+            self.load(train_x, train_y, predict)
+        if build_index: # (shop_id, item_id) -> inference row, for XGB_model.predict_subset
+            with profile_stage(profiler, 'split.feature_index', inputs=[self.config.get('inference')], outputs=[self.config.get('feature_index')]):
+                FeatureIndex(self.config, self.logger).build()
         # full_df = self.extract()
         # train_x, train_y, predict = self.split(full_df)
         # self.load(train_x, train_y, predict)
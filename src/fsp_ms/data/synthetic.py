@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+
+from .etl import ETL_pipeline
+from .feature_matrix import TEST_MONTH
+
+# ETL_pipeline.normalize_shop_ids maps duplicated shops onto ids up to 58, they have to exist in shops.csv
+MIN_SHOPS = max(ETL_pipeline.shop_replacements.values()) + 1
+# BuildFeatures, Split and FeatureMatrix put the test set into month 34: history has to end right before it
+N_MONTHS = TEST_MONTH
+
+
+class SyntheticData():
+    '''
+    Generator of raw input files in the layout Config expects: sales_train.csv, dicts/items.csv,
+    dicts/item_categories.csv, dicts/shops.csv, submission_data/test.csv and sample_submission.csv.
+
+    Defaults are close to the Kaggle dataset (60 shops, 22170 items, 84 categories, 34 months, ~2.9M rows),
+    `scale` multiplies the number of items and sales rows, so the blank schema (shops x items per month)
+    grows linearly with it. Everything is generated offline from `seed`.
+
+    Args:
+        n_shops, n_items, n_categories, n_cities, n_months: sizes of dicts and history, n_shops >= MIN_SHOPS (59),
+            n_months == N_MONTHS (34).
+        rows_per_month: sales rows per month before duplicates are added.
+        item_popularity: Zipf exponent of item popularity, higher -> sparser shop x item matrix.
+        price_median, price_sigma: lognormal price distribution per item (prices vary by +-5% between sales).
+        returns_share: share of rows with item_cnt_day = -1; duplicates_share: share of fully duplicated rows.
+        test_items_share: share of sold items which go into test.csv (with every shop).
+        new_items_share: share of items never sold in the history, they appear in test.csv only.
+
+    Example:
+        SyntheticData(config, logger, scale=0.1).run()
+    '''
+
+    def __init__(self, config, logger, scale: float = 1.0, n_shops: int = 60, n_items: int = 22170, n_categories: int = 84,
+                 n_cities: int = 30, n_months: int = N_MONTHS, rows_per_month: int = 85_000, item_popularity: float = 1.1,
+                 price_median: float = 400.0, price_sigma: float = 1.2, returns_share: float = 0.003,
+                 duplicates_share: float = 0.0001, test_items_share: float = 0.23, new_items_share: float = 0.02,
+                 seed: int = 0):
+        if n_shops < MIN_SHOPS:
+            raise ValueError(f'n_shops={n_shops}: ETL remaps shops {ETL_pipeline.shop_replacements}, '
+                             f'so at least {MIN_SHOPS} shops are needed for the pipeline to accept the data')
+        if n_months != N_MONTHS:
+            raise ValueError(f'n_months={n_months}: the pipeline puts the test set into month {TEST_MONTH}, '
+                             f'history has to have exactly {N_MONTHS} months (0-{N_MONTHS - 1})')
+        self.config = config
+        self.logger = logger
+        self.n_shops = n_shops
+        self.n_items = max(int(n_items * scale), 1)
+        self.n_categories = n_categories
+        self.n_cities = n_cities
+        self.n_months = n_months
+        self.rows_per_month = max(int(rows_per_month * scale), 1)
+        self.item_popularity = item_popularity
+        self.price_median = price_median
+        self.price_sigma = price_sigma
+        self.returns_share = returns_share
+        self.duplicates_share = duplicates_share
+        self.test_items_share = test_items_share
+        self.new_items = np.arange(self.n_items - int(self.n_items * new_items_share), self.n_items) # last item ids
+        self.rng = np.random.default_rng(seed)
+
+    def dicts(self) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        # General category and city are the first word of the name, as BuildFeatures.encode_dicts parses them
+        n_general = max(self.n_categories // 6, 1)
+        item_categories = pd.DataFrame({
+            'item_category_name': [f'General{c % n_general} - Category {c}' for c in range(self.n_categories)],
+            'item_category_id': np.arange(self.n_categories),
+        })
+        items = pd.DataFrame({
+            'item_name': [f'Item {i}' for i in range(self.n_items)],
+            'item_id': np.arange(self.n_items),
+            'item_category_id': self.rng.integers(0, self.n_categories, self.n_items),
+        })
+        shops = pd.DataFrame({
+            'shop_name': [f'City{s % self.n_cities} Shop {s}' for s in range(self.n_shops)],
+            'shop_id': np.arange(self.n_shops),
+        })
+        return items, item_categories, shops
+
+    def sales(self) -> pd.DataFrame:
+        n_rows = self.rows_per_month * self.n_months
+        popularity = 1.0 / np.arange(1, self.n_items + 1) ** self.item_popularity
+        popularity = popularity[self.rng.permutation(self.n_items)]
+        popularity[self.new_items] = 0.0
+        item_prices = np.exp(self.rng.normal(np.log(self.price_median), self.price_sigma, self.n_items)).round(2)
+
+        months = np.repeat(np.arange(self.n_months), self.rows_per_month)
+        # Random calendar day inside every month (date_block_num 0 = January 2013)
+        month_start = pd.to_datetime({'year': 2013 + months // 12, 'month': months % 12 + 1, 'day': 1})
+        days_in_month = month_start.dt.days_in_month.to_numpy()
+        dates = month_start + pd.to_timedelta(self.rng.integers(0, days_in_month), unit='D')
+
+        items = self.rng.choice(self.n_items, size=n_rows, p=popularity / popularity.sum())
+        item_cnt_day = self.rng.geometric(0.7, n_rows).astype(np.float64)
+        item_cnt_day[self.rng.random(n_rows) < self.returns_share] = -1.0
+        sales = pd.DataFrame({
+            'date': dates.dt.strftime('%d.%m.%Y'),
+            'date_block_num': months,
+            'shop_id': self.rng.integers(0, self.n_shops, n_rows),
+            'item_id': items,
+            'item_price': (item_prices[items] * self.rng.choice([0.95, 1.0, 1.05], n_rows, p=[0.1, 0.8, 0.1])).round(2),
+            'item_cnt_day': item_cnt_day,
+        })
+        duplicates = sales.sample(frac=self.duplicates_share, random_state=int(self.rng.integers(2 ** 31)))
+        return pd.concat([sales, duplicates], ignore_index=True)
+
+    def test(self, sales: pd.DataFrame) -> pd.DataFrame:
+        # Every shop x (a sample of items sold in the history + new items), same layout as Kaggle test.csv
+        sold_items = sales['item_id'].unique()
+        n_test_items = max(int(len(sold_items) * self.test_items_share), 1)
+        test_items = np.sort(np.concatenate([self.rng.choice(sold_items, size=n_test_items, replace=False), self.new_items]))
+        shop_ids = np.repeat(np.arange(self.n_shops), len(test_items))
+        return pd.DataFrame({'ID': np.arange(len(shop_ids)), 'shop_id': shop_ids, 'item_id': np.tile(test_items, self.n_shops)})
+
+    def run(self):
+        self.logger.info(f'Generating synthetic data: {self.n_shops} shops, {self.n_items} items, '
+                         f'{self.n_months} months, {self.rows_per_month} rows per month...')
+        items, item_categories, shops = self.dicts()
+        sales = self.sales()
+        test = self.test(sales)
+
+        for key in ('items', 'item_categories', 'shops', 'test', 'submission'):
+            self.config.get(key).parent.mkdir(parents=True, exist_ok=True)
+        sales.to_csv(self.config.get('sales'), index=False)
+        items.to_csv(self.config.get('items'), index=False)
+        item_categories.to_csv(self.config.get('item_categories'), index=False)
+        shops.to_csv(self.config.get('shops'), index=False)
+        test.to_csv(self.config.get('test'), index=False)
+        test[['ID']].assign(item_cnt_month=0.5).to_csv(self.config.get('submission'), index=False)
+        self.logger.info(f"Synthetic data written to {self.config.get('raw_dir')}: {len(sales)} sales rows, {len(test)} test rows")
+        return sales, items, item_categories, shops, test
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .cumulative import cumulative_stats
+from .lag_cube import LagCube
+from .dtype_plan import planned_dtype
+from ..data.features_store import write_features
+from ..utils.profiler import profile_stage
+
+TEST_MONTH = 34 # date_block_num assigned to the test set in BuildFeatures.concat_test
+
+
+class ArrowFeatures():
+    '''
+    BuildFeatures steps with full_df kept as a pyarrow.Table (BuildFeatures.run(backend='arrow')).
+
+    Group-by aggregations, joins, null filling, flags and deltas run on Arrow compute kernels, which use
+    all cores of the Arrow CPU pool (`threads` sets its size). Adding a feature appends a column to the
+    table; existing columns are never copied. Joins only move the key columns and a row index, and their
+    result is reordered back to full_df order.
+    Sequence features (expanding windows, lags) take zero-copy numpy views of the columns and reuse
+    cumulative_stats and LagCube. Columns, their order, dtypes and values are the same as with the
+    pandas steps, so Split and XGB_model read the same features store.
+    '''
+
+    all_obs_combination_by = ['date_block_num', 'shop_id', 'item_id']
+    month_group_keys = ['item_id', 'shop_id', 'item_category_id', 'general_item_category_name', 'city']
+    aggregating_target_by = [['item_id', 'shop_id'], ['item_id'], ['shop_id']]
+
+    def __init__(self, config, logger, build_features, threads: int | None = None):
+        self.config = config
+        self.logger = logger
+        self.build_features = build_features # dicts encoding, blank schema and step defaults are shared
+        if threads is not None:
+            pa.set_cpu_count(threads)
+        self.logger.info(f'Arrow backend uses {pa.cpu_count()} threads')
+
+# Helpers:
+
+    def column(self, values: np.ndarray, name: str) -> pa.Array:
+        # numpy result -> Arrow column with the planned dtype, NaN becomes null (as NaN in pandas before fillna).
+        # The buffer is copied into the Arrow pool: a column wrapping numpy memory needs the GIL to be released,
+        # which aborts the interpreter at exit when an Arrow writer thread drops the last reference.
+        dtype = planned_dtype(name)
+        values = values if dtype is None else values.astype(dtype, copy=False)
+        return pa.array(values, from_pandas=True).copy_to(pa.default_cpu_memory_manager())
+
+    def numpy(self, table: pa.Table, name: str) -> np.ndarray:
+        # Zero-copy view of single-chunk columns without nulls, nulls become NaN (copy) otherwise
+        return table[name].to_numpy()
+
+    def lookup(self, table: pa.Table, right: pa.Table, keys: list[str]) -> pa.Table:
+        # Left join of `right` onto table rows: only keys and a row index go through the join,
+        # the result holds the non-key columns of `right` in table row order (null where no match).
+        left = pa.table({**{key: table[key] for key in keys}, '__row': pa.array(np.arange(len(table), dtype=np.int64))})
+        right = right.cast(pa.schema([right.schema.field(k).with_type(table.schema.field(k).type) if k in keys \
+                                      else right.schema.field(k) for k in right.column_names]))
+        joined = left.join(right, keys=keys, join_type='left outer', use_threads=True)
+        joined = joined.drop_columns(keys).take(pc.sort_indices(joined['__row']))
+        # One chunk per column, as every other column of table: numpy views stay zero-copy
+        return joined.drop_columns(['__row']).combine_chunks()
+
+    def append(self, table: pa.Table, columns: pa.Table | dict) -> pa.Table:
+        columns = columns if isinstance(columns, dict) else dict(zip(columns.column_names, columns.columns))
+        for name, values in columns.items():
+            table = table.append_column(name, values)
+        return table
+
+    def cast_planned(self, table: pa.Table, names: list[str]) -> pa.Table:
+        for name in names:
+            dtype = planned_dtype(name)
+            if dtype is not None and table.schema.field(name).type != pa.from_numpy_dtype(dtype):
+                table = table.set_column(table.schema.get_field_index(name), name, table[name].cast(pa.from_numpy_dtype(dtype)))
+        return table
+
+# full_schema:
+
+    def sales_aggregation(self, sales: pa.Table) -> pa.Table:
+        self.logger.info('Aggregating sales to month time dimension (arrow)...')
+        aggregated = sales.group_by(self.all_obs_combination_by, use_threads=True).aggregate([
+            ('item_price', 'mean'), ('item_cnt_day', 'sum'), ('was_item_price_outlier', 'mean'), ('was_item_cnt_day_outlier', 'mean')])
+        aggregated = aggregated.rename_columns([{'item_price_mean': 'item_price', 'item_cnt_day_sum': 'target',
+                                                 'was_item_price_outlier_mean': 'was_item_price_outlier',
+                                                 'was_item_cnt_day_outlier_mean': 'was_item_cnt_day_outlier'}.get(c, c) \
+                                                for c in aggregated.column_names])
+        return self.cast_planned(aggregated, ['item_price', 'target', 'was_item_price_outlier', 'was_item_cnt_day_outlier'])
+
+    def full_schema(self, sales: pd.DataFrame, items, items_categories, shops, test) -> pa.Table:
+        bf = self.build_features
+        self.logger.info('Creating a common table with test, all items, and sales by months (arrow):')
+        table = pa.Table.from_pandas(bf.blank_schema(sales), preserve_index=False)
+        sales_table = pa.Table.from_pandas(sales, preserve_index=False)
+
+        # merge_df_aggregated: left join + fillna(0)
+        aggregated = self.lookup(table, self.sales_aggregation(sales_table), self.all_obs_combination_by)
+        table = self.append(table, {name: pc.fill_null(aggregated[name], 0) for name in aggregated.column_names})
+
+        # concat_test: test rows get nulls in aggregated columns
+        test_table = pa.table({'date_block_num': pa.array(np.full(len(test), TEST_MONTH, dtype=np.int32)),
+                               'shop_id': pa.array(test['shop_id'].to_numpy(dtype=np.int32)),
+                               'item_id': pa.array(test['item_id'].to_numpy(dtype=np.int32))})
+        table = pa.concat_tables([table, test_table], promote_options='default').combine_chunks()
+        self.logger.info(f'Concatenated with test, rows: {len(table)}')
+
+        # dicts
+        items, shops, items_categories = bf.encode_dicts(items, shops, items_categories)
+        for right, key in ((items, 'item_id'), (items_categories, 'item_category_id'), (shops, 'shop_id')):
+            table = self.append(table, self.lookup(table, pa.Table.from_pandas(right, preserve_index=False), [key]))
+        sales_table = pa.Table.from_pandas(bf.merge_sales_dicts(sales, items, items_categories, shops), preserve_index=False)
+
+        table = self.month_aggregations(table, sales_table)
+        table = self.was_in_test(table, test)
+        bf.check_memory_budget(len(table), table.column_names)
+        return table
+
+    def month_aggregations(self, table: pa.Table, sales: pa.Table) -> pa.Table:
+        self.logger.info('Starting aggregating target for other features (arrow)...')
+        for key in self.month_group_keys:
+            group_cols = ['date_block_num', key]
+            temp = sales.group_by(group_cols, use_threads=True).aggregate([('item_cnt_day', 'sum'), ('item_cnt_day', 'mean')])
+            temp = temp.rename_columns([{'item_cnt_day_sum': f'target_{key}_total', 'item_cnt_day_mean': f'target_{key}_mean'}.get(c, c) \
+                                        for c in temp.column_names])
+            temp = temp.select(group_cols + [f'target_{key}_total', f'target_{key}_mean'])
+            temp = self.cast_planned(temp, [f'target_{key}_total', f'target_{key}_mean'])
+            table = self.append(table, self.lookup(table, temp, group_cols))
+            self.logger.info(f'Grouped by: {group_cols}')
+        return table
+
+    def was_in_test(self, table: pa.Table, test: pd.DataFrame) -> pa.Table:
+        for key in ('item_id', 'shop_id'):
+            in_test = pc.is_in(table[key], value_set=pa.array(test[key].unique().astype(np.int32)))
+            table = table.append_column(f'{key}_was_in_test', pc.cast(in_test, pa.int8()))
+        self.logger.info('Shops and items which contained in test have been marked')
+        return table
+
+# transform:
+
+    def first_month(self, table: pa.Table) -> pa.Table:
+        table = table.append_column('not_full_historical_data', pc.cast(pc.equal(table['date_block_num'], 0), pa.int8()))
+        first = table.select(['item_id', 'date_block_num']).group_by('item_id', use_threads=True).aggregate([('date_block_num', 'min')])
+        first_month = self.lookup(table, first, ['item_id'])['date_block_num_min']
+        table = table.append_column('first_month_item_id', pc.cast(pc.equal(table['date_block_num'], first_month), pa.int8()))
+        self.logger.info('Items selling in this month first time are marked successfully')
+        return table
+
+    def expanding_window(self, table: pa.Table, windows: list[int] | None = None) -> pa.Table:
+        columns = sorted({key for feature in self.aggregating_target_by for key in feature} | {'date_block_num', 'target'})
+        frame = pd.DataFrame({name: self.numpy(table, name) for name in columns}, copy=False)
+        for feature in self.aggregating_target_by:
+            for window in [None] + list(windows or []):
+                mean, max_ = cumulative_stats(frame, feature, window=window)
+                for stat, values in (('mean', mean), ('max', max_)):
+                    prefix = f'target_aggregated_{stat}_premonthes' if window is None else f'target_aggregated_{stat}_last_{window}_monthes'
+                    name = '_'.join([prefix, *feature])
+                    table = table.append_column(name, self.column(values, name))
+            self.logger.info(f'Expanding window statistics for {feature} have been created')
+        return table
+
+    def year_month(self, table: pa.Table) -> pa.Table:
+        months = self.numpy(table, 'date_block_num')
+        table = table.append_column('month', self.column(months % 12 + 1, 'month'))
+        table = table.append_column('year', self.column(2013 + months // 12, 'year'))
+        return table
+
+    def lags(self, table: pa.Table, additional: list[str] | None = None, shift_range: list[int] | None = None) -> pa.Table:
+        defaults = self.build_features.step_defaults()
+        additional = defaults['additional'] if additional is None else additional
+        shift_range = defaults['shift_range'] if shift_range is None else shift_range
+        shifted_columns = [c for c in table.column_names if 'target' in c] + additional
+
+        keys = pd.DataFrame({name: self.numpy(table, name) for name in self.all_obs_combination_by}, copy=False)
+        lag_cube = LagCube(keys)
+        values = pd.DataFrame({name: self.numpy(table, name) for name in shifted_columns}, copy=False)
+        shifted = lag_cube.lags(values.assign(**keys), shifted_columns, shift_range, fill_value=0)
+        del lag_cube, values
+
+        # fillna(0) + downcast of the pandas backend, then the float32 lag block
+        filled = []
+        for field in table.schema:
+            column = pc.fill_null(table[field.name], 0) if table[field.name].null_count else table[field.name]
+            if pa.types.is_floating(field.type) and field.type != pa.float32():
+                column = column.cast(pa.float32())
+            elif field.type == pa.int64():
+                column = column.cast(pa.int32())
+            filled.append(column)
+        table = pa.table(filled, names=table.column_names)
+        for name in shifted.columns:
+            table = table.append_column(name, self.column(shifted[name].to_numpy(), name))
+        self.logger.info(f'Lags have been created for {shifted_columns}...')
+        return table
+
+    def deltas(self, table: pa.Table, columns_to_delta: list[str] | None = None) -> pa.Table:
+        columns_to_delta = self.build_features.step_defaults()['columns_to_delta'] if columns_to_delta is None else columns_to_delta
+        for target_predict in columns_to_delta:
+            lag_1, lag_2, lag_3 = (table[f'{target_predict}_lag_{n}'] for n in (1, 2, 3))
+            delta_1_2 = pc.subtract(lag_1, lag_2)
+            delta_2_3 = pc.subtract(lag_2, lag_3)
+            predict_1_2 = pc.add(lag_1, delta_1_2)
+            predict_2_3 = pc.add(pc.add(lag_1, delta_2_3), predict_1_2)
+            for suffix, values in (('delta_1_2', delta_1_2), ('delta_2_3', delta_2_3),
+                                   ('predict_1_2', predict_1_2), ('predict_2_3', predict_2_3)):
+                table = table.append_column(f'{target_predict}_{suffix}', values)
+        self.logger.info('Deltas have been created')
+        return table
+
+    def transform_steps(self):
+        return [
+            ('first_month', self.first_month),
+            ('expanding_window', self.expanding_window),
+            ('year_month', self.year_month),
+            ('lags', self.lags),
+            ('deltas', self.deltas),
+        ]
+
+    def transform(self, table: pa.Table, profiler=None) -> pa.Table:
+        for name, step in self.transform_steps():
+            with profile_stage(profiler, f'features.{name}', rows_in=len(table)) as record:
+                table = step(table)
+                record['rows_out'] = len(table)
+        return table
+
+    def check_leakage(self, table: pa.Table, constant_features: set[str]={'target','item_id_was_in_test', 'shop_id_was_in_test','not_full_historical_data'}):
+        test_rows = table.filter(pc.equal(table['date_block_num'], TEST_MONTH))
+        leakage_features = [name for name in table.column_names if name not in constant_features \
+                            and pc.all(pc.equal(test_rows[name], 0)).as_py()]
+        self.logger.info(f'Leakage features were removed, those are : {leakage_features}')
+        return table.drop_columns(leakage_features)
+
+    def output(self, table: pa.Table):
+        write_features(table, self.config.get('features_dataset'))
+        self.logger.info(f"full_df saved as dataset partitioned by date_block_num: {self.config.get('features_dataset')}")
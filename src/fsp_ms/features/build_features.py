@@ -1,17 +1,44 @@
+from __future__ import annotations
+
 import numpy as np
 import pandas as pd
-import itertools
 import tqdm
 import gc
+import inspect
+from functools import partial
+
+from .cumulative import cumulative_stats
+from .lag_cube import LagCube
+from .dtype_plan import apply_dtype_plan, projected_bytes
+from .incremental import IncrementalFeatures
+from .arrow_features import ArrowFeatures
+from .parallel import FeatureFamilies, expanding_family, month_aggregation_family, delta_family, DELTA_LAGS
+from .feature_graph import FeatureGraph
+from ..data.features_store import write_features
+from ..data.feature_matrix import FeatureMatrix
+from ..utils.memory import current_rss_mb, peak_rss_mb, format_mb
+from ..utils.profiler import profile_stage
 
 class BuildFeatures():
-    def __init__(self,config, logger):
+    month_group_keys = ['item_id', 'shop_id', 'item_category_id', 'general_item_category_name', 'city']
+    month_aggregation_functions = {'total': 'sum', 'mean': 'mean'}
+    aggregating_target_by = [['item_id', 'shop_id'], ['item_id'], ['shop_id']]
+
+    def __init__(self,config, logger, memory_budget_gb: float | None = None, on_budget_exceeded: str = 'warn',
+                 deep_memory: bool = False, workers: int = 1):
+        if on_budget_exceeded not in ('warn', 'raise'):
+            raise ValueError(f"Unknown on_budget_exceeded '{on_budget_exceeded}', use 'warn' or 'raise'")
         self.config = config
         self.logger = logger
+        self.memory_budget_gb = memory_budget_gb # projected size of the final full_df, checked once rows are known
+        self.on_budget_exceeded = on_budget_exceeded
+        self.deep_memory = deep_memory # memory_usage(deep=True) walks every object, only worth it with object columns
+        # Independent families of expanding_window, month_aggregations and deltas run in `workers` processes
+        self.families = FeatureFamilies(config, logger, workers=workers)
 
     # Info: size_memory_info(df = full_df, name='full_df')
     def size_memory_info(self, df: pd.DataFrame, name: str = 'current df'):
-        size_in_bytes = df.memory_usage(deep=True).sum()
+        size_in_bytes = df.memory_usage(deep=self.deep_memory).sum()
         size_in_megabytes = size_in_bytes / (1024 ** 2)
         size_in_gigabytes = size_in_bytes / (1024 ** 3)
 
@@ -20,6 +47,39 @@ class BuildFeatures():
                     \nNumber of columns in this table: {df.shape[1]}\n")
     # Probably move to helpers.py
 
+    def step_defaults(self) -> dict:
+        # Default arguments of lags and deltas (shift_range, additional, columns_to_delta), shared with other backends
+        defaults = {}
+        for method in (self.lags, self.deltas):
+            defaults.update({name: p.default for name, p in inspect.signature(method).parameters.items() \
+                             if p.default is not inspect.Parameter.empty})
+        return defaults
+
+    def projected_columns(self, columns: list[str]) -> list[str]:
+        # Columns full_df will have after transform(), derived from the same defaults the steps use
+        lags = deltas = self.step_defaults()
+        columns = list(columns) + ['not_full_historical_data', 'first_month_item_id']
+        for feature in [['item_id', 'shop_id'], ['item_id'], ['shop_id']]:
+            columns += ['_'.join([f'target_aggregated_{stat}_premonthes', *feature]) for stat in ('mean', 'max')]
+        columns += ['month', 'year']
+        shifted_columns = [c for c in columns if 'target' in c] + lags['additional']
+        columns += [f'{c}_lag_{shift}' for shift in lags['shift_range'] for c in shifted_columns]
+        columns += [f'{c}_{suffix}' for c in deltas['columns_to_delta'] for suffix in ('delta_1_2', 'delta_2_3', 'predict_1_2', 'predict_2_3')]
+        return columns
+
+    def check_memory_budget(self, n_rows: int, columns: list[str], selected: list[str] | None = None):
+        # Fail fast (or warn) before the expensive steps if the final frame will not fit into the budget.
+        # With a feature selection the frame holds at most the `selected` closure
+        columns = self.projected_columns(columns) if selected is None else selected
+        projected_gb = projected_bytes(n_rows, columns) / 1024 ** 3
+        self.logger.info(f'Projected size of final full_df: {projected_gb:.2f} GB ({n_rows} rows x {len(columns)} columns)')
+        if self.memory_budget_gb is None or projected_gb <= self.memory_budget_gb:
+            return
+        message = f'Projected full_df size {projected_gb:.2f} GB is over the memory budget of {self.memory_budget_gb:.2f} GB'
+        if self.on_budget_exceeded == 'raise':
+            raise MemoryError(message)
+        self.logger.warning(f'!!! {message}')
+
     def extract(self):
         self.logger.info('Extracting all raw data...')
         # Main dataset
@@ -37,21 +97,37 @@ class BuildFeatures():
         self.logger.info('All raw data has been extracted\n')
         return sales, items, items_categories, shops, test
 
-    def blank_schema(self, sales):
+    def blank_schema(self, sales, sort: bool = False):
         self.logger.info('Creating full schema of items sold in every month for all shops...')
 
         ### Creating full schema of montly sold items for every shop - { df }
         all_obs_combination_by = ['date_block_num', 'shop_id', 'item_id']
-        all_shops_items = []
-
-        for block_num in sales['date_block_num'].unique():
-            unique_shops = sales[sales['date_block_num'] == block_num]['shop_id'].unique()
-            unique_items = sales[sales['date_block_num'] == block_num]['item_id'].unique()
-            all_shops_items.append(np.array(list(itertools.product([block_num], unique_shops, unique_items)),\
-                                            dtype='int32'))
+        months = sales['date_block_num'].unique()
+        shops_by_month = {m: g.to_numpy(dtype='int32') for m, g in \
+                          sales[['date_block_num', 'shop_id']].drop_duplicates().groupby('date_block_num', sort=False)['shop_id']}
+        items_by_month = {m: g.to_numpy(dtype='int32') for m, g in \
+                          sales[['date_block_num', 'item_id']].drop_duplicates().groupby('date_block_num', sort=False)['item_id']}
+
+        # Cartesian product of shops x items is written straight into preallocated arrays (no python tuples)
+        sizes = [len(shops_by_month[m]) * len(items_by_month[m]) for m in months]
+        schema = {col: np.empty(sum(sizes), dtype='int32') for col in all_obs_combination_by}
+        offset = 0
+        for block_num, size in zip(months, sizes):
+            unique_shops = shops_by_month[block_num]
+            unique_items = items_by_month[block_num]
+            schema['date_block_num'][offset:offset + size] = block_num
+            schema['shop_id'][offset:offset + size] = np.repeat(unique_shops, len(unique_items))
+            schema['item_id'][offset:offset + size] = np.tile(unique_items, len(unique_shops))
+            offset += size
+
+        if sort:
+            # Order expected by later lag and window stages: (shop_id, item_id, date_block_num)
+            order = np.lexsort((schema['date_block_num'], schema['item_id'], schema['shop_id']))
+            schema = {col: values[order] for col, values in schema.items()}
+            self.logger.info('Full schema sorted by shop_id, item_id, date_block_num')
 
         # full schema with all unique combinations of month number, shop_id, and item_id for month:
-        df = pd.DataFrame(np.vstack(all_shops_items), columns=all_obs_combination_by, dtype='int32')
+        df = pd.DataFrame(schema, columns=all_obs_combination_by)
         self.logger.info('Full blank schema of items sold in every month for all shops created successfully')
         return df
 
@@ -63,6 +139,7 @@ class BuildFeatures():
                                                             'sum','was_item_price_outlier':'mean', \
                                                                 'was_item_cnt_day_outlier':'mean'})
         aggregated.rename(columns={'item_cnt_day': 'target'}, inplace = True)
+        aggregated = apply_dtype_plan(aggregated)
         # aggregated['target'] = aggregated['target'].clip(0,20)
         # self.logger.info('Clipping target⚒️⚠️🫡')
         self.logger.info('Sales successfully aggregated at the monthly level, item_cnt_month columns marked as "target"')
@@ -82,8 +159,8 @@ class BuildFeatures():
         self.logger.info('Assigned value 34 to date_block_num for the test set')
 
         self.logger.info('Concatenating full schema with test...')
-        full_df = pd.concat([full_df, test], ignore_index= True)
-        full_df = full_df.drop('ID',axis=1)
+        full_df = pd.concat([full_df, apply_dtype_plan(test)], ignore_index= True)
+        full_df = apply_dtype_plan(full_df.drop('ID',axis=1))
         self.logger.info('Concatenated successfully with resulting full_df table')
         self.logger.info(f"Percantage of zero values in target: {(full_df[full_df['target']==0]).shape[0] /  full_df.shape[0] :.2f}")
         self.size_memory_info(df = full_df, name= "full_df")
@@ -101,6 +178,7 @@ class BuildFeatures():
 
         shops = shops.drop('shop_name', axis=1)
         items = items.drop('item_name', axis=1)
+        items, shops, items_categories = (apply_dtype_plan(d) for d in (items, shops, items_categories))
         self.logger.info('Dictionaries encoded successfully')
 
         return items, shops, items_categories
@@ -127,33 +205,33 @@ class BuildFeatures():
         self.size_memory_info(df = sales, name = 'sales_train' )
         return sales
 
-    def month_aggregations(self, full_df: pd.DataFrame, sales: pd.DataFrame) -> pd.DataFrame:
-        self.logger.info('Starting aggregating target for other features...')
+    def month_aggregations(self, full_df: pd.DataFrame, sales: pd.DataFrame, fused: bool = True,
+                           columns: list[str] | None = None) -> pd.DataFrame:
+        self.logger.info(f'Starting aggregating target for other features (fused: {fused})...')
 
-        group_keys = [
-            'item_id',
-            'shop_id',
-            'item_category_id',
-            'general_item_category_name',
-            'city'
-        ]
+        # key -> aggregations, only the ones in `columns` (FeatureGraph closure) if it is passed
+        aggregations = {key: {suffix: agg_func for suffix, agg_func in self.month_aggregation_functions.items() \
+                              if columns is None or f'target_{key}_{suffix}' in columns} for key in self.month_group_keys}
+        aggregations = {key: functions for key, functions in aggregations.items() if functions}
 
-        aggregations = {
-            'total': 'sum',
-            'mean': 'mean'
-        }
+        if fused:
+            full_df = self.month_aggregations_fused(full_df, sales, aggregations)
+            self.logger.info('Aggregations finished successfully')
+            self.size_memory_info(full_df)
+            return full_df
 
-        for key in group_keys:
+        for key, key_aggregations in aggregations.items():
             group_cols = ['date_block_num', key]
             self.logger.info(f'Grouping by: {group_cols} ...')
 
-            for suffix, agg_func in tqdm.tqdm(aggregations.items()):
+            for suffix, agg_func in tqdm.tqdm(key_aggregations.items()):
                 col_name = f'target_{key}_{suffix}'
                 tqdm.tqdm.write(f'{col_name}')
                 temp = sales.groupby(group_cols, as_index=False)['item_cnt_day'].agg(agg_func)
                 temp = temp.rename(columns={'item_cnt_day': col_name})
 
                 full_df = full_df.merge(temp, on=group_cols, how='left')
+                full_df = apply_dtype_plan(full_df, [col_name])
                 del temp
                 gc.collect()
             self.logger.info('Grouped successfully')
@@ -161,73 +239,136 @@ class BuildFeatures():
         self.size_memory_info(full_df)
         return full_df
 
-    def first_month(self, full_df):
+    def month_aggregations_fused(self, full_df: pd.DataFrame, sales: pd.DataFrame,
+                                 aggregations: dict[str, dict[str, str]]) -> pd.DataFrame:
+        # One groupby per key for all aggregations, results are looked up by integer codes
+        # from small (date_block_num, key) arrays instead of merging into the full frame.
+        # Keys are independent families, every one gets only its key columns and item_cnt_day
+        families = []
+        for key, key_aggregations in aggregations.items():
+            self.logger.info(f"Grouping by: {['date_block_num', key]} ...")
+            inputs = {f'{frame_name}.{column}': frame[column].to_numpy() for frame_name, frame in (('full', full_df), ('sales', sales)) \
+                      for column in ('date_block_num', key)}
+            inputs['sales.item_cnt_day'] = sales['item_cnt_day'].to_numpy()
+            families.append((f'month_aggregations {key}', month_aggregation_family, inputs, {'key': key, 'aggregations': key_aggregations}))
+        new_columns = self.families.run(families)
+        self.logger.info('Grouped successfully')
+
+        return pd.concat([full_df, pd.DataFrame(new_columns, index=full_df.index)], axis=1)
+
+    def first_month(self, full_df, columns: list[str] | None = None):
         self.logger.info('Starting to mark items which sold first time in this month:')
 
-        full_df['not_full_historical_data'] = 0
-        self.logger.info('not_full_historical_data column initialized.')
+        if columns is None or 'not_full_historical_data' in columns:
+            full_df['not_full_historical_data'] = (full_df['date_block_num'] == 0).astype(np.int8)
+            self.logger.info('Marked first month with not_full_historical_data')
 
-        self.logger.info('Creating a DataFrame with the earliest month for each item...')
-        first_month = full_df.groupby('item_id', as_index=False)['date_block_num'].min()
-        first_month.rename(columns={'date_block_num': 'first_month_item_id_num'}, inplace=True)
+        if columns is None or 'first_month_item_id' in columns:
+            self.logger.info('Creating the earliest month for each item...')
+            first_month_item_id_num = full_df.groupby('item_id')['date_block_num'].transform('min')
 
-        self.logger.info('Merging first month of appeareance to full_df..')
-        full_df = full_df.merge(first_month, on='item_id', how='left')
-
-        self.logger.info('Checking if first month of appearance is the current month and marking...')
-        full_df['first_month_item_id'] = (full_df['date_block_num'] == full_df['first_month_item_id_num']).astype('int8')
-        full_df = full_df.drop('first_month_item_id_num', axis = 1)
-
-        self.logger.info('Marked first month with not_full_historical_data')
-        full_df.loc[full_df['date_block_num'] == 0, 'not_full_historical_data'] = 1
-        full_df['not_full_historical_data'] = full_df['not_full_historical_data'].astype(np.int8)
+            self.logger.info('Checking if first month of appearance is the current month and marking...')
+            full_df['first_month_item_id'] = (full_df['date_block_num'] == first_month_item_id_num).astype(np.int8)
+            del first_month_item_id_num
 
         self.logger.info('Items selling in this month first time are marked successfully')
         self.size_memory_info(full_df)
         return full_df
 
-    def expanding_window(self, full_df):
-        self.logger.info('Starting leakage-free target expanding-window aggregation:')
+    def expanding_window_loop(self, full_df, feature: list[str], col: str, col2: str):
+        # Reference implementation: month by month groupby over all earlier rows (O(months x rows))
+        full_df[col] = np.nan
+        full_df[col2] = np.nan
+
+        for d in tqdm.tqdm(full_df.date_block_num.unique()):
+            valid_month = (full_df.date_block_num < d)
+            current_month = (full_df.date_block_num == d)
+            tqdm.tqdm.write(f'Gather previous statistic for {d} month...')
+
+            temp = full_df.loc[valid_month].groupby(feature)[['target']].mean().reset_index()
+            agg = full_df.loc[current_month][feature].merge(temp, on=feature, how='left')[['target']].copy()
+            agg.set_index(full_df.loc[current_month].index, inplace=True)
+            full_df.loc[current_month, col] = agg['target']
+
+            temp = full_df.loc[valid_month].groupby(feature)[['target']].max().reset_index()
+            agg = full_df.loc[current_month][feature].merge(temp, on=feature, how='left')[['target']].copy()
+            agg.set_index(full_df.loc[current_month].index, inplace=True)
+            full_df.loc[current_month, col2] = agg['target']
+            del valid_month, current_month, temp, agg
+            gc.collect()
+        return full_df
 
-        aggregating_target_by = [['item_id', 'shop_id'], ['item_id'], ['shop_id']]
+    def expanding_window(self, full_df, engine: str = 'cumulative', windows: list[int] | None = None,
+                         columns: list[str] | None = None):
+        '''
+        engine='cumulative' computes every key in one sorted pass with running sums, counts and maxima
+        (see features/cumulative.py), engine='loop' is the original month-by-month implementation.
+        windows=[3, 6, 12] additionally adds mean/max over the last n months only.
+        `columns` (FeatureGraph closure) limits the keys to the ones with a column in it.
+        '''
+        if engine not in ('cumulative', 'loop'):
+            raise ValueError(f"Unknown expanding window engine '{engine}', use 'cumulative' or 'loop'")
+        self.logger.info(f'Starting leakage-free target expanding-window aggregation (engine: {engine}):')
+
+        aggregating_target_by = [feature for feature in self.aggregating_target_by if columns is None \
+                                 or any('_'.join([f'target_aggregated_{stat}_premonthes', *feature]) in columns for stat in ('mean', 'max'))]
         self.logger.info(f"aggregating_target_by = {aggregating_target_by}")
 
-        for feature in aggregating_target_by:
-            col = '_'.join(['target_aggregated_mean_premonthes', *feature])
-            col2 = '_'.join(['target_aggregated_max_premonthes', *feature])
-            full_df[col] = np.nan
-            full_df[col2] = np.nan
-
-            self.logger.info(f'Gathering target data for {feature} for all previous months and assigning value to the current month...')
-
-            for d in tqdm.tqdm(full_df.date_block_num.unique()):
-                valid_month = (full_df.date_block_num < d)
-                current_month = (full_df.date_block_num == d)
-                tqdm.tqdm.write(f'Gather previous statistic for {d} month...')
-
-                temp = full_df.loc[valid_month].groupby(feature)[['target']].mean().reset_index()
-                agg = full_df.loc[current_month][feature].merge(temp, on=feature, how='left')[['target']].copy()
-                agg.set_index(full_df.loc[current_month].index, inplace=True)
-                full_df.loc[current_month, col] = agg['target']
-
-                temp = full_df.loc[valid_month].groupby(feature)[['target']].max().reset_index()
-                agg = full_df.loc[current_month][feature].merge(temp, on=feature, how='left')[['target']].copy()
-                agg.set_index(full_df.loc[current_month].index, inplace=True)
-                full_df.loc[current_month, col2] = agg['target']
-                del valid_month, current_month, temp, agg
-                gc.collect()
-
-            self.logger.info(f'Expanding window statistics for {feature} have been created')
+        if engine == 'loop':
+            for feature in aggregating_target_by:
+                col = '_'.join(['target_aggregated_mean_premonthes', *feature])
+                col2 = '_'.join(['target_aggregated_max_premonthes', *feature])
+
+                self.logger.info(f'Gathering target data for {feature} for all previous months and assigning value to the current month...')
+                full_df = apply_dtype_plan(self.expanding_window_loop(full_df, feature, col, col2), [col, col2])
+                self.logger.info(f'Expanding window statistics for {feature} have been created')
+
+                for window in windows or []:
+                    col_window = '_'.join([f'target_aggregated_mean_last_{window}_monthes', *feature])
+                    col2_window = '_'.join([f'target_aggregated_max_last_{window}_monthes', *feature])
+                    mean, max_ = cumulative_stats(full_df, feature, window=window)
+                    full_df[col_window], full_df[col2_window] = mean.astype(np.float32), max_.astype(np.float32)
+                    self.logger.info(f'Rolling window statistics over last {window} months for {feature} have been created')
+        else: # every key set is an independent family: its key columns, month and target
+            families = [(f'expanding_window {feature}', expanding_family,
+                         {column: full_df[column].to_numpy() for column in [*feature, 'date_block_num', 'target']},
+                         {'keys': feature, 'windows': list(windows or [])}) for feature in aggregating_target_by]
+            for column, values in self.families.run(families).items():
+                full_df[column] = values
 
         self.logger.info('Leakage-free expanding-window aggregation (for target) finished successfully')
 
         self.size_memory_info(full_df)
         return full_df
 
-    def year_month(self, full_df):
+    def compare_expanding_engines(self, full_df, atol: float = 1e-6) -> bool:
+        # Parity check: both engines on copies of the same frame, logs max abs difference per column
+        self.logger.info('Comparing expanding window engines: loop vs cumulative...')
+        loop_df = self.expanding_window(full_df.copy(), engine='loop')
+        cumulative_df = self.expanding_window(full_df.copy(), engine='cumulative')
+
+        columns = [c for c in loop_df.columns if c not in full_df.columns]
+        matched = list(columns) == [c for c in cumulative_df.columns if c not in full_df.columns]
+        for col in columns:
+            expected = loop_df[col].to_numpy(dtype=np.float64)
+            result = cumulative_df[col].to_numpy(dtype=np.float64)
+            same_nan = np.array_equal(np.isnan(expected), np.isnan(result))
+            max_diff = np.nanmax(np.abs(expected - result), initial=0.0)
+            self.logger.info(f'{col}: same NaN positions = {same_nan}, max abs difference = {max_diff}')
+            matched = matched and same_nan and max_diff <= atol
+
+        if matched:
+            self.logger.info('Expanding window engines produce the same columns')
+        else:
+            self.logger.warning('!!! Expanding window engines differ')
+        return matched
+
+    def year_month(self, full_df, columns: list[str] | None = None):
+        if columns is not None and not {'month', 'year'} & set(columns):
+            return full_df
         self.logger.info('Adding month and year features...')
         full_df['month'] = ((full_df['date_block_num'] % 12) + 1).astype(np.int8)
-        full_df['year'] = (2013 + (full_df['date_block_num'] // 12))
+        full_df['year'] = (2013 + (full_df['date_block_num'] // 12)).astype(np.int32)
         self.logger.info("Features 'month' and 'year' have been added successfully")
         return full_df
 
@@ -236,15 +377,9 @@ class BuildFeatures():
 
         shop_id_test = test['shop_id'].unique()
         item_id_test = test['item_id'].unique()
-        full_df['item_id_was_in_test'] = 0
-        full_df['shop_id_was_in_test'] = 0
-        self.logger.info('Empty rows and columns item_id_was_in_test, shop_id_was_in_test have been created')
-
         self.logger.info('Assigning values...')
-        full_df.loc[(full_df['item_id'].isin(item_id_test)), 'item_id_was_in_test'] =  1
-        full_df.loc[full_df['shop_id'].isin(shop_id_test), 'shop_id_was_in_test'] =  1
-        full_df['item_id_was_in_test'] = full_df['item_id_was_in_test'].astype(np.int8)
-        full_df['shop_id_was_in_test'] = full_df['shop_id_was_in_test'].astype(np.int8)
+        full_df['item_id_was_in_test'] = full_df['item_id'].isin(item_id_test).astype(np.int8)
+        full_df['shop_id_was_in_test'] = full_df['shop_id'].isin(shop_id_test).astype(np.int8)
 
 
         unmarked = full_df[
@@ -295,57 +430,80 @@ class BuildFeatures():
             self.logger.info(f'Memory usage reduced by: {(mem_start-mem_end)/ (1024**2)} MB')
         return full_df
 
-    def lags(self, full_df, additional: list[str]=['was_item_price_outlier', 'was_item_cnt_day_outlier', 'item_price']):
-        self.logger.info('Starting to create lags...')
+    def lags(self, full_df, additional: list[str]=['was_item_price_outlier', 'was_item_cnt_day_outlier', 'item_price'],
+             shift_range: list[int]=[1, 2, 3, 12], backend: str='cube', columns: list[str] | None = None):
+        if backend not in ('cube', 'merge'):
+            raise ValueError(f"Unknown lags backend '{backend}', use 'cube' or 'merge'")
+        self.logger.info(f'Starting to create lags (backend: {backend})...')
+        self.logger.info(f'RSS before lags: {format_mb(current_rss_mb())}, peak RSS so far: {format_mb(peak_rss_mb())}')
 
         all_obs_combination_by = ['date_block_num', 'shop_id', 'item_id']
-        shift_range = [1, 2, 3, 12]
         shifted_columns = [c for c in full_df if 'target' in c]
         shifted_columns = shifted_columns + additional
+        # column -> its shifts, only the lags in `columns` (FeatureGraph closure) if it is passed
+        shifts = {c: [shift for shift in shift_range if columns is None or f'{c}_lag_{shift}' in columns] for c in shifted_columns}
+        shifted_columns = [c for c in shifted_columns if shifts[c]]
+
+        if backend == 'cube':
+            # Each column is scattered once into a month-major array, every shift is a gather from it.
+            # Columns with the same shifts share one block (a single block without a feature selection)
+            lag_cube = LagCube(full_df)
+            groups = {}
+            for c in shifted_columns:
+                groups.setdefault(tuple(shifts[c]), []).append(c)
+            # Lag columns are created as float32 with NaN already filled by 0 (as downcast + fillna of merge backend)
+            shifted = [lag_cube.lags(full_df, group, list(group_shifts), fill_value=0) for group_shifts, group in groups.items()]
+            full_df = self.downcast_dtypes(full_df = full_df.fillna(0), logs=False)
+            full_df = pd.concat([full_df, *shifted], axis=1, copy=False)
+            del lag_cube, shifted
+            gc.collect()
+        else:
+            for shift in tqdm.tqdm(shift_range):
+                shift_columns = [c for c in shifted_columns if shift in shifts[c]]
+                temp = full_df[all_obs_combination_by + shift_columns].copy()
+                temp['date_block_num'] = temp['date_block_num'] + shift
 
-        for shift in tqdm.tqdm(shift_range):
-            temp = full_df[all_obs_combination_by + shifted_columns].copy()
-            temp['date_block_num'] = temp['date_block_num'] + shift
-
-            foo = lambda x: f'{x}_lag_{shift}' if x in shifted_columns else x
-            temp = temp.rename(columns=foo)
+                foo = lambda x: f'{x}_lag_{shift}' if x in shift_columns else x
+                temp = temp.rename(columns=foo)
 
-            full_df = pd.merge(full_df, temp, on = all_obs_combination_by, how= 'left')
-            full_df = self.downcast_dtypes(full_df = full_df, logs=False)
+                full_df = pd.merge(full_df, temp, on = all_obs_combination_by, how= 'left')
+                full_df = self.downcast_dtypes(full_df = full_df, logs=False)
 
-            del temp
-            gc.collect()
-        full_df = full_df.fillna(0)
+                del temp
+                gc.collect()
+            full_df = full_df.fillna(0)
         self.logger.info(f'Lags have been created for {shifted_columns}...')
+        self.logger.info(f'RSS after lags: {format_mb(current_rss_mb())}, peak RSS so far: {format_mb(peak_rss_mb())}')
         self.size_memory_info(full_df)
-        return full_df # added possibility to chose additional lags features
+        return full_df # added possibility to chose additional lags features and shifts
 
     def deltas(self, full_df: pd.DataFrame, columns_to_delta: list[str]=['target', 'target_item_id_total', 'target_shop_id_total','target_item_category_id_total',\
-                            'target_general_item_category_name_total', 'target_city_total']):
+                            'target_general_item_category_name_total', 'target_city_total'], columns: list[str] | None = None):
         self.logger.info('Starting creating deltas...')
         # columns_to_delta = ['target', 'target_by_item_id_total', 'target_by_shop_id_total','target_by_category_total',\
         #                     'target_by_general_category_total', 'target_by_city_total']
 
-        for target_predict in columns_to_delta:
-            self.logger.info(f'Creating deltas for {target_predict} feature...')
-            full_df[target_predict + '_delta_1_2'] = full_df[target_predict + '_lag_1'] - full_df[target_predict + '_lag_2']
-            full_df[target_predict + '_delta_2_3'] = full_df[target_predict + '_lag_2'] - full_df[target_predict + '_lag_3']
-
-            full_df[target_predict + '_predict_1_2'] = full_df[target_predict + '_lag_1'] + full_df[target_predict + '_delta_1_2']
-            full_df[target_predict + '_predict_2_3'] = full_df[target_predict + '_lag_1'] + full_df[target_predict + '_delta_2_3']\
-                + full_df[target_predict + '_predict_1_2']
-            self.logger.info(f'Deltas have been created for {target_predict} feature...')
-
-        self.logger.info(f'Deltas for {target_predict} have been created.')
+        # Every target is an independent family, it only needs the lags of its outputs (only the ones in `columns` if passed)
+        outputs = {target_predict: [suffix for suffix in DELTA_LAGS if columns is None or f'{target_predict}_{suffix}' in columns] \
+                   for target_predict in columns_to_delta}
+        families = [(f'deltas {target_predict}', delta_family,
+                     {f'{target_predict}_lag_{n}': full_df[f'{target_predict}_lag_{n}'].to_numpy() \
+                      for n in sorted({n for suffix in suffixes for n in DELTA_LAGS[suffix]})},
+                     {'target': target_predict, 'outputs': suffixes}) for target_predict, suffixes in outputs.items() if suffixes]
+        for column, values in self.families.run(families).items():
+            full_df[column] = values
+
+        self.logger.info(f'Deltas for {columns_to_delta} have been created.')
         self.size_memory_info(full_df)
         return full_df # added possibility to chose deltas features
 
 # Main methods:
 
-    def full_schema(self, sales, items, items_categories, shops, test) -> pd.DataFrame:
+    def full_schema(self, sales, items, items_categories, shops, test, sort_schema: bool = False,
+                    columns: list[str] | None = None) -> pd.DataFrame:
         self.logger.info('Creating a common dataframe with test, all items, and sales by months:')
 
-        df = self.blank_schema(sales)
+        df = self.blank_schema(sales, sort=sort_schema)
         aggregated = self.sales_aggregation(sales)
         full_df = self.merge_df_aggregated(df, aggregated)
         del df,aggregated
@@ -355,58 +513,178 @@ class BuildFeatures():
             self.encode_dicts(items, shops, items_categories)
         full_df = self.merge_full_df_dicts(full_df, items, items_categories, shops)
         sales = self.merge_sales_dicts(sales, items, items_categories, shops)
-        full_df = self.month_aggregations(full_df, sales)
+        full_df = self.month_aggregations(full_df, sales, columns=columns)
         full_df = self.was_in_test(full_df, test)
+        self.check_memory_budget(len(full_df), full_df.columns, selected=columns)
         return full_df
 
-    def transform(self, full_df):
-        full_df = self.first_month(full_df)
-        full_df = self.expanding_window(full_df)
-        full_df = self.year_month(full_df)
-        full_df = self.lags(full_df)
-        full_df = self.deltas(full_df)
+    def transform_steps(self, columns: list[str] | None = None):
+        # `columns` (FeatureGraph closure) is passed to every step, which then creates only the columns in it
+        steps = [
+            ('first_month', self.first_month),
+            ('expanding_window', self.expanding_window),
+            ('year_month', self.year_month),
+            ('lags', self.lags),
+            ('deltas', self.deltas),
+        ]
+        if columns is None:
+            return steps
+        return [(name, partial(step, columns=columns)) for name, step in steps]
+
+    def transform(self, full_df, profiler=None, columns: list[str] | None = None):
+        for name, step in self.transform_steps(columns):
+            with profile_stage(profiler, f'features.{name}', rows_in=len(full_df)) as record:
+                full_df = step(full_df)
+                record['rows_out'] = len(full_df)
         return full_df
 
-    def check_leakage(self, full_df, constant_features: set[str]={'target','item_id_was_in_test', 'shop_id_was_in_test','not_full_historical_data'}):
-        self.logger.info('Looking for leakage features..')
-        temp = full_df[full_df['date_block_num'] == 34] # Chose last month only
+    def cached_build(self, cache, sort_schema: bool = False, columns: list[str] | None = None) -> pd.DataFrame:
+        # full_schema + every transform step as cached stages; the chain resumes after the last stage with a matching key
+        code = [inspect.getmodule(obj) for obj in (BuildFeatures, cumulative_stats, LagCube, apply_dtype_plan, FeatureFamilies, FeatureGraph)]
+        inputs = [self.config.get(key) for key in ('cleaned_parquet', 'items', 'item_categories', 'shops', 'test')]
+        stages = [('full_schema', None)] + self.transform_steps(columns)
+        params = {'sort_schema': sort_schema} if columns is None else {'sort_schema': sort_schema, 'columns': columns}
+        keys = [cache.key('full_schema', inputs=inputs, params=params, code=code)]
+        for name, _ in stages[1:]:
+            keys.append(cache.key(name, params={'previous': keys[-1]}, code=code))
+
+        hits = [i for i, (name, _) in enumerate(stages) if cache.exists(name, keys[i])]
+        if hits:
+            start = hits[-1] + 1
+            full_df = cache.load(stages[hits[-1]][0], keys[hits[-1]])
+        else:
+            start = 1
+            full_df = self.full_schema(*self.extract(), sort_schema=sort_schema, columns=columns)
+            cache.save('full_schema', keys[0], full_df)
+
+        for (name, step), key in zip(stages[start:], keys[start:]):
+            full_df = step(full_df)
+            cache.save(name, key, full_df)
+        return full_df
+
+    def keep_features(self, full_df: pd.DataFrame, features: list[str]) -> pd.DataFrame:
+        dropped = [c for c in full_df.columns if c not in features]
+        self.logger.info(f'Keeping {len(full_df.columns) - len(dropped)} requested features, dropping {len(dropped)} intermediate columns: {dropped}')
+        return full_df.drop(columns=dropped)
 
-        # Make a boolean mask for columns to delete which consist\
-        # of all 0 for all observations
-        leakage_true = list((temp == 0).sum() == 214200)
+    def leakage_features(self, full_df, constant_features: set[str]={'target','item_id_was_in_test', 'shop_id_was_in_test','not_full_historical_data'},
+                         test_month: int = 34) -> list[str]:
+        # Columns which consist of all 0 for all observations of the test month
+        temp = full_df[full_df['date_block_num'] == test_month] # Chose last month only
+        leakage_true = list((temp == 0).sum() == len(temp)) # len(temp) is 214200 for the Kaggle test set
         del temp
         gc.collect()
         leakage_features = set(full_df.loc[:,leakage_true].columns)
         #constant_features = {'target','item_id_was_in_test', 'shop_id_was_in_test','not_full_historical_data'}
-        leakage_features = list(leakage_features - constant_features)
+        return [column for column in full_df.columns if column in leakage_features - constant_features]
+
+    def check_leakage(self, full_df, constant_features: set[str]={'target','item_id_was_in_test', 'shop_id_was_in_test','not_full_historical_data'}):
+        self.logger.info('Looking for leakage features..')
+        leakage_features = self.leakage_features(full_df, constant_features)
 
         full_df = full_df.drop(columns=leakage_features, axis = 1)
         self.logger.info(f'Leakage features were removed, those are : {leakage_features}')
         return full_df
 
 
-    def output(self, full_df):
+    def output(self, full_df, partitioned: bool=True):
         self.logger.info('Output function was called:')
         full_df = self.downcast_dtypes(full_df)
-        full_df.to_parquet(self.config.get('features'), engine='pyarrow')
+        if partitioned: # dataset partitioned by date_block_num, readers take only months and columns they need
+            write_features(full_df, self.config.get('features_dataset'))
+            self.logger.info(f"full_df saved as dataset partitioned by date_block_num: {self.config.get('features_dataset')}")
+        else:
+            full_df.to_parquet(self.config.get('features'), engine='pyarrow')
         #full_df.sample(100000).to_csv(config.get('full_df_test_csv'), index = False)
         self.logger.info(f"full_df with test set and without leakage features was saved to {self.config.get('features_dir')}")
         self.logger.info('Output function has been executed')
         self.size_memory_info(full_df)
 
-    def run(self,  validator_object=None, validation_schema=None,  dry_run: bool=True):
-        self.logger.info('\n=== FEATURE ENGINEERING process started ===\n')
+    def output_matrix(self, full_df):
+        # Model features of full_df (DataFrame or Table) written column by column into preallocated float32 matrices
+        self.logger.info('Output function was called (matrix):')
+        FeatureMatrix(self.config, self.logger).build(full_df, features=self.config.get_xgb('important_features'))
+        self.logger.info('Output function has been executed')
+
+    def run(self,  validator_object=None, validation_schema=None,  dry_run: bool=True, save_state: bool=False, cache=None,
+            profiler=None, backend: str='pandas', threads: int | None = None, features: str | list[str] = 'full',
+            output_format: str = 'dataset'):
+        '''
+        backend='pandas' builds full_df with the pandas steps of this class, backend='arrow' keeps it as a
+        pyarrow.Table (features/arrow_features.py, `threads` sets the Arrow CPU pool size). The stage cache
+        stores DataFrames and is only used by the pandas backend.
+        features='full' builds every column, 'train-serving' or a list of columns builds only them and the columns
+        they are computed from (features/feature_graph.py), pandas backend only.
+        output_format='dataset' writes the partitioned features store for Split, 'matrix' writes the model features
+        straight into the float32 matrices of FeatureMatrix (data/feature_matrix.py) for XGB_model(train_data='matrix').
+        '''
+        if backend not in ('pandas', 'arrow'):
+            raise ValueError(f"Unknown build_features backend '{backend}', use 'pandas' or 'arrow'")
+        if output_format not in ('dataset', 'matrix'):
+            raise ValueError(f"Unknown output_format '{output_format}', use 'dataset' or 'matrix'")
+        graph = FeatureGraph(self)
+        requested = graph.profile(features) if isinstance(features, str) else list(features)
+        selection = {} # closure of the requested features for full_schema and the transform steps
+        if requested is not None:
+            if backend == 'arrow':
+                raise ValueError('Feature selection is only supported by the pandas backend')
+            if save_state:
+                raise ValueError('save_state needs every feature, it can not be used with a feature selection')
+            selection['columns'] = graph.closure(requested)
+            self.logger.info(f"Feature selection: {len(requested)} requested, {len(selection['columns'])} computed columns, "
+                             f"per step: { {step: len(columns) for step, columns in graph.plan(requested).items()} }")
+        self.logger.info(f'\n=== FEATURE ENGINEERING process started (backend: {backend}) ===\n')
+        # Steps object: full_schema, transform, check_leakage and output of the chosen backend
+        engine = ArrowFeatures(self.config, self.logger, self, threads=threads) if backend == 'arrow' else self
+        if cache is not None and backend == 'arrow':
+            self.logger.warning('!!! Stage cache is not used with the arrow backend')
+            cache = None
         #sales, items, items_categories, shops, test = self.extract()
-        full_df = self.full_schema(*self.extract())
-        full_df = self.transform(full_df)
-        full_df = self.check_leakage(full_df)# can be moved inside self.output() or self.transform()
+        if cache is not None:
+            with profile_stage(profiler, 'features.cached_build') as record:
+                full_df = self.cached_build(cache, **selection)
+                record['rows_out'] = len(full_df)
+        else:
+            inputs = [self.config.get(key) for key in ('cleaned_parquet', 'items', 'item_categories', 'shops', 'test')]
+            with profile_stage(profiler, 'features.extract', inputs=inputs) as record:
+                extracted = self.extract()
+                record['rows_out'] = len(extracted[0])
+            with profile_stage(profiler, 'features.full_schema', rows_in=len(extracted[0])) as record:
+                full_df = engine.full_schema(*extracted, **selection)
+                record['rows_out'] = len(full_df)
+            del extracted
+            full_df = engine.transform(full_df, profiler=profiler, **selection)
+        if requested is not None: # columns only needed to compute the requested ones
+            full_df = self.keep_features(full_df, requested)
+
+        self.families.close() # feature families are done, workers are not kept for the rest of the run
+
+        if save_state and not dry_run: # running state for IncrementalFeatures, before lag sources are dropped
+            incremental = IncrementalFeatures(self.config, self.logger, self)
+            state_df = full_df.to_pandas() if backend == 'arrow' else full_df
+            incremental.save_state(incremental.state_from_full_df(state_df))
+            del state_df
+        with profile_stage(profiler, 'features.check_leakage', rows_in=len(full_df)) as record:
+            full_df = engine.check_leakage(full_df)# can be moved inside self.output() or self.transform()
+            record['rows_out'] = len(full_df)
 
         if validator_object and validation_schema:
-            full_df = validator_object.validate(schema = validation_schema, df = full_df, scheme_name='feaures_engineering')
+            with profile_stage(profiler, 'features.validate', rows_in=len(full_df)) as record:
+                if backend == 'arrow': # pandera validates DataFrames, validated frame is written as in pandas backend
+                    full_df, engine = full_df.to_pandas(), self
+                full_df = validator_object.validate(schema = validation_schema, df = full_df, scheme_name='feaures_engineering',
+                                                    required = requested is None) # a selection has only some schema columns
+                record['rows_out'] = len(full_df)
         else:
             self.logger.warning('!!! No validation schema passed to build_features pipeline\
                                 The pipeline performed transformations without validation.')
 
-        if not dry_run:
-            self.output(full_df)
+        if not dry_run and output_format == 'matrix':
+            with profile_stage(profiler, 'features.output_matrix', rows_in=len(full_df), outputs=[self.config.get('feature_matrix')]):
+                self.output_matrix(full_df)
+        elif not dry_run:
+            with profile_stage(profiler, 'features.output', rows_in=len(full_df), outputs=[self.config.get('features_dataset')]) as record:
+                engine.output(full_df)
+                if profiler is not None and isinstance(full_df, pd.DataFrame):
+                    profiler.frame(record, full_df)
         self.logger.info("\n=== FEATURE ENGINEERING process finished ===\n\n\n\n\n")
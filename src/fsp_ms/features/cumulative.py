@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+
+def group_codes(df: pd.DataFrame, keys: list[str]) -> np.ndarray:
+    '''
+    Packs several key columns into one dense int64 code per row.
+    Every column is factorized first, so the codes stay small even for sparse ids.
+    '''
+    codes = np.zeros(len(df), dtype=np.int64)
+    for key in keys:
+        key_codes, uniques = pd.factorize(df[key], sort=True)
+        codes = codes * (len(uniques) + 1) + (key_codes + 1)
+    return codes
+
+
+def cumulative_stats(df: pd.DataFrame, keys: list[str], target: str = 'target', time_col: str = 'date_block_num',
+                     window: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Leakage-free mean and max of `target` per `keys` over previous months only.
+
+    One sorted pass per key: rows are reduced to (key, month) cells holding sum, count and max of the target,
+    then every cell reads the running statistics of the cells before it (shifted by one month).
+    With `window=None` all previous months are used (expanding window), with `window=n` only the last n months.
+    NaN targets (test month) are skipped, cells without any previous observation get NaN.
+
+    Returns:
+        (mean, max) - float64 arrays aligned with df rows.
+    '''
+    months = df[time_col].to_numpy().astype(np.int64)
+    n_months = int(months.max()) + 1 if len(months) else 1
+    cell_codes = group_codes(df, keys) * n_months + months
+
+    order = np.argsort(cell_codes, kind='stable')
+    sorted_codes = cell_codes[order]
+    is_new_cell = np.empty(len(sorted_codes), dtype=bool)
+    is_new_cell[:1] = True
+    np.not_equal(sorted_codes[1:], sorted_codes[:-1], out=is_new_cell[1:])
+    starts = np.flatnonzero(is_new_cell)
+    cells = sorted_codes[starts]
+    row_cell = np.empty(len(order), dtype=np.int64)
+    row_cell[order] = np.cumsum(is_new_cell) - 1
+    if len(cells) == 0:
+        empty = np.full(0, np.nan)
+        return empty, empty.copy()
+
+    values = df[target].to_numpy(dtype=np.float64)[order]
+    valid = ~np.isnan(values)
+    cell_sum = np.add.reduceat(np.where(valid, values, 0.0), starts)
+    cell_count = np.add.reduceat(valid.astype(np.int64), starts)
+    cell_max = np.fmax.reduceat(values, starts)
+
+    cell_key = cells // n_months
+    cell_month = cells % n_months
+    key_start = np.flatnonzero(np.r_[True, cell_key[1:] != cell_key[:-1]])
+    cell_key_start = np.repeat(key_start, np.diff(np.r_[key_start, len(cells)]))
+    position = np.arange(len(cells))
+
+    # Prefix sums are global, every cell subtracts the prefix of the first cell inside its window
+    sum_prefix = np.r_[0.0, np.cumsum(cell_sum)]
+    count_prefix = np.r_[0, np.cumsum(cell_count)]
+    if window is None:
+        lower = cell_key_start
+    else:
+        lower = np.maximum(np.searchsorted(cells, cells - window, side='left'), cell_key_start)
+    prev_sum = sum_prefix[position] - sum_prefix[lower]
+    prev_count = count_prefix[position] - count_prefix[lower]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        prev_mean = np.where(prev_count > 0, prev_sum / prev_count, np.nan)
+
+    if window is None:
+        running_max = pd.Series(np.where(np.isnan(cell_max), -np.inf, cell_max))\
+            .groupby(cell_key, sort=False).cummax().to_numpy()
+        has_previous = position > cell_key_start
+        prev_max = np.full(len(cells), -np.inf)
+        prev_max[1:] = running_max[:-1]
+        prev_max[~has_previous] = -np.inf
+    else:
+        prev_max = np.full(len(cells), -np.inf)
+        for offset in range(1, window + 1):
+            lookup = cells - offset
+            found = np.searchsorted(cells, lookup, side='left')
+            found_clipped = np.minimum(found, len(cells) - 1)
+            hit = (cell_month >= offset) & (cells[found_clipped] == lookup)
+            prev_max[hit] = np.fmax(prev_max[hit], np.nan_to_num(cell_max[found_clipped[hit]], nan=-np.inf))
+    prev_max[np.isneginf(prev_max)] = np.nan
+
+    return prev_mean[row_cell], prev_max[row_cell]
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import re
+
+import numpy as np
+import pandas as pd
+
+# Final compact dtype of every feature, first matching pattern wins.
+# Same dtypes as validation/scheme_features.py, so columns are created as they are stored and validated
+# instead of being built as int64/float64 and downcasted at the end.
+DTYPE_PLAN: list[tuple[str, str]] = [
+    # Identifiers and time
+    (r'^(date_block_num|shop_id|item_id|item_category_id)$', 'int32'),
+    (r'^(general_item_category_name|city|month)$', 'int8'),
+    (r'^year$', 'int32'),
+    (r'^first_month_item_id_num$', 'int32'), # intermediate, dropped in first_month
+    # Binary flags
+    (r'^(item_id_was_in_test|shop_id_was_in_test|not_full_historical_data|first_month_item_id)$', 'int8'),
+    # Target, aggregations, windows, lags, deltas
+    (r'^target', 'float32'),
+    (r'^was_item_.*_outlier', 'float32'),
+    (r'^item_price', 'float32'),
+    (r'_(lag_\d+|delta_\d+_\d+|predict_\d+_\d+)$', 'float32'),
+]
+
+_compiled_plan = [(re.compile(pattern), np.dtype(dtype)) for pattern, dtype in DTYPE_PLAN]
+
+
+def planned_dtype(column: str) -> np.dtype | None:
+    for pattern, dtype in _compiled_plan:
+        if pattern.search(column):
+            return dtype
+    return None
+
+
+def apply_dtype_plan(df: pd.DataFrame, columns: list[str] | None = None) -> pd.DataFrame:
+    # Casts `columns` (all by default) to their planned dtype in place, columns without a plan are left as they are
+    casts = {}
+    for column in df.columns if columns is None else columns:
+        dtype = planned_dtype(column)
+        if dtype is not None and df[column].dtype != dtype:
+            casts[column] = dtype
+    for column, dtype in casts.items():
+        df[column] = df[column].astype(dtype)
+    return df
+
+
+def projected_bytes(n_rows: int, columns: list[str], default_dtype: str = 'float64') -> int:
+    # Size of a frame with planned dtypes, columns without a plan are counted as `default_dtype`
+    return n_rows * sum((planned_dtype(column) or np.dtype(default_dtype)).itemsize for column in columns)
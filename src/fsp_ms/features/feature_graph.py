@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+from .parallel import DELTA_LAGS
+
+ROW_KEYS = ['date_block_num', 'shop_id', 'item_id']
+# Columns of full_schema() before month aggregations: blank schema, monthly sales, encoded dicts, test flags
+SCHEMA_COLUMNS = ROW_KEYS + ['item_price', 'target', 'was_item_price_outlier', 'was_item_cnt_day_outlier',
+                             'item_category_id', 'general_item_category_name', 'city', 'item_id_was_in_test', 'shop_id_was_in_test']
+FEATURE_PROFILES = ('full', 'train-serving')
+
+
+class FeatureGraph():
+    '''
+    Every column BuildFeatures can create, with the step creating it and the columns it is computed from:
+    target_predict_2_3 <- target_lag_1..3 <- target, target_item_id_total_lag_1 <- target_item_id_total <- item_id, ...
+
+    closure(features) resolves a requested feature list to every column needed to compute it, in pipeline order.
+    BuildFeatures.run(features=...) passes that list to full_schema() and every transform step, which then
+    compute only the month aggregation keys, expanding windows, lags and deltas in it, and keeps the requested
+    columns. The 'train-serving' profile requests exactly what Split and XGB_model read: important_features
+    from config, the target and the row keys.
+
+    Example:
+        graph = FeatureGraph(build_features)
+        graph.closure(['target_predict_2_3'])  # ['date_block_num', 'shop_id', 'item_id', 'target', 'target_lag_1', ...]
+        build_features.run(..., features='train-serving')
+    '''
+
+    def __init__(self, build_features):
+        self.config = build_features.config
+        defaults = build_features.step_defaults()
+        self.nodes = {} # column -> (step, input columns), in the order the pipeline creates columns
+        for column in SCHEMA_COLUMNS:
+            self.nodes[column] = ('full_schema', [])
+        for key in build_features.month_group_keys:
+            for suffix in build_features.month_aggregation_functions:
+                self.nodes[f'target_{key}_{suffix}'] = ('month_aggregations', ['date_block_num', key])
+        self.nodes['not_full_historical_data'] = ('first_month', ['date_block_num'])
+        self.nodes['first_month_item_id'] = ('first_month', ['date_block_num', 'item_id'])
+        for feature in build_features.aggregating_target_by:
+            for stat in ('mean', 'max'):
+                self.nodes['_'.join([f'target_aggregated_{stat}_premonthes', *feature])] = \
+                    ('expanding_window', [*feature, 'date_block_num', 'target'])
+        self.nodes['month'] = self.nodes['year'] = ('year_month', ['date_block_num'])
+        for column in [c for c in self.nodes if 'target' in c] + defaults['additional']:
+            for shift in defaults['shift_range']:
+                self.nodes[f'{column}_lag_{shift}'] = ('lags', [*ROW_KEYS, column])
+        for target in defaults['columns_to_delta']:
+            for suffix, shifts in DELTA_LAGS.items():
+                self.nodes[f'{target}_{suffix}'] = ('deltas', [f'{target}_lag_{n}' for n in shifts])
+
+    def profile(self, name: str) -> list[str] | None:
+        # Requested features of a profile, None for 'full' (every column, as without the graph)
+        if name not in FEATURE_PROFILES:
+            raise ValueError(f"Unknown feature profile '{name}', use one of {FEATURE_PROFILES} or a list of features")
+        if name == 'full':
+            return None
+        return list(dict.fromkeys([*ROW_KEYS, *self.config.get_xgb('important_features'), 'target']))
+
+    def closure(self, features: list[str]) -> list[str]:
+        unknown = [column for column in features if column not in self.nodes]
+        if unknown:
+            raise ValueError(f'Unknown features {unknown}: they are not created by BuildFeatures')
+        needed, stack = set(), list(features)
+        while stack:
+            column = stack.pop()
+            if column not in needed:
+                needed.add(column)
+                stack.extend(self.nodes[column][1])
+        return [column for column in self.nodes if column in needed]
+
+    def plan(self, features: list[str]) -> dict[str, list[str]]:
+        # Columns of the closure grouped by the step creating them
+        plan = {}
+        for column in self.closure(features):
+            plan.setdefault(self.nodes[column][0], []).append(column)
+        return plan
@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import json
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ..data.features_store import features_dataset, read_features, write_features
+
+
+class IncrementalFeatures():
+    '''
+    Appends features for one new month of sales without rebuilding the whole history.
+
+    The full build (BuildFeatures.run(save_state=True)) persists the running state needed by the
+    history-dependent features:
+        * expanding-window accumulators (sum, count, max of target) per key
+        * lag sources: shifted columns of the last max(shift_range) months
+        * first month of appearance per item_id
+        * held columns: history values of the columns check_leakage drops because they are all 0 in the test month,
+          partitioned by month like the features store, so an append writes only the new month
+    run() then builds the rows of the new date_block_num from sales of that month only, computes
+    their features from the state, appends them to the features parquet and updates the state.
+    The test month rows are recomputed as well, since their lags and windows depend on the new month.
+    Leakage is checked again on them: columns of a short history (lags of the months before the first one)
+    stop being all 0 and go back to the store with their held history, so the store has the columns of a full rebuild.
+    '''
+
+    aggregating_target_by = [['item_id', 'shop_id'], ['item_id'], ['shop_id']]
+    all_obs_combination_by = ['date_block_num', 'shop_id', 'item_id']
+
+    def __init__(self, config, logger, build_features):
+        self.config = config
+        self.logger = logger
+        self.build_features = build_features # BuildFeatures instance, month frames are built with its methods
+        self.state_dir = config.get('features_state')
+        self.held_path = self.state_dir / 'held_columns'
+
+# State:
+
+    def expanding_name(self, feature: list[str]) -> str:
+        return '_'.join(feature)
+
+    def expanding_accumulators(self, df: pd.DataFrame, feature: list[str]) -> pd.DataFrame:
+        return df.groupby(feature, as_index=False)['target'].agg(sum='sum', count='count', max='max')
+
+    def state_from_full_df(self, full_df: pd.DataFrame, shift_range: list[int]=[1, 2, 3, 12]) -> dict:
+        # Expects full_df after BuildFeatures.transform (before check_leakage drops lag sources)
+        self.logger.info('Collecting incremental state from full_df...')
+        test_month = int(full_df['date_block_num'].max()) # concat_test appends the test set after the last month of sales
+        history = full_df[full_df['date_block_num'] < test_month]
+        last_month = int(history['date_block_num'].max())
+        held_columns = self.build_features.leakage_features(full_df, test_month=test_month)
+        shifted_columns = [c for c in full_df.columns if all(f'{c}_lag_{shift}' in full_df.columns for shift in shift_range)]
+
+        state = {
+            'last_month': last_month,
+            'test_month': test_month,
+            'columns': list(full_df.columns),
+            'held_columns': held_columns,
+            'shift_range': list(shift_range),
+            'shifted_columns': shifted_columns,
+            'expanding': {self.expanding_name(feature): self.expanding_accumulators(history, feature) \
+                          for feature in self.aggregating_target_by},
+            'lag_sources': history.loc[history['date_block_num'] > last_month - max(shift_range),\
+                                       self.all_obs_combination_by + shifted_columns].reset_index(drop=True),
+            'first_month': history.groupby('item_id', as_index=False)['date_block_num'].min()\
+                .rename(columns={'date_block_num': 'first_month_item_id_num'}),
+            'held': self.build_features.downcast_dtypes(history[self.all_obs_combination_by + held_columns]\
+                                                        .reset_index(drop=True), logs=False),
+        }
+        self.logger.info(f'State collected up to month {last_month}, lag sources: {len(shifted_columns)} columns, '
+                         f'held (leakage in month {test_month}): {len(held_columns)} columns')
+        return state
+
+    def save_state(self, state: dict):
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        meta = {k: state[k] for k in ('last_month', 'test_month', 'shift_range', 'shifted_columns', 'columns', 'held_columns')}
+        with open(self.state_dir / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        for name, accumulators in state['expanding'].items():
+            accumulators.to_parquet(self.state_dir / f'expanding_{name}.parquet', index=False)
+        state['lag_sources'].to_parquet(self.state_dir / 'lag_sources.parquet', index=False)
+        state['first_month'].to_parquet(self.state_dir / 'first_month.parquet', index=False)
+        if state.get('held') is not None: # whole held history of a full build, appends write their month in load()
+            shutil.rmtree(self.held_path, ignore_errors=True)
+            write_features(state['held'], self.held_path)
+        self.logger.info(f'Incremental state saved to {self.state_dir}')
+
+    def load_state(self) -> dict:
+        meta_path = self.state_dir / 'meta.json'
+        if not meta_path.exists():
+            raise FileNotFoundError(f'No incremental state in {self.state_dir}, run BuildFeatures.run(save_state=True) first')
+        with open(meta_path, encoding='utf-8') as f:
+            state = json.load(f)
+        state['expanding'] = {self.expanding_name(feature): pd.read_parquet(self.state_dir / f'expanding_{self.expanding_name(feature)}.parquet') \
+                              for feature in self.aggregating_target_by}
+        state['lag_sources'] = pd.read_parquet(self.state_dir / 'lag_sources.parquet')
+        state['first_month'] = pd.read_parquet(self.state_dir / 'first_month.parquet')
+        self.logger.info(f"Incremental state loaded, last month: {state['last_month']}")
+        return state
+
+    def update_state(self, state: dict, month_df: pd.DataFrame, month: int) -> dict:
+        self.logger.info(f'Updating incremental state with month {month}...')
+        for feature in self.aggregating_target_by:
+            name = self.expanding_name(feature)
+            merged = pd.concat([state['expanding'][name], self.expanding_accumulators(month_df, feature)], ignore_index=True)
+            state['expanding'][name] = merged.groupby(feature, as_index=False).agg({'sum': 'sum', 'count': 'sum', 'max': 'max'})
+
+        sources = pd.concat([state['lag_sources'], month_df[self.all_obs_combination_by + state['shifted_columns']]], ignore_index=True)
+        sources = self.build_features.downcast_dtypes(sources, logs=False)
+        state['lag_sources'] = sources[sources['date_block_num'] > month - max(state['shift_range'])].reset_index(drop=True)
+
+        new_items = month_df.loc[~month_df['item_id'].isin(state['first_month']['item_id']), ['item_id']].drop_duplicates()
+        new_items['first_month_item_id_num'] = month
+        state['first_month'] = pd.concat([state['first_month'], new_items], ignore_index=True)
+
+        state['last_month'] = int(month)
+        return state
+
+# Month features:
+
+    def extract(self, month: int | None = None):
+        self.logger.info('Extracting sales of the new month and dicts...')
+        if month is None:
+            month = int(pq.read_table(self.config.get('cleaned_parquet'), columns=['date_block_num'])['date_block_num']\
+                        .to_pandas().max())
+        sales = pd.read_parquet(self.config.get('cleaned_parquet'), filters=[('date_block_num', '==', month)])
+        items = pd.read_csv(self.config.get('items'))
+        items_categories = pd.read_csv(self.config.get('item_categories'))
+        shops = pd.read_csv(self.config.get('shops'))
+        test = pd.read_csv(self.config.get('test'))
+        self.logger.info(f'Extracted {len(sales)} sales records of month {month}')
+        return month, sales, items, items_categories, shops, test
+
+    def month_schema(self, month_df, sales, items, items_categories, shops, test) -> pd.DataFrame:
+        # Same steps as BuildFeatures.full_schema, restricted to the rows of one month
+        bf = self.build_features
+        items, shops, items_categories = bf.encode_dicts(items.copy(), shops.copy(), items_categories.copy())
+        month_df = bf.merge_full_df_dicts(month_df, items, items_categories, shops)
+        sales = bf.merge_sales_dicts(sales, items, items_categories, shops)
+        month_df = bf.month_aggregations(month_df, sales)
+        month_df = bf.was_in_test(month_df, test)
+        return month_df
+
+    def transform(self, month_df: pd.DataFrame, state: dict, month: int) -> pd.DataFrame:
+        bf = self.build_features
+        self.logger.info(f'Computing history-dependent features for month {month} from incremental state...')
+
+        # first_month: item is new if it was never seen before this month
+        first_seen = month_df['item_id'].map(state['first_month'].set_index('item_id')['first_month_item_id_num'])
+        month_df['not_full_historical_data'] = np.int8(month == 0)
+        month_df['first_month_item_id'] = (first_seen.isna() | (first_seen >= month)).astype('int8')
+
+        # expanding window: accumulators cover all months before the new one
+        for feature in self.aggregating_target_by:
+            col = '_'.join(['target_aggregated_mean_premonthes', *feature])
+            col2 = '_'.join(['target_aggregated_max_premonthes', *feature])
+            accumulators = month_df[feature].merge(state['expanding'][self.expanding_name(feature)], on=feature, how='left')
+            month_df[col] = (accumulators['sum'] / accumulators['count'].where(accumulators['count'] > 0)).to_numpy()
+            month_df[col2] = accumulators['max'].to_numpy()
+
+        month_df = bf.year_month(month_df)
+
+        # lags: one small merge per shift against the stored sources of month - shift
+        shifted_columns = state['shifted_columns']
+        missing = [c for c in shifted_columns if c not in month_df.columns]
+        if missing:
+            raise KeyError(f'Lag sources {missing} are not produced for the new month')
+        for shift in state['shift_range']:
+            temp = state['lag_sources'][state['lag_sources']['date_block_num'] == month - shift].copy()
+            temp['date_block_num'] = temp['date_block_num'] + shift
+            temp = temp.rename(columns={c: f'{c}_lag_{shift}' for c in shifted_columns})
+            month_df = pd.merge(month_df, temp, on=self.all_obs_combination_by, how='left')
+            month_df = bf.downcast_dtypes(full_df=month_df, logs=False)
+        month_df = month_df.fillna(0)
+
+        month_df = bf.deltas(month_df)
+        return month_df
+
+    def store_dtypes(self) -> pd.Series:
+        dataset_path = self.config.get('features_dataset')
+        if dataset_path.exists():
+            return features_dataset(dataset_path).schema.empty_table().to_pandas().dtypes
+        return pq.read_schema(self.config.get('features')).empty_table().to_pandas().dtypes
+
+    def read_store(self) -> pd.DataFrame:
+        dataset_path = self.config.get('features_dataset')
+        if dataset_path.exists():
+            return read_features(dataset_path)
+        return pd.read_parquet(self.config.get('features'))
+
+    def write_store(self, df: pd.DataFrame, rewrite: bool = False):
+        # rewrite=False replaces only the months of df, rewrite=True writes df as the whole store (columns changed)
+        months = df['date_block_num'].unique()
+        dataset_path = self.config.get('features_dataset')
+        if dataset_path.exists():
+            if rewrite:
+                shutil.rmtree(dataset_path)
+            # Partitioned store: only partitions of the rebuilt months are (re)written
+            write_features(df, dataset_path)
+            self.logger.info(f'Wrote {len(df)} rows of months {list(months)} to {dataset_path}')
+            return
+
+        # Single file: rows of the rebuilt months are replaced, all other rows are taken over as they are
+        path = self.config.get('features')
+        new_table = pa.Table.from_pandas(df, preserve_index=False)
+        if not rewrite:
+            existing = pq.read_table(path)
+            months = pa.array(months)
+            kept = existing.filter(pa.compute.invert(pa.compute.is_in(existing['date_block_num'], value_set=months.cast(existing['date_block_num'].type))))
+            new_table = pa.concat_tables([kept, new_table.cast(existing.schema)])
+        pq.write_table(new_table, path)
+        self.logger.info(f'Appended {len(df)} rows of months {list(months)} to {path}')
+
+    def held_dtypes(self) -> pd.Series:
+        return features_dataset(self.held_path).schema.empty_table().to_pandas().dtypes
+
+    def load(self, frames: list[pd.DataFrame], state: dict, held_columns: list[str], test_month: int):
+        '''
+        Writes the rebuilt months to the features store and their history rows of `held_columns` to the held history.
+        Store columns are the columns of the full build without `held_columns`. While that set stays the same, only
+        partitions of the rebuilt months are written. When it changes, both are rewritten once: released columns
+        get their values back from the held history, newly held ones move into it.
+        '''
+        keys = self.all_obs_combination_by
+        held_before = state['held_columns']
+        store_columns = [c for c in state['columns'] if c not in held_columns]
+        dtypes = {**self.held_dtypes().to_dict(), **self.store_dtypes().to_dict()}
+        frames = [f[[c for c in state['columns'] if c in f.columns]].astype({c: dtypes[c] for c in f.columns if c in dtypes})
+                  for f in frames]
+        history = [f[keys + held_columns] for f in frames if (f['date_block_num'] < test_month).all()]
+        months = pd.concat([f['date_block_num'] for f in frames]).unique()
+
+        if set(held_columns) == set(held_before):
+            self.write_store(pd.concat([f[store_columns] for f in frames], ignore_index=True))
+        else:
+            released = [c for c in held_before if c not in held_columns]
+            moved = [c for c in held_columns if c not in held_before]
+            self.logger.info(f'Store columns changed: {released} are back from the held history, {moved} are held now')
+            existing = self.read_store()
+            existing = existing[~existing['date_block_num'].isin(months)].reset_index(drop=True)
+            held = read_features(self.held_path, exclude_months=list(months))
+            held['date_block_num'] = held['date_block_num'].astype(existing['date_block_num'].dtype)
+            if moved:
+                held = held.merge(existing[keys + moved], on=keys, how='left')
+            if released:
+                existing = existing.merge(held[keys + released], on=keys, how='left')
+            self.write_store(pd.concat([existing[store_columns], *[f[store_columns] for f in frames]], ignore_index=True), rewrite=True)
+            shutil.rmtree(self.held_path)
+            write_features(self.build_features.downcast_dtypes(held[keys + held_columns].reset_index(drop=True), logs=False), self.held_path)
+        if history: # months before the test month: their partitions of the held history are (re)written
+            write_features(pd.concat(history, ignore_index=True), self.held_path)
+            self.logger.info(f'Wrote held columns of months {[int(f["date_block_num"].iloc[0]) for f in history]} to {self.held_path}')
+        state['held_columns'] = held_columns
+
+    def run(self, month: int | None = None, refresh_test: bool = True, dry_run: bool = False):
+        self.logger.info('\n=== INCREMENTAL FEATURE ENGINEERING process started ===\n')
+        bf = self.build_features
+        state = self.load_state()
+        month, sales, items, items_categories, shops, test = self.extract(month)
+        if month != state['last_month'] + 1:
+            raise ValueError(f"Incremental state ends at month {state['last_month']}, can not append month {month}")
+        # Sales of the test month itself move the test set to the month after them
+        test_month = max(state['test_month'], month + 1)
+
+        base_df = bf.merge_df_aggregated(bf.blank_schema(sales), bf.sales_aggregation(sales))
+        month_df = self.month_schema(base_df, sales, items, items_categories, shops, test)
+        month_df = self.transform(month_df, state, month)
+        state = self.update_state(state, month_df, month)
+        frames = [month_df]
+
+        held_columns = state['held_columns']
+        if refresh_test:
+            self.logger.info(f'Recomputing test month {test_month} rows with updated state...')
+            test_df = pd.concat([base_df.iloc[:0], test.assign(date_block_num=test_month)], ignore_index=True)
+            test_df = test_df.drop('ID', axis=1)
+            test_df = self.month_schema(test_df, sales.iloc[:0], items, items_categories, shops, test)
+            frames.append(self.transform(test_df, state, test_month))
+            # Leakage of the refreshed test rows, as check_leakage of a full rebuild would find it
+            leakage = set(bf.leakage_features(frames[-1], test_month=test_month))
+            held_columns = [c for c in state['columns'] if c in leakage]
+
+        if not dry_run:
+            self.load(frames, state, held_columns, test_month)
+            state['test_month'] = test_month
+            self.save_state(state)
+        self.logger.info('\n=== INCREMENTAL FEATURE ENGINEERING process finished ===\n\n\n\n\n')
+        return frames
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+
+class LagCube:
+    '''
+    Dense month x (shop_id, item_id) index over full_df rows.
+
+    Every (shop_id, item_id) pair gets a dense integer index, every column is scattered into a
+    month-major array of shape (n_months, n_pairs). A lag of `shift` months is then a gather
+    from month - shift for the same pair instead of a hash join of the whole frame.
+    '''
+
+    def __init__(self, full_df: pd.DataFrame, keys: list[str] = ['shop_id', 'item_id'], time_col: str = 'date_block_num'):
+        pair_codes = np.zeros(len(full_df), dtype=np.int64)
+        for key in keys:
+            key_codes, uniques = pd.factorize(full_df[key], sort=True)
+            pair_codes = pair_codes * len(uniques) + key_codes
+        self.pair, pairs = pd.factorize(pair_codes, sort=True)
+        self.month = full_df[time_col].to_numpy().astype(np.int64)
+        self.n_pairs = len(pairs)
+        self.n_months = int(self.month.max()) + 1 if len(self.month) else 0
+        self.cell = self.month * self.n_pairs + self.pair
+
+        if len(np.unique(self.cell)) != len(self.cell):
+            raise ValueError(f'Rows are not unique by {[time_col, *keys]}, lag cube can not be built')
+
+    def cube(self, values: np.ndarray, dtype=np.float32) -> np.ndarray:
+        # Month-major array, cells without a row in full_df stay NaN (as missing rows after a left merge)
+        cube = np.full(self.n_months * self.n_pairs, np.nan, dtype=dtype)
+        cube[self.cell] = values
+        return cube
+
+    def shift(self, cube: np.ndarray, shift: int, out: np.ndarray | None = None, fill_value: float = np.nan) -> np.ndarray:
+        source_month = self.month - shift
+        valid = (source_month >= 0) & (source_month < self.n_months)
+        shifted = np.empty(len(self.month), dtype=cube.dtype) if out is None else out
+        shifted[~valid] = fill_value
+        shifted[valid] = cube[source_month[valid] * self.n_pairs + self.pair[valid]]
+        if fill_value == fill_value: # not NaN: also fill cells which have no source row
+            shifted[np.isnan(shifted)] = fill_value
+        return shifted
+
+    def lags(self, full_df: pd.DataFrame, columns: list[str], shift_range: list[int],
+             fill_value: float = np.nan, dtype=np.float32) -> pd.DataFrame:
+        # Same column order as the merge implementation: shift-major, then columns
+        names = [f'{col}_lag_{shift}' for shift in shift_range for col in columns]
+        position = {name: i for i, name in enumerate(names)}
+        # One preallocated block (column-contiguous), every lag column is gathered straight into it
+        block = np.empty((len(names), len(full_df)), dtype=dtype)
+        for col in columns:
+            cube = self.cube(full_df[col].to_numpy(), dtype=dtype)
+            for shift in shift_range:
+                self.shift(cube, shift, out=block[position[f'{col}_lag_{shift}']], fill_value=fill_value)
+            del cube
+        return pd.DataFrame(block.T, index=full_df.index, columns=names, copy=False)
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from .cumulative import cumulative_stats
+
+
+# Shared memory transport: arrays go to workers and back as (segment name, dtype, shape) handles,
+# only these small tuples are pickled.
+
+def share(array: np.ndarray) -> tuple[tuple, shared_memory.SharedMemory]:
+    array = np.ascontiguousarray(array)
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+    return (segment.name, array.dtype.str, array.shape), segment
+
+
+def attach(handle: tuple) -> tuple[np.ndarray, shared_memory.SharedMemory]:
+    name, dtype, shape = handle
+    segment = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf), segment
+
+
+def run_family(function, handles: dict[str, tuple], kwargs: dict) -> dict[str, tuple]:
+    # Worker side: attach inputs, compute the family, put every output column into its own segment.
+    # Output segments are unlinked by the parent once the columns are copied out.
+    inputs, segments = {}, []
+    for name, handle in handles.items():
+        inputs[name], segment = attach(handle)
+        segments.append(segment)
+    try:
+        outputs = function(inputs, **kwargs)
+        result = {}
+        for name, values in outputs.items():
+            result[name], segment = share(values)
+            segment.close()
+        return result
+    finally:
+        del inputs
+        for segment in segments:
+            segment.close()
+
+
+# Feature families: module level functions of numpy columns, the same code runs inline and in workers.
+
+def expanding_family(columns: dict[str, np.ndarray], keys: list[str], windows: list[int] = []) -> dict[str, np.ndarray]:
+    # Expanding (and rolling) mean/max of target for one key set, column order as BuildFeatures.expanding_window
+    frame = pd.DataFrame(columns, copy=False)
+    result = {}
+    for window in [None, *windows]:
+        mean, max_ = cumulative_stats(frame, keys, window=window)
+        for stat, values in (('mean', mean), ('max', max_)):
+            prefix = f'target_aggregated_{stat}_premonthes' if window is None else f'target_aggregated_{stat}_last_{window}_monthes'
+            result['_'.join([prefix, *keys])] = values.astype(np.float32)
+    return result
+
+
+def month_aggregation_family(columns: dict[str, np.ndarray], key: str, aggregations: dict[str, str]) -> dict[str, np.ndarray]:
+    # Monthly aggregations of item_cnt_day by (date_block_num, key), looked up by integer codes for full_df rows.
+    # Inputs: full.date_block_num, full.<key>, sales.date_block_num, sales.<key>, sales.item_cnt_day
+    full_months = columns['full.date_block_num'].astype(np.int64)
+    sales = pd.DataFrame({'date_block_num': columns['sales.date_block_num'], key: columns[f'sales.{key}'],
+                          'item_cnt_day': columns['sales.item_cnt_day']}, copy=False)
+    n_months = int(max(full_months.max(), sales['date_block_num'].max())) + 1
+    temp = sales.groupby(['date_block_num', key], sort=False)['item_cnt_day'].agg(list(aggregations.values()))
+
+    key_values = pd.Index(temp.index.get_level_values(key).unique())
+    temp_cells = temp.index.get_level_values('date_block_num').to_numpy().astype(np.int64) * len(key_values) \
+        + key_values.get_indexer(temp.index.get_level_values(key))
+    full_codes = key_values.get_indexer(columns[f'full.{key}'])
+    full_cells = np.where(full_codes >= 0, full_months * len(key_values) + full_codes, -1)
+
+    result = {}
+    for suffix, agg_func in aggregations.items():
+        lookup = np.full(n_months * len(key_values) + 1, np.nan) # last cell: key is missing in sales
+        lookup[temp_cells] = temp[agg_func].to_numpy(dtype=np.float64)
+        result[f'target_{key}_{suffix}'] = lookup[full_cells].astype(np.float32)
+    return result
+
+
+# Lags every delta output is computed from
+DELTA_LAGS = {'delta_1_2': (1, 2), 'delta_2_3': (2, 3), 'predict_1_2': (1, 2), 'predict_2_3': (1, 2, 3)}
+
+
+def delta_family(columns: dict[str, np.ndarray], target: str, outputs: list[str] | None = None) -> dict[str, np.ndarray]:
+    # Deltas and naive predictions from the first three lags of `target`; `outputs` (DELTA_LAGS keys) limits
+    # the computed columns, `columns` then only needs their lags
+    outputs = list(DELTA_LAGS) if outputs is None else outputs
+    lag_1, lag_2, lag_3 = (columns.get(f'{target}_lag_{n}') for n in (1, 2, 3))
+    delta_1_2 = lag_1 - lag_2 if {'delta_1_2', 'predict_1_2', 'predict_2_3'} & set(outputs) else None
+    delta_2_3 = lag_2 - lag_3 if {'delta_2_3', 'predict_2_3'} & set(outputs) else None
+    predict_1_2 = lag_1 + delta_1_2 if {'predict_1_2', 'predict_2_3'} & set(outputs) else None
+    predict_2_3 = lag_1 + delta_2_3 + predict_1_2 if 'predict_2_3' in outputs else None
+    values = {'delta_1_2': delta_1_2, 'delta_2_3': delta_2_3, 'predict_1_2': predict_1_2, 'predict_2_3': predict_2_3}
+    return {f'{target}_{suffix}': values[suffix] for suffix in DELTA_LAGS if suffix in outputs}
+
+
+class FeatureFamilies():
+    '''
+    Runs independent feature families (expanding window keys, month aggregation keys, deltas of every target)
+    concurrently in a process pool.
+
+    A family is (name, function, inputs, kwargs): `inputs` maps input names to numpy columns, and only these
+    columns are sent to the worker computing it. Inputs and resulting columns travel through shared memory
+    segments, pickling only (name, dtype, shape) handles. Results are returned in family order, and within
+    a family in the order the function creates them, so the column order does not depend on which worker
+    finishes first.
+
+    With workers=1 families run one after another in the calling process, without a pool.
+    The pool is started on the first parallel run and kept until close() (workers import the package once).
+    'spawn' is the default start method: forking a process that already runs Arrow/BLAS threads is not safe.
+
+    Example:
+        families = FeatureFamilies(config, logger, workers=3)
+        columns = families.run([(f'expanding {keys}', expanding_family, {...}, {'keys': keys}) for keys in ...])
+        families.close()
+    '''
+
+    def __init__(self, config, logger, workers: int = 1, start_method: str = 'spawn'):
+        if workers < 1:
+            raise ValueError(f'workers has to be at least 1, got {workers}')
+        self.config = config
+        self.logger = logger
+        self.workers = workers
+        self.start_method = start_method
+        self.pool = None
+
+    def executor(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            self.logger.info(f'Starting feature families pool with {self.workers} workers ({self.start_method})')
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(self.start_method))
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def run(self, families: list[tuple]) -> dict[str, np.ndarray]:
+        if self.workers == 1 or len(families) < 2:
+            result = {}
+            for name, function, inputs, kwargs in families:
+                result.update(function(inputs, **kwargs))
+                self.logger.info(f'Feature family {name} finished')
+            return result
+
+        # Every distinct input column is shared once, even if several families read it
+        shared, segments = {}, []
+        try:
+            for _, _, inputs, _ in families:
+                for input_name, values in inputs.items():
+                    if input_name not in shared:
+                        shared[input_name], segment = share(values)
+                        segments.append(segment)
+            pool = self.executor()
+            futures = [pool.submit(run_family, function, {input_name: shared[input_name] for input_name in inputs}, kwargs) \
+                       for _, function, inputs, kwargs in families]
+
+            result = {}
+            try:
+                for (name, _, _, _), future in zip(families, futures):
+                    for column, handle in future.result().items():
+                        values, segment = attach(handle)
+                        result[column] = values.copy()
+                        del values
+                        segment.close()
+                        segment.unlink()
+                    self.logger.info(f'Feature family {name} finished')
+            except BaseException:
+                # A family failed: outputs of the families which did finish are still in shared memory
+                for future in futures:
+                    if future.done() and future.exception() is None:
+                        for handle in future.result().values():
+                            try:
+                                segment = attach(handle)[1]
+                            except FileNotFoundError: # already copied and unlinked above
+                                continue
+                            segment.close()
+                            segment.unlink()
+                raise
+            return result
+        finally:
+            for segment in segments:
+                segment.close()
+                segment.unlink()
@@ -1,67 +1,270 @@
+from __future__ import annotations
+
 import numpy as np
 import pandas as pd
 import xgboost as xgb
 import pickle
+import json
+
+from .data_iter import ParquetBatches, scan_categories
+from ..data.feature_matrix import FeatureMatrix
+from ..data.sparse_matrix import MIN_ZERO_SHARE, sparse_columns, to_csr
+from ..utils.profiler import profile_stage
+
+MODEL_FORMATS = ('pickle', 'ubj', 'json')
+TRAIN_DATA = ('memory', 'quantile', 'external', 'matrix', 'sparse')
 
 class XGB_model():
+    categorical = ['shop_id','item_id','item_category_id','city']
 
-    def __init__(self, config, logger):
+    def __init__(self, config, logger, model_format: str = 'pickle', column_cache=None):
+        '''
+        model_format='pickle' pickles the whole XGBRegressor (config 'xgb_model'), 'ubj'/'json' save the booster in
+        XGBoost's native format ('xgb_model_ubj'/'xgb_model_json') with features and categories in 'xgb_model_meta'.
+        A native model is loaded straight into an xgb.Booster, without the sklearn wrapper and without unpickling.
+        column_cache (data/column_cache.py ColumnCache): train_x, train_y and inference are read as memory-mapped
+        .npy columns instead of decoding parquet on every run.
+        '''
+        if model_format not in MODEL_FORMATS:
+            raise ValueError(f"Unknown model format '{model_format}', use one of {MODEL_FORMATS}")
         self.config = config
         self.logger = logger
+        self.model_format = model_format
+        self.column_cache = column_cache
         self.model = xgb.XGBRegressor()
+        self.meta = {}
+
+    def read_columns(self, source, columns: list[str]) -> pd.DataFrame:
+        if self.column_cache is not None:
+            return self.column_cache.read(source, columns)
+        return pd.read_parquet(source, columns=columns)
 
     def get_train_data(self):
         self.logger.info('Uploading training data...')
-        X = pd.read_parquet(self.config.get('train_x'))
-        y = pd.read_parquet(self.config.get('train_y'))
+        # Column projection: only features used by the model are decoded
+        X = self.read_columns(self.config.get('train_x'), columns=self.config.get_xgb('important_features'))
+        y = self.read_columns(self.config.get('train_y'), columns=['target'])
         return X, y
 
     def get_inference_data(self):
         self.logger.info('Uploading inference data...')
-        inference_for = pd.read_parquet(self.config.get('inference'))
+        inference_for = self.read_columns(self.config.get('inference'), columns=self.config.get_xgb('important_features'))
         return inference_for
 
+    def model_path(self):
+        return self.config.get('xgb_model' if self.model_format == 'pickle' else f'xgb_model_{self.model_format}')
+
     def save_model(self):
-        path = self.config.get('xgb_model')
+        path = self.model_path()
         self.logger.info(f'Saving model to {path}...')
-        with open(path, 'wb') as f:
-            pickle.dump(self.model, f)
+        if self.model_format == 'pickle':
+            with open(path, 'wb') as f:
+                pickle.dump(self.model, f)
+            return
+        self.booster().save_model(path)
+        with open(self.config.get('xgb_model_meta'), 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, indent=2)
+        self.logger.info(f"Model metadata saved to {self.config.get('xgb_model_meta')}")
 
+    def booster(self) -> xgb.Booster:
+        return self.model if isinstance(self.model, xgb.Booster) else self.model.get_booster()
 
-    def train(self, save: bool=False):
-        params =  self.config.get_xgb('xgb_params')
-        X, y = self.get_train_data()
-        X = self.select_features(X)
-        self.model = xgb.XGBRegressor(**params)
-        self.logger.info('Fit...')
-        self.model.fit(X, y)
+    def model_meta(self, categories: dict[str, list]) -> dict:
+        # Saved next to a native model: feature order, types and categories of categorical columns at training time
+        booster = self.booster()
+        return {
+            'xgboost_version': xgb.__version__,
+            'features': booster.feature_names,
+            'feature_types': booster.feature_types,
+            'categories': categories,
+            'params': self.config.get_xgb('xgb_params') if isinstance(self.model, xgb.Booster) else self.model.get_xgb_params(),
+        }
+
+    def frame_categories(self, X) -> dict[str, list]:
+        return {column: X[column].cat.categories.tolist() for column in self.categorical if column in X.columns}
+
+    def booster_params(self) -> tuple[dict, int]:
+        # xgb_params are XGBRegressor arguments: n_estimators is the number of rounds, enable_categorical goes to the DMatrix
+        params = dict(self.config.get_xgb('xgb_params'))
+        num_boost_round = params.pop('n_estimators', 100)
+        params.pop('enable_categorical', None)
+        return params, num_boost_round
+
+
+    def train(self, save: bool=False, profiler=None, train_data: str='memory'):
+        '''
+        train_data='memory' reads train_x/train_y into pandas and fits XGBRegressor.
+        'quantile' streams parquet row groups through ParquetBatches into a QuantileDMatrix, 'external' into an
+        ExtMemQuantileDMatrix with pages cached on disk (config 'xgb_external_memory', xgboost >= 3.0); both train an xgb.Booster
+        and never hold the training set as a DataFrame.
+        'matrix' builds a QuantileDMatrix straight from the memory-mapped float32 matrix of FeatureMatrix
+        (BuildFeatures.run(output_format='matrix'), no Split needed) and trains an xgb.Booster.
+        'sparse' builds it from the same matrix converted to CSR, zeros of zero-dominated columns are not stored
+        (data/sparse_matrix.py): XGBoost treats them as missing values, predict_values() converts inference data the same way.
+        '''
+        if train_data not in TRAIN_DATA:
+            raise ValueError(f"Unknown train_data '{train_data}', use one of {TRAIN_DATA}")
+        if train_data == 'external' and not hasattr(xgb, 'ExtMemQuantileDMatrix'):
+            raise ImportError(f"train_data='external' needs xgboost >= 3.0 (ExtMemQuantileDMatrix), installed: {xgb.__version__}")
+        if train_data == 'matrix':
+            self.train_matrix(profiler=profiler)
+        elif train_data == 'sparse':
+            self.train_sparse(profiler=profiler)
+        elif train_data != 'memory':
+            self.train_streaming(external=train_data == 'external', profiler=profiler)
+        else:
+            self.train_in_memory(profiler=profiler)
         self.logger.info(f'XGB has been trained')
         if save:
-            self.save_model()
+            with profile_stage(profiler, 'model.save', outputs=[self.model_path()]):
+                self.save_model()
         return self.model
 
+    def train_in_memory(self, profiler=None):
+        params =  self.config.get_xgb('xgb_params')
+        with profile_stage(profiler, 'model.get_train_data', inputs=[self.config.get('train_x'), self.config.get('train_y')]) as record:
+            X, y = self.get_train_data()
+            X = self.select_features(X)
+            record['rows_out'] = len(X)
+        self.model = xgb.XGBRegressor(**params)
+        self.logger.info('Fit...')
+        with profile_stage(profiler, 'model.fit', rows_in=len(X)):
+            self.model.fit(X, y)
+        self.meta = self.model_meta(self.frame_categories(X))
+
+    def train_streaming(self, external: bool=False, profiler=None):
+        features = self.config.get_xgb('important_features')
+        inputs = [self.config.get('train_x'), self.config.get('train_y')]
+        with profile_stage(profiler, 'model.get_train_data', inputs=inputs) as record:
+            self.logger.info(f"Streaming training data into {'external memory' if external else 'QuantileDMatrix'}...")
+            categories = scan_categories(self.config.get('train_x'), [c for c in self.categorical if c in features])
+            cache_prefix = None
+            if external:
+                cache_dir = self.config.get('xgb_external_memory')
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                cache_prefix = str(cache_dir / 'train')
+            batches = ParquetBatches(*inputs, features=features, categories=categories, cache_prefix=cache_prefix)
+            matrix = xgb.ExtMemQuantileDMatrix if external else xgb.QuantileDMatrix
+            dtrain = matrix(batches, enable_categorical=True)
+            record['rows_out'] = dtrain.num_row()
+        params, num_boost_round = self.booster_params()
+        self.logger.info(f'Fit on {dtrain.num_row()} rows...')
+        with profile_stage(profiler, 'model.fit', rows_in=dtrain.num_row()):
+            self.model = xgb.train(params, dtrain, num_boost_round=num_boost_round)
+        self.meta = self.model_meta(categories)
+        del dtrain, batches
+
+    def train_matrix(self, profiler=None):
+        matrix = FeatureMatrix(self.config, self.logger).open()
+        if matrix.features() != self.config.get_xgb('important_features'):
+            self.logger.warning('!!! Features of the feature matrix differ from important_features in config')
+        with profile_stage(profiler, 'model.get_train_data', inputs=[self.config.get('feature_matrix')]) as record:
+            self.logger.info('Building QuantileDMatrix from the feature matrix...')
+            # Column-major float32 memmap goes to XGBoost through the array interface, categorical columns hold codes
+            dtrain = xgb.QuantileDMatrix(matrix.array('train_x'), label=matrix.array('train_y'), feature_names=matrix.features(),
+                                         feature_types=matrix.feature_types(), enable_categorical=True)
+            matrix.arrays.clear() # quantized copy is all fit needs: pages of the matrix are unmapped before training
+            record['rows_out'] = dtrain.num_row()
+        params, num_boost_round = self.booster_params()
+        self.logger.info(f'Fit on {dtrain.num_row()} rows...')
+        with profile_stage(profiler, 'model.fit', rows_in=dtrain.num_row()):
+            self.model = xgb.train(params, dtrain, num_boost_round=num_boost_round)
+        self.meta = self.model_meta(matrix.categories('train'))
+        del dtrain
+
+    def train_sparse(self, profiler=None, min_zero_share: float = MIN_ZERO_SHARE):
+        matrix = FeatureMatrix(self.config, self.logger).open()
+        if matrix.features() != self.config.get_xgb('important_features'):
+            self.logger.warning('!!! Features of the feature matrix differ from important_features in config')
+        with profile_stage(profiler, 'model.get_train_data', inputs=[self.config.get('feature_matrix')]) as record:
+            X = matrix.array('train_x')
+            sparse = sparse_columns(X, matrix.features(), matrix.feature_types(), min_zero_share)
+            self.logger.info(f'Building CSR matrix, {len(sparse)} of {len(matrix.features())} columns sparse...')
+            csr = to_csr(X, [feature in sparse for feature in matrix.features()])
+            csr_mb = (csr.data.nbytes + csr.indices.nbytes + csr.indptr.nbytes) / 1024 ** 2
+            self.logger.info(f'CSR matrix: {csr.nnz} of {X.size} values stored, {csr_mb:.1f} MB (dense {X.nbytes / 1024 ** 2:.1f} MB)')
+            dtrain = xgb.QuantileDMatrix(csr, label=matrix.array('train_y'), feature_names=matrix.features(),
+                                         feature_types=matrix.feature_types(), enable_categorical=True)
+            del X, csr
+            matrix.arrays.clear()
+            record['rows_out'] = dtrain.num_row()
+            record['csr_mb'] = csr_mb
+        params, num_boost_round = self.booster_params()
+        self.logger.info(f'Fit on {dtrain.num_row()} rows...')
+        with profile_stage(profiler, 'model.fit', rows_in=dtrain.num_row()):
+            self.model = xgb.train(params, dtrain, num_boost_round=num_boost_round)
+        # Saved with the booster in every format: predict_values() has to drop zeros of the same columns
+        self.model.set_attr(sparse_features=json.dumps(sparse))
+        self.meta = self.model_meta(matrix.categories('train'))
+        del dtrain
+
     def load_model(self):
-        path = self.config.get('xgb_model')
-        self.logger.info(f'Uploading model from .pkl, \
+        path = self.model_path()
+        self.logger.info(f'Uploading model from {self.model_format} file, \
                          \nPath: {path}...')
-        with open(path, 'rb') as f:
-            self.model = pickle.load(f)
+        if self.model_format == 'pickle':
+            with open(path, 'rb') as f:
+                self.model = pickle.load(f)
+        else:
+            self.model = xgb.Booster(model_file=str(path))
+            with open(self.config.get('xgb_model_meta'), encoding='utf-8') as f:
+                self.meta = json.load(f)
+            if self.meta['features'] != self.config.get_xgb('important_features'):
+                self.logger.warning('!!! Features of the loaded model differ from important_features in config')
         self.logger.info('Model uploaded successfully')
 
-    def predict(self, load: bool=True, save: bool=True):
+    def predict_values(self, X):
+        # Booster of a native model predicts in place, the same call XGBRegressor.predict makes
+        sparse = self.booster().attr('sparse_features')
+        if sparse is not None: # trained with train_data='sparse': zeros of these columns were missing values
+            sparse, features = json.loads(sparse), self.booster().feature_names
+            X = to_csr(X[features] if isinstance(X, pd.DataFrame) else X, [feature in sparse for feature in features])
+        if isinstance(self.model, xgb.Booster):
+            return self.model.inplace_predict(X)
+        return self.model.predict(X)
+
+    def predict(self, load: bool=True, save: bool=True, profiler=None, inference_data: str='parquet'):
+        # inference_data='matrix' predicts the inference matrix of FeatureMatrix instead of inference.parquet
+        if inference_data not in ('parquet', 'matrix'):
+            raise ValueError(f"Unknown inference_data '{inference_data}', use 'parquet' or 'matrix'")
         self.logger.info('Starting prediction function...')
         if load:
-            self.load_model()
-        inference_for = self.get_inference_data()
-        inference_for = self.select_features(X=inference_for)
+            with profile_stage(profiler, 'model.load', inputs=[self.model_path()]):
+                self.load_model()
+        if inference_data == 'matrix':
+            with profile_stage(profiler, 'model.get_inference_data', inputs=[self.config.get('feature_matrix')]) as record:
+                inference_for = FeatureMatrix(self.config, self.logger).array('inference_x')
+                record['rows_out'] = len(inference_for)
+        else:
+            with profile_stage(profiler, 'model.get_inference_data', inputs=[self.config.get('inference')]) as record:
+                inference_for = self.get_inference_data()
+                inference_for = self.select_features(X=inference_for)
+                record['rows_out'] = len(inference_for)
         self.logger.info('XGBoost is Predicting now...')
-        predicted = self.model.predict(inference_for)
+        with profile_stage(profiler, 'model.predict', rows_in=len(inference_for)) as record:
+            predicted = self.predict_values(inference_for)
+            record['rows_out'] = len(predicted)
         if save:
-            df_predicted = self.save_prediction(predicted)
+            with profile_stage(profiler, 'model.save_prediction', outputs=[self.config.get('predict')]):
+                df_predicted = self.save_prediction(predicted)
         self.logger.info('Prediction process completed🫡')
         return df_predicted
 
 
+    def predict_subset(self, index, shop_ids=None, item_ids=None, shops=None) -> pd.DataFrame:
+        '''
+        Scores only the requested (shop_id, item_id) pairs, or every pair of `shops`, fetched from a FeatureIndex
+        (data/feature_index.py) instead of the whole inference.parquet. Categories of the whole month are applied,
+        so values are the same as predict() gives for these rows. The model has to be loaded or trained.
+        '''
+        columns = self.config.get_xgb('important_features') # only these memory-mapped columns are gathered
+        rows = index.shops(shops, columns) if shops is not None else index.lookup(shop_ids, item_ids, columns)
+        self.logger.info(f'Predicting {len(rows)} rows from feature index...')
+        X = self.select_features(rows, categories=index.categories())
+        predicted = np.clip(self.predict_values(X), 0, 20) if len(X) else np.empty(0, dtype=np.float32)
+        return pd.DataFrame({'ID': rows['ID'].to_numpy(), 'shop_id': rows['shop_id'].to_numpy(),
+                             'item_id': rows['item_id'].to_numpy(), 'item_cnt_month': predicted})
+
     def save_prediction(self, predicted):
         self.logger.info('Saving predictions in appropriate format...')
         inference_y = predicted
@@ -73,11 +276,15 @@ class XGB_model():
         df_y_pred.to_csv(self.config.get('predict'), index=False)
         return df_y_pred
 
-    def select_features(self, X):
+    def select_features(self, X, categories: dict[str, list] | None = None):
+        # `categories` fixes the categories of categorical columns (a subset of rows has to get the codes of the whole month)
         self.logger.info('Selecting only important features from given data...')
         important_features = self.config.get_xgb('important_features')
-        X = X[important_features].copy()
-        categorical = ['shop_id','item_id','item_category_id','city']
+        X = pd.DataFrame({column: X[column] for column in important_features}, copy=False) # memory-mapped columns stay mapped
         self.logger.info('Marking categorical features...')
-        X[categorical] =  X[categorical].astype('category')
+        if categories is None:
+            X[self.categorical] =  X[self.categorical].astype('category')
+        else:
+            for column in self.categorical:
+                X[column] = pd.Categorical(X[column], categories=categories[column])
         return X
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import xgboost as xgb
+
+
+def scan_categories(path: Path, columns: list[str]) -> dict[str, list]:
+    # Sorted unique values of every categorical column, read one column at a time.
+    # Same categories as astype('category') on the whole frame, so every batch gets the same codes.
+    return {column: np.sort(pc.unique(pq.read_table(path, columns=[column])[column]).to_numpy()).tolist() \
+            for column in columns}
+
+
+class ParquetBatches(xgb.DataIter):
+    '''
+    Feeds train_x/train_y parquet files to XGBoost row group by row group.
+
+    Only `features` are decoded, categorical columns get the categories of the whole file (scan_categories), so
+    QuantileDMatrix / ExtMemQuantileDMatrix built from the batches see the same codes as the in-memory frame.
+    At most one row group (256k rows, see features_store.ROW_GROUP_SIZE) is in memory as a DataFrame at a time.
+    With `cache_prefix` XGBoost keeps the pages on disk (external memory), otherwise in a compressed QuantileDMatrix.
+    '''
+
+    def __init__(self, x_path: Path, y_path: Path, features: list[str], categories: dict[str, list],
+                 target: str = 'target', cache_prefix: str | None = None):
+        self.x_file = pq.ParquetFile(x_path)
+        self.y_file = pq.ParquetFile(y_path)
+        if [self.x_file.metadata.row_group(i).num_rows for i in range(self.x_file.num_row_groups)] != \
+                [self.y_file.metadata.row_group(i).num_rows for i in range(self.y_file.num_row_groups)]:
+            raise ValueError(f'Row groups of {x_path} and {y_path} are not aligned, write them with the same row_group_size')
+        self.features = features
+        self.categories = categories
+        self.target = target
+        self.position = 0
+        super().__init__(cache_prefix=cache_prefix, release_data=True)
+
+    def reset(self):
+        self.position = 0
+
+    def next(self, input_data) -> bool:
+        if self.position == self.x_file.num_row_groups:
+            return False
+        X = self.x_file.read_row_group(self.position, columns=self.features).to_pandas()
+        for column, categories in self.categories.items():
+            X[column] = pd.Categorical(X[column], categories=categories)
+        y = self.y_file.read_row_group(self.position, columns=[self.target]).column(0).to_numpy()
+        input_data(data=X, label=y)
+        self.position += 1
+        return True
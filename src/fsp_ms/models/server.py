@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+import pandas as pd
+
+from .XGB_model import XGB_model
+
+
+class PredictionService():
+    '''
+    Warm XGB_model for per-request predictions: the model is loaded and inference.parquet is read and passed
+    through select_features() once, requests only look rows up by (shop_id, item_id) and predict them.
+
+    Concurrent requests are micro-batched: a single batching thread collects requests for up to `batch_wait_ms`
+    (or until `max_batch_rows` rows) and runs one model.predict() call for all of them. Predictions are the same as
+    XGB_model.predict() gives for these rows (same categorical codes, clipped to [0, 20]), pairs missing from
+    inference data get None. Latencies of the last `latency_window` requests are kept for stats().
+
+    Example:
+        service = PredictionService(config, logger).start()
+        service.predict_pairs([5, 5], [5037, 5320])  # -> {'ID': [...], 'item_cnt_month': [...]}
+        serve(service, port=8008)                    # HTTP endpoint, see serve()
+    '''
+
+    def __init__(self, config, logger, model: XGB_model | None = None, max_batch_rows: int = 65536,
+                 batch_wait_ms: float = 2.0, latency_window: int = 10000):
+        self.config = config
+        self.logger = logger
+        self.model = model if model is not None else XGB_model(config, logger)
+        self.max_batch_rows = max_batch_rows
+        self.batch_wait = batch_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.latencies = deque(maxlen=latency_window) # ms per request
+        self.batch_sizes = deque(maxlen=latency_window) # requests per model call
+        self.lock = threading.Lock()
+        self.batcher = None
+        self.features = None
+
+    def load(self):
+        started = time.perf_counter()
+        self.model.load_model()
+        features = self.model.select_features(self.model.get_inference_data())
+        # Row position = ID, as in XGB_model.save_prediction; pairs are packed into one int64 key per row
+        self.keys = self.pair_keys(features['shop_id'].to_numpy(dtype=np.int64), features['item_id'].to_numpy(dtype=np.int64))
+        self.index = pd.Index(self.keys)
+        if not self.index.is_unique:
+            raise ValueError('Inference data has duplicated (shop_id, item_id) pairs, rows can not be looked up')
+        self.features = features
+        self.model.predict_values(features.iloc[:1]) # warm-up: first call builds predictor caches
+        self.logger.info(f'Prediction service loaded {len(features)} rows x {features.shape[1]} features '
+                         f'in {time.perf_counter() - started:.2f}s')
+        return self
+
+    def pair_keys(self, shop_ids: np.ndarray, item_ids: np.ndarray) -> np.ndarray:
+        return shop_ids << 32 | item_ids
+
+    def start(self):
+        if self.features is None:
+            self.load()
+        with self.lock:
+            if self.batcher is None:
+                self.batcher = threading.Thread(target=self.batch_loop, name='prediction-batcher', daemon=True)
+                self.batcher.start()
+        return self
+
+    def stop(self):
+        # Requests are queued under the same lock: every request accepted before the stop marker is still predicted
+        with self.lock:
+            batcher, self.batcher = self.batcher, None
+            if batcher is not None:
+                self.requests.put(None)
+        if batcher is not None:
+            batcher.join()
+
+# Batching:
+
+    def batch_loop(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch, rows = [request], len(request[0])
+            deadline = time.perf_counter() + self.batch_wait
+            while rows < self.max_batch_rows:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is None: # stop after this batch
+                    self.requests.put(None)
+                    break
+                batch.append(request)
+                rows += len(request[0])
+            self.run_batch(batch)
+
+    def run_batch(self, batch: list[tuple[np.ndarray, Future]]):
+        try:
+            positions = np.concatenate([positions for positions, _ in batch])
+            predicted = np.clip(self.model.predict_values(self.features.iloc[positions]), 0, 20) if len(positions) \
+                else np.empty(0, dtype=np.float32)
+        except Exception as error:
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        with self.lock:
+            self.batch_sizes.append(len(batch))
+        for (positions, future), values in zip(batch, np.split(predicted, np.cumsum([len(p) for p, _ in batch])[:-1])):
+            future.set_result(values)
+
+# Requests:
+
+    def predict_pairs(self, shop_ids: list[int], item_ids: list[int]) -> dict:
+        started = time.perf_counter()
+        if len(shop_ids) != len(item_ids):
+            raise ValueError(f'Got {len(shop_ids)} shop_id and {len(item_ids)} item_id values')
+        positions = self.index.get_indexer(self.pair_keys(np.asarray(shop_ids, dtype=np.int64), np.asarray(item_ids, dtype=np.int64)))
+        found = positions >= 0
+        future = Future()
+        with self.lock:
+            if self.batcher is None:
+                raise RuntimeError('Prediction service is not running, call start() first')
+            self.requests.put((positions[found], future))
+        values = future.result()
+
+        predicted = np.full(len(positions), np.nan)
+        predicted[found] = values
+        with self.lock:
+            self.latencies.append((time.perf_counter() - started) * 1000)
+        return {
+            'ID': [int(p) if p >= 0 else None for p in positions],
+            'item_cnt_month': [float(v) if v == v else None for v in predicted],
+        }
+
+    def stats(self) -> dict:
+        with self.lock:
+            latencies = np.array(self.latencies)
+            batch_sizes = np.array(self.batch_sizes)
+        percentiles = {f'p{q}_ms': float(np.percentile(latencies, q)) if len(latencies) else None for q in (50, 90, 99)}
+        return {
+            'requests': len(latencies),
+            **percentiles,
+            'max_ms': float(latencies.max()) if len(latencies) else None,
+            'mean_requests_per_batch': float(batch_sizes.mean()) if len(batch_sizes) else None,
+            'rows': 0 if self.features is None else len(self.features),
+        }
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    # POST /predict {"shop_id": [...], "item_id": [...]} or {"pairs": [[shop_id, item_id], ...]}; GET /stats, GET /health
+
+    def send_json(self, status: int, body: dict):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self.send_json(200, self.server.service.stats())
+        else:
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try: # request errors
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if 'pairs' in body:
+                pairs = np.asarray(body['pairs'], dtype=np.int64).reshape(-1, 2)
+                shop_ids, item_ids = pairs[:, 0], pairs[:, 1]
+            else:
+                shop_ids, item_ids = np.asarray(body['shop_id'], dtype=np.int64), np.asarray(body['item_id'], dtype=np.int64)
+            if shop_ids.shape != item_ids.shape or shop_ids.ndim != 1:
+                raise ValueError(f'Got {shop_ids.size} shop_id and {item_ids.size} item_id values')
+        except (ValueError, KeyError, TypeError, OverflowError) as error:
+            self.send_json(400, {'error': str(error)})
+            return
+        try: # service errors: the client still gets a response
+            result = self.server.service.predict_pairs(shop_ids, item_ids)
+        except Exception as error:
+            if self.server.service.batcher is None: # service stopped
+                self.send_json(503, {'error': str(error)})
+                return
+            self.server.service.logger.error(f'Prediction failed: {error!r}')
+            self.send_json(500, {'error': f'Prediction failed: {error}'})
+            return
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        self.server.service.logger.debug(f'{self.address_string()} {format % args}')
+
+
+class PredictionHTTPServer(HTTPServer):
+    # Requests are handled by a fixed thread pool instead of a new thread per connection
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], service: PredictionService, threads: int = 8):
+        super().__init__(address, PredictionHandler)
+        self.service = service
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='prediction-http')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+def serve(service: PredictionService, host: str = '127.0.0.1', port: int = 8008, threads: int = 8):
+    service.start()
+    server = PredictionHTTPServer((host, port), service, threads=threads)
+    service.logger.info(f'Prediction service listening on http://{host}:{server.server_address[1]} ({threads} threads)')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.stop()
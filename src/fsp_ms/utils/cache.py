@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import hashlib
+import inspect
+import json
+import time
+from pathlib import Path
+
+import pandas as pd
+
+
+class StageCache:
+    '''
+    Content-hashed cache of intermediate DataFrames for pipeline stages.
+
+    Key of a stage = sha256 of: stage name + content hashes of its input files + stage parameters
+    + source code of the objects the stage depends on. Stages with a matching key are loaded
+    from `config.get('stage_cache')` (03_interim) instead of being executed.
+    Cache size is kept bounded: entries older than `max_age_days` are removed, then the least
+    recently used ones until the directory is below `max_size_gb`.
+
+    Example:
+        cache = StageCache(config, logger, max_size_gb=20)
+        etl.run(validator_object=etl_validator, validation_schema=etl_schema, dry_run=False, cache=cache)
+    '''
+
+    def __init__(self, config, logger, max_size_gb: float = 20, max_age_days: float = 30):
+        self.config = config
+        self.logger = logger
+        self.cache_dir = Path(config.get('stage_cache'))
+        self.max_size_bytes = max_size_gb * 1024 ** 3
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.file_hashes_path = self.cache_dir / 'file_hashes.json'
+
+    def file_hash(self, path: Path) -> str:
+        # Content hash, memoized by (size, mtime) so unchanged big csv files are read only once
+        path = Path(path)
+        stat = path.stat()
+        memo = {}
+        if self.file_hashes_path.exists():
+            memo = json.loads(self.file_hashes_path.read_text(encoding='utf-8'))
+        entry = memo.get(str(path.resolve()))
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha256']
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 ** 2), b''):
+                digest.update(chunk)
+        memo[str(path.resolve())] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.file_hashes_path.write_text(json.dumps(memo, indent=2), encoding='utf-8')
+        return digest.hexdigest()
+
+    def code_version(self, *objects) -> str:
+        digest = hashlib.sha256()
+        for obj in objects:
+            digest.update(inspect.getsource(obj).encode('utf-8'))
+        return digest.hexdigest()
+
+    def key(self, stage: str, inputs: list[Path] = [], params: dict = {}, code: list = []) -> str:
+        payload = {
+            'stage': stage,
+            'inputs': [self.file_hash(path) for path in inputs],
+            'params': params,
+            'code': self.code_version(*code),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def path(self, stage: str, key: str) -> Path:
+        return self.cache_dir / f'{stage}-{key[:20]}.parquet'
+
+    def exists(self, stage: str, key: str) -> bool:
+        return self.path(stage, key).exists()
+
+    def load(self, stage: str, key: str) -> pd.DataFrame | None:
+        path = self.path(stage, key)
+        if not path.exists():
+            self.logger.info(f'Stage cache miss: {stage}')
+            return None
+        self.logger.info(f'Stage cache hit: {stage}, loading {path.name}...')
+        path.touch() # mtime marks last use for eviction
+        return pd.read_parquet(path)
+
+    def save(self, stage: str, key: str, df: pd.DataFrame):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.path(stage, key)
+        df.to_parquet(path, engine='pyarrow')
+        self.logger.info(f'Stage {stage} cached to {path.name}')
+        self.evict(keep=path)
+
+    def evict(self, keep: Path | None = None):
+        entries = sorted(self.cache_dir.glob('*.parquet'), key=lambda p: p.stat().st_mtime)
+        now = time.time()
+        for path in list(entries):
+            if path != keep and now - path.stat().st_mtime > self.max_age_seconds:
+                self.logger.info(f'Stage cache: {path.name} expired, removed')
+                path.unlink()
+                entries.remove(path)
+
+        total = sum(p.stat().st_size for p in entries)
+        for path in entries: # least recently used first
+            if total <= self.max_size_bytes:
+                break
+            if path == keep:
+                continue
+            total -= path.stat().st_size
+            path.unlink()
+            self.logger.info(f'Stage cache: {path.name} removed to keep size under {self.max_size_bytes / 1024 ** 3:.1f} GB')
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import sys
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+def proc_status_mb(field: str) -> float | None:
+    # Value of a kB field of /proc/self/status (VmRSS, VmHWM) in MB, None where there is no /proc (not Linux)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(f'{field}:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_mb() -> float | None:
+    '''Resident set size of the current process in MB (VmRSS, psutil where there is no /proc), None if unavailable.'''
+    rss = proc_status_mb('VmRSS')
+    if rss is not None:
+        return rss
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / (1024 ** 2)
+
+
+def peak_rss_mb() -> float | None:
+    '''Peak resident set size of the current process in MB (since process start), None if unavailable.'''
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak / (1024 ** 2) if sys.platform == 'darwin' else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return getattr(psutil.Process().memory_info(), 'peak_wset', 0) / (1024 ** 2) or None
+
+
+def reset_peak_rss() -> bool:
+    '''Resets the peak RSS counter (VmHWM) of the current process, Linux only. Returns False if not supported.'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss_since_reset_mb() -> float | None:
+    '''Peak RSS in MB since the last reset_peak_rss() (VmHWM), None if unavailable.'''
+    return proc_status_mb('VmHWM')
+
+
+def format_mb(value: float | None) -> str:
+    return 'n/a' if value is None else f'{value:.1f} MB'
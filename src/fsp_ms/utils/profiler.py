@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from .memory import current_rss_mb, peak_rss_mb, reset_peak_rss, peak_rss_since_reset_mb
+
+
+def path_bytes(path: Path) -> int:
+    # Size of a file or of all files under a directory (partitioned datasets), 0 if it does not exist
+    path = Path(path)
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+class StageProfiler:
+    '''
+    Per-stage instrumentation of ETL_pipeline, BuildFeatures, Split and XGB_model.
+
+    Every stage records wall time, CPU time of the process, peak RSS, rows in/out, and bytes read/written
+    (sizes of the files the stage declares as inputs/outputs). Peak RSS is per stage on Linux (the VmHWM counter
+    is reset when a stage starts), elsewhere it is the process peak so far (`peak_rss_scope` says which one).
+    Frame sizes are taken with memory_usage(deep=False), which only looks at column buffers;
+    deep=True walks every python object and is opt-in with `deep_memory`.
+    Records are written as one JSON report per run into `config.get('profiles')`, compare two of them with
+    compare_reports() or ``python -m src.scripts.compare_profiles old.json new.json``.
+
+    Example:
+        profiler = StageProfiler(config, logger, run_name='train')
+        etl.run(dry_run=False, profiler=profiler)
+        build_features.run(dry_run=False, profiler=profiler)
+        profiler.save()
+    '''
+
+    def __init__(self, config, logger, run_name: str = 'run', deep_memory: bool = False):
+        self.config = config
+        self.logger = logger
+        self.run_name = run_name
+        self.deep_memory = deep_memory
+        self.started_at = datetime.now()
+        self.records: list[dict] = []
+        self._open: list[dict] = [] # stack of running stages, nested stages pass their peak to the parent
+
+    def frame_bytes(self, df: pd.DataFrame) -> int:
+        return int(df.memory_usage(deep=self.deep_memory).sum())
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int | None = None, inputs: list[Path] = [], outputs: list[Path] = []):
+        '''
+        Measures the block as stage `name`. The yielded dict can be filled inside the block:
+        record['rows_out'] = len(df), or profiler.frame(record, df) to also store the frame size.
+        '''
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None, 'bytes_read': sum(path_bytes(p) for p in inputs)}
+        stage_scoped = reset_peak_rss()
+        record['_child_peak'] = 0.0
+        self._open.append(record)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = time.perf_counter() - wall
+            record['cpu_s'] = time.process_time() - cpu
+            peak = peak_rss_since_reset_mb() if stage_scoped else peak_rss_mb()
+            record['peak_rss_mb'] = max(peak or 0.0, record.pop('_child_peak')) or None
+            record['peak_rss_scope'] = 'stage' if stage_scoped else 'process'
+            record['rss_end_mb'] = current_rss_mb()
+            record['bytes_written'] = sum(path_bytes(p) for p in outputs)
+            self._open.pop()
+            if self._open and record['peak_rss_mb']:
+                self._open[-1]['_child_peak'] = max(self._open[-1]['_child_peak'], record['peak_rss_mb'])
+            record['depth'] = len(self._open)
+            self.records.append(record)
+            self.logger.info(f"Profile {name}: wall {record['wall_s']:.2f}s, cpu {record['cpu_s']:.2f}s, "
+                             f"peak RSS {record['peak_rss_mb'] or 0:.1f} MB, rows {rows_in} -> {record['rows_out']}")
+
+    def frame(self, record: dict, df: pd.DataFrame, key: str = 'rows_out'):
+        record[key] = len(df)
+        record['frame_bytes' if key == 'rows_out' else f'{key}_frame_bytes'] = self.frame_bytes(df)
+
+    def report(self) -> dict:
+        return {
+            'run_name': self.run_name,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'pid': os.getpid(),
+            'deep_memory': self.deep_memory,
+            'stages': self.records,
+        }
+
+    def save(self, path: Path | None = None) -> Path:
+        if path is None:
+            directory = Path(self.config.get('profiles'))
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"{self.run_name}_{self.started_at.strftime('%Y%m%d_%H%M%S')}.json"
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+        self.logger.info(f'Profile report saved to {path}')
+        return Path(path)
+
+
+def profile_stage(profiler: StageProfiler | None, name: str, **kwargs):
+    # Pipelines call this with their optional profiler: without one the block runs as is and gets a throwaway dict
+    return profiler.stage(name, **kwargs) if profiler is not None else nullcontext({})
+
+
+def load_report(path: Path) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_reports(old: dict, new: dict, metrics: list[str] = ['wall_s', 'cpu_s', 'peak_rss_mb', 'rows_out']) -> pd.DataFrame:
+    '''
+    Stage-by-stage comparison of two reports: old/new value and new/old ratio per metric.
+    Stages repeated within a run are summed (peak RSS: max), stages present in one report only get NaN on the other side.
+    '''
+    def by_stage(report):
+        stages = pd.DataFrame(report['stages'])
+        if stages.empty:
+            return pd.DataFrame(columns=metrics)
+        stages = stages.reindex(columns=['stage', *metrics])
+        grouped = stages.groupby('stage', sort=False)
+        return pd.DataFrame({metric: grouped[metric].max() if metric == 'peak_rss_mb' else grouped[metric].sum(min_count=1) \
+                             for metric in metrics})
+
+    old_stages, new_stages = by_stage(old), by_stage(new)
+    order = list(old_stages.index) + [s for s in new_stages.index if s not in old_stages.index]
+    columns = {}
+    for metric in metrics:
+        before = old_stages[metric].reindex(order).astype(float)
+        after = new_stages[metric].reindex(order).astype(float)
+        columns[f'{metric}_old'] = before
+        columns[f'{metric}_new'] = after
+        columns[f'{metric}_ratio'] = after / before.where(before != 0)
+    return pd.DataFrame(columns, index=pd.Index(order, name='stage'))
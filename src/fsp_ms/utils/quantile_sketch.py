@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+
+class QuantileSketch:
+    '''
+    Mergeable quantile sketch (KLL-style compactor hierarchy).
+
+    Values are added chunk by chunk with update(); sketches built on different chunks or workers
+    are combined with merge(). Level h keeps items of weight 2**h, a level that grows over `k` items
+    is sorted and every second item (random offset) is promoted to the next level.
+    Each compaction at level h moves any rank by at most 2**h, the sum of them is tracked exactly,
+    so `rank_error` is a guaranteed bound (as a fraction of n) and not an estimate.
+    While nothing has been compacted the sketch holds all values and quantile() is exact.
+
+    Args:
+        error: target rank error; k is chosen so that the bound stays below it for up to 2**32 values.
+        k: capacity of every level, overrides `error`.
+    '''
+
+    def __init__(self, error: float = 0.001, k: int | None = None, seed: int = 0):
+        self.k = k or math.ceil(32 / error)
+        self.levels: list[np.ndarray] = [np.empty(0)]
+        self.n = 0
+        self.max_rank_error = 0 # in items
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values) -> 'QuantileSketch':
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compact()
+        return self
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.n += other.n
+        self.max_rank_error += other.max_rank_error
+        self.compact()
+        return self
+
+    def compact(self):
+        h = 0
+        while h < len(self.levels):
+            items = self.levels[h]
+            if len(items) > self.k:
+                items = np.sort(items)
+                # Odd item stays on its level, pairs are halved
+                rest, items = items[len(items) - len(items) % 2:], items[:len(items) - len(items) % 2]
+                promoted = items[self.rng.integers(2)::2]
+                self.levels[h] = rest
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+                self.max_rank_error += 2 ** h
+            h += 1
+
+    @property
+    def rank_error(self) -> float:
+        return self.max_rank_error / self.n if self.n else 0.0
+
+    def quantile(self, q: float) -> float:
+        if self.n == 0:
+            return np.nan
+        if len(self.levels) == 1: # nothing compacted yet: exact, same interpolation as pandas
+            return float(np.quantile(self.levels[0], q))
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        position = np.searchsorted(cumulative, q * (self.n - 1), side='right')
+        return float(items[order][min(position, len(items) - 1)])
+
+    def __len__(self) -> int:
+        return self.n
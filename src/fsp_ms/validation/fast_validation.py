@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pandera.pandas as pa
+from pandera.engines import pandas_engine
+from pandera.errors import SchemaError, SchemaErrorReason
+
+# Checks of the schema compiled to numpy: check name -> function(values, statistics) -> boolean mask of passing values.
+# Checks not listed here are run by pandera itself on the column (same result, not vectorized by us).
+NUMPY_CHECKS = {
+    'in_range': lambda v, s: (v >= s['min_value'] if s.get('include_min', True) else v > s['min_value']) \
+                             & (v <= s['max_value'] if s.get('include_max', True) else v < s['max_value']),
+    'greater_than_or_equal_to': lambda v, s: v >= s['min_value'],
+    'greater_than': lambda v, s: v > s['min_value'],
+    'less_than_or_equal_to': lambda v, s: v <= s['max_value'],
+    'less_than': lambda v, s: v < s['max_value'],
+    'equal_to': lambda v, s: v == s['value'],
+    'not_equal_to': lambda v, s: v != s['value'],
+    'isin': lambda v, s: np.isin(v, np.asarray(s['allowed_values'])),
+    'notin': lambda v, s: ~np.isin(v, np.asarray(s['forbidden_values'])),
+}
+
+
+def match_columns(schema: pa.DataFrameSchema, columns: pd.Index) -> dict[str, list[str]]:
+    # Schema column (name or regex) -> frame columns it validates, regex columns match like pandera (str.match)
+    matched = {}
+    for name, column in schema.columns.items():
+        if column.regex:
+            matched[name] = list(columns[columns.astype(str).str.match(name)])
+        else:
+            matched[name] = [name] if name in columns else []
+    return matched
+
+
+def failure_frame(df: pd.DataFrame, positions: np.ndarray, values) -> pd.DataFrame:
+    return pd.DataFrame({'index': df.index.to_numpy()[positions], 'failure_case': values})
+
+
+def check_column(schema_column: pa.Column, df: pd.DataFrame, name: str) -> list[SchemaError]:
+    # dtype, nulls and every check of one column in one pass over its numpy values (no copy of the frame)
+    errors = []
+    series = df[name]
+    if schema_column.dtype is not None and not schema_column.dtype.check(pandas_engine.Engine.dtype(series.dtype)):
+        errors.append(SchemaError(schema_column, df, f"expected series '{name}' to have type {schema_column.dtype}, got {series.dtype}",
+                                  failure_cases=str(series.dtype), check=f"dtype('{schema_column.dtype}')",
+                                  reason_code=SchemaErrorReason.WRONG_DATATYPE, column_name=name))
+    values = series.to_numpy()
+    nulls = pd.isna(values) if values.dtype.kind not in 'iub' else np.zeros(len(values), dtype=bool)
+    if not schema_column.nullable and nulls.any():
+        positions = np.flatnonzero(nulls)
+        errors.append(SchemaError(schema_column, df, f"non-nullable series '{name}' contains null values",
+                                  failure_cases=failure_frame(df, positions, values[positions]), check='not_nullable',
+                                  reason_code=SchemaErrorReason.SERIES_CONTAINS_NULLS, column_name=name))
+
+    for check_number, check in enumerate(schema_column.checks):
+        if check.name in NUMPY_CHECKS and values.dtype.kind in 'iufb':
+            with np.errstate(invalid='ignore'):
+                passed = NUMPY_CHECKS[check.name](values, check.statistics)
+        else:
+            passed = check(series).check_output.to_numpy()
+        failed = ~passed & ~nulls if check.ignore_na else ~passed
+        if failed.any():
+            positions = np.flatnonzero(failed)
+            errors.append(SchemaError(schema_column, df, f"Column '{name}' failed element-wise validator number {check_number}: {check}",
+                                      failure_cases=failure_frame(df, positions, values[positions]), check=check,
+                                      check_index=check_number, reason_code=SchemaErrorReason.DATAFRAME_CHECK,
+                                      column_name=name))
+    return errors
+
+
+def packed_key(df: pd.DataFrame, columns: list[str]) -> np.ndarray | None:
+    # Integer columns -> one int64 key (each column shifted to 0 and given its bit width), None if they do not fit
+    key = np.zeros(len(df), dtype=np.int64)
+    bits = 0
+    for column in columns:
+        values = df[column].to_numpy()
+        if values.dtype.kind not in 'iu':
+            return None
+        if not len(values):
+            continue
+        low, high = int(values.min()), int(values.max())
+        width = max(high - low, 1).bit_length()
+        bits += width
+        if bits > 63:
+            return None
+        key = key << width | (values.astype(np.int64) - low)
+    return key
+
+
+def check_unique(schema: pa.DataFrameSchema, df: pd.DataFrame, columns: list[str]) -> list[SchemaError]:
+    # Rows sharing the `columns` combination (all of them, as pandera's report_duplicates='all')
+    key = packed_key(df, columns)
+    if key is None:
+        duplicated = df.duplicated(subset=columns, keep=False).to_numpy()
+    else:
+        ordered = key[:-1] < key[1:]
+        if ordered.all(): # the feature frame is built sorted by the key, a sort is only needed if it is not
+            return []
+        order = np.argsort(key, kind='stable')
+        sorted_key = key[order]
+        same = sorted_key[1:] == sorted_key[:-1]
+        duplicated = np.zeros(len(key), dtype=bool)
+        duplicated[order[1:][same]] = True
+        duplicated[order[:-1][same]] = True
+    if not duplicated.any():
+        return []
+    positions = np.flatnonzero(duplicated)
+    failure_cases = pd.concat([failure_frame(df, positions, df[column].to_numpy()[positions]).assign(column=column) \
+                               for column in columns], ignore_index=True)
+    return [SchemaError(schema, df, f'columns {tuple(columns)} not unique', failure_cases=failure_cases,
+                        check='multiple_fields_uniqueness', reason_code=SchemaErrorReason.DUPLICATES)]
+
+
+def fast_validate(schema: pa.DataFrameSchema, df: pd.DataFrame, threads: int | None = None) -> pd.DataFrame:
+    '''
+    Validates `df` against a pandera DataFrameSchema without pandera's per-check machinery and returns `df` itself.
+
+    Column presence (required / strict), dtypes, nulls and the checks of every column are compiled to numpy
+    (NUMPY_CHECKS) and run column by column in a thread pool (numpy releases the GIL), the `unique` columns are
+    checked through one packed int64 key. Every failure is collected (as pandera's lazy=True) and raised as
+    pandera.errors.SchemaErrors, so e.failure_cases has the same columns as pandera's.
+    '''
+    errors = []
+    matched = match_columns(schema, df.columns)
+    for name, schema_column in schema.columns.items():
+        if schema_column.required and not matched[name]:
+            errors.append(SchemaError(schema, df, f"column '{name}' not in dataframe", failure_cases=name,
+                                      check='column_in_dataframe', reason_code=SchemaErrorReason.COLUMN_NOT_IN_DATAFRAME))
+    if schema.strict:
+        known = {column for columns in matched.values() for column in columns}
+        for column in df.columns:
+            if column not in known:
+                errors.append(SchemaError(schema, df, f"column '{column}' not in DataFrameSchema", failure_cases=column,
+                                          check='column_in_schema', reason_code=SchemaErrorReason.COLUMN_NOT_IN_SCHEMA))
+
+    unique = [schema.unique] if isinstance(schema.unique, str) else (schema.unique or [])
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as pool:
+        tasks = [pool.submit(check_column, schema.columns[name], df, column) for name, columns in matched.items() for column in columns]
+        if unique and all(column in df.columns for column in unique):
+            tasks.append(pool.submit(check_unique, schema, df, unique))
+        for task in tasks:
+            errors.extend(task.result())
+
+    if errors:
+        raise pa.errors.SchemaErrors(schema, errors, df)
+    return df
@@ -29,6 +29,7 @@ class SchemaFeatures:
                 "target_aggregated_max_premonthes_item_id": pa.Column(pa.Float32, Check.ge(0)),
                 "target_aggregated_mean_premonthes_shop_id": pa.Column(pa.Float32, Check.ge(0)),
                 "target_aggregated_max_premonthes_shop_id": pa.Column(pa.Float32, Check.ge(0)),
+                r"^target_aggregated_(mean|max)_last_\d+_monthes_.*$": pa.Column(pa.Float32, Check.ge(0), regex=True, required=False),  # optional rolling windows
 
                 # Lag features (regex patterns to cover all lag columns):
                 r"^target.*_lag_\d+$": pa.Column(pa.Float32, Check.ge(0), regex=True),  # all target-related lag columns >= 0
@@ -1,17 +1,42 @@
+from __future__ import annotations
+
 import pandas as pd
 import pandera.pandas as pa
 
+from .fast_validation import fast_validate
+
+VALIDATION_MODES = ('pandera', 'fast')
+
 class Validator:
-    def __init__(self, logger):
+    '''
+    mode='pandera' validates with pandera (lazy=True: every failure is collected) and returns its validated copy of the frame,
+    mode='fast' runs the same schema compiled to numpy checks (validation/fast_validation.py) in a pool of
+    `threads` threads and returns the frame itself. Both raise pandera.errors.SchemaErrors with the same failure_cases.
+    '''
+    def __init__(self, logger, mode: str = 'pandera', threads: int | None = None):
+        if mode not in VALIDATION_MODES:
+            raise ValueError(f"Unknown validation mode '{mode}', use one of {VALIDATION_MODES}")
         self.logger = logger
-        pass
+        self.mode = mode
+        self.threads = threads
 
-    def validate(self, schema: pa.DataFrameSchema, df: pd.DataFrame, scheme_name:str) -> pd.DataFrame:
+    def validate(self, schema: pa.DataFrameSchema, df: pd.DataFrame, scheme_name:str, required: bool = True) -> pd.DataFrame:
+        # required=False: columns missing from df are not failures (a feature selection), present ones are checked as usual
         self.logger.info(f'Initializing validation schema: {scheme_name}...\n')
-        self.logger.info(f'Starting validation for Dframe with {len(df)} records...')
+        self.logger.info(f'Starting validation ({self.mode}) for Dframe with {len(df)} records...')
 
+        dataframe_schema = schema.schema
+        if not required:
+            dataframe_schema = dataframe_schema.update_columns({name: {'required': False} for name in dataframe_schema.columns})
+        mode = self.mode
+        if mode == 'fast' and (dataframe_schema.coerce or any(c.coerce for c in dataframe_schema.columns.values())):
+            self.logger.warning(f'!!! {scheme_name} coerces dtypes, fast mode never changes the frame: validating with pandera')
+            mode = 'pandera'
         try:
-            validated_df = schema.schema.validate(df)
+            if mode == 'fast':
+                validated_df = fast_validate(dataframe_schema, df, threads=self.threads)
+            else:
+                validated_df = dataframe_schema.validate(df, lazy=True) # all failures, raised as SchemaErrors like the fast mode
             self.logger.info(f'Data frame has passed validation!\n')
         except pa.errors.SchemaErrors as e:
             self.logger.error("!!! DataFrame validation failed.")
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.fsp_ms.config import Config
+from src.fsp_ms.utils.logger import get_logger
+from src.fsp_ms.utils.profiler import StageProfiler
+from src.fsp_ms.data.synthetic import SyntheticData
+from src.fsp_ms.data.etl import ETL_pipeline
+from src.fsp_ms.features.build_features import BuildFeatures
+from src.fsp_ms.data.split import Split
+from src.fsp_ms.models.XGB_model import XGB_model
+
+# Runs the whole pipeline on synthetic data at several scale factors and fits how every stage scales.
+# To run this file use following command from ROOT in console:
+# ``python -m src.scripts.benchmark --scales 0.05 0.1 0.2 --out data/benchmark``
+
+
+def quiet_logger(name: str) -> logging.Logger:
+    # Pipeline loggers of benchmark runs: nothing to console or files, only the profiler writes its own log
+    logger = logging.getLogger(f'benchmark.{name}')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    return logger
+
+
+def run_scale(out: Path, scale: float, seed: int, n_estimators: int | None) -> dict:
+    config = Config(base_dir=out / f'scale_{scale:g}')
+    profiler = StageProfiler(config, quiet_logger('profiler'), run_name=f'benchmark_scale_{scale:g}')
+    if n_estimators is not None: # smaller model keeps benchmark runs short, data stages are what is measured
+        config.get_xgb('xgb_params')['n_estimators'] = n_estimators
+
+    with profiler.stage('synthetic.generate') as record:
+        sales = SyntheticData(config, quiet_logger('synthetic'), scale=scale, seed=seed).run()[0]
+        record['rows_out'] = len(sales)
+    del sales
+    ETL_pipeline(config, quiet_logger('etl')).run(dry_run=False, profiler=profiler)
+    BuildFeatures(config, quiet_logger('build_features')).run(dry_run=False, profiler=profiler)
+    Split(config, quiet_logger('split')).run(profiler=profiler)
+    model = XGB_model(config, quiet_logger('model'))
+    model.train(save=True, profiler=profiler)
+    model.predict(profiler=profiler)
+    profiler.save()
+    return profiler.report()
+
+
+def scaling(reports: dict[float, dict], min_seconds: float) -> pd.DataFrame:
+    '''
+    Per stage: wall time and peak RSS at every scale and the fitted exponent of wall ~ scale ** exponent.
+    exponent ~ 1 is linear, clearly above 1 is super-linear. Stages faster than `min_seconds` at the largest
+    scale are mostly noise and get no exponent.
+    '''
+    rows = []
+    for scale, report in reports.items():
+        for record in report['stages']:
+            rows.append({'scale': scale, 'stage': record['stage'], 'wall_s': record['wall_s'], 'peak_rss_mb': record['peak_rss_mb']})
+    records = pd.DataFrame(rows).groupby(['stage', 'scale'], sort=False).agg({'wall_s': 'sum', 'peak_rss_mb': 'max'})
+
+    table = records.unstack('scale')
+    table.columns = [f'{metric}_x{scale:g}' for metric, scale in table.columns]
+    exponents = {}
+    for stage, group in records.groupby(level='stage', sort=False):
+        scales = group.index.get_level_values('scale').to_numpy(dtype=float)
+        wall = group['wall_s'].to_numpy(dtype=float)
+        if len(scales) < 2 or wall[np.argmax(scales)] < min_seconds:
+            exponents[stage] = np.nan
+            continue
+        exponents[stage] = np.polyfit(np.log(scales), np.log(np.maximum(wall, 1e-6)), 1)[0]
+    table['wall_exponent'] = pd.Series(exponents)
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pipeline benchmark on synthetic data')
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.05, 0.1, 0.2])
+    parser.add_argument('--out', type=Path, default=Path('data/benchmark'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--n-estimators', type=int, default=20)
+    parser.add_argument('--min-seconds', type=float, default=0.05)
+    parser.add_argument('--superlinear', type=float, default=1.3, help='exponent above which a stage is reported')
+    args = parser.parse_args()
+
+    config = Config(base_dir=args.out)
+    logger = get_logger(config=config, name='benchmark', log_file='benchmark.log')
+    reports = {}
+    for scale in sorted(args.scales):
+        logger.info(f'Running pipeline at scale {scale:g}...')
+        # Fresh process per scale: peak RSS of a stage is not inflated by memory kept from the previous scale
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            reports[scale] = pool.submit(run_scale, args.out, scale, args.seed, args.n_estimators).result()
+
+    table = scaling(reports, args.min_seconds)
+    table.to_csv(args.out / 'benchmark.csv')
+    with open(args.out / 'benchmark.json', 'w', encoding='utf-8') as f:
+        json.dump({str(scale): report for scale, report in reports.items()}, f, indent=2)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 250, 'display.float_format', '{:.3f}'.format):
+        logger.info(f'\n{table}')
+    superlinear = table.index[table['wall_exponent'] > args.superlinear].tolist()
+    if superlinear:
+        logger.warning(f'!!! Super-linear stages (exponent > {args.superlinear}): {superlinear}')
+    else:
+        logger.info(f'No stage scales worse than scale ** {args.superlinear}')
+    logger.info(f"Results saved to {args.out / 'benchmark.csv'} and {args.out / 'benchmark.json'}")
@@ -0,0 +1,16 @@
+import sys
+
+import pandas as pd
+
+from src.fsp_ms.utils.profiler import load_report, compare_reports
+
+# To compare two runs use following command from ROOT in console:
+# ``python -m src.scripts.compare_profiles data/07_logs/profiles/train_old.json data/07_logs/profiles/train_new.json``
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('Usage: python -m src.scripts.compare_profiles <old_report.json> <new_report.json>')
+    old, new = load_report(sys.argv[1]), load_report(sys.argv[2])
+    comparison = compare_reports(old, new)
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 250, 'display.float_format', '{:.3f}'.format):
+        print(f"{old['run_name']} ({old['started_at']}) -> {new['run_name']} ({new['started_at']})\n")
+        print(comparison)
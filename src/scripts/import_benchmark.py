@@ -0,0 +1,76 @@
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+
+# Import-time benchmark: every case runs in a fresh interpreter and reports its wall time and
+# which heavy libraries ended up in sys.modules. With --check it fails (exit code 1) when the
+# package import or Config() pulls in a heavy library or creates directories, so lazy imports can not regress.
+# Needs only the standard library for the light cases. To run this file use following command from ROOT:
+# ``python -m src.scripts.import_benchmark --repeats 5 --check``
+
+HEAVY = ['numpy', 'pandas', 'pyarrow', 'xgboost', 'pandera', 'tqdm', 'sklearn']
+
+CASES = {
+    # name: (statement, heavy imports allowed, directories may be created)
+    'import fsp_ms':             ('import src.fsp_ms', False, False),
+    'Config()':                  ('from src.fsp_ms.config import Config; Config(base_dir=BASE)', False, False),
+    'Config() + get paths':      ('from src.fsp_ms.config import Config; c = Config(base_dir=BASE); c.get("inference"); c.get("xgb_model")', False, True),
+    'from fsp_ms import Config': ('from src.fsp_ms import Config; Config(base_dir=BASE).as_dict()', False, False),
+    'XGB_model':                 ('from src.fsp_ms import XGB_model', True, True),
+    'BuildFeatures':             ('from src.fsp_ms import BuildFeatures', True, True),
+    'all public classes':        ('import src.fsp_ms as m; [getattr(m, name) for name in m.__all__]', True, True),
+}
+
+CHILD = '''
+import json, sys, time
+from pathlib import Path
+BASE = Path(sys.argv[2])
+started = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - started
+print(json.dumps({'seconds': elapsed, 'heavy': [m for m in sys.argv[3].split(',') if m in sys.modules],
+                  'created': sorted(str(p.relative_to(BASE)) for p in BASE.rglob('*'))}))
+'''
+
+
+def run_case(statement: str, repeats: int) -> dict:
+    runs = []
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory() as base:
+            output = subprocess.run([sys.executable, '-c', CHILD, statement, base, ','.join(HEAVY)],
+                                    capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output))
+    seconds = sorted(run['seconds'] for run in runs)
+    return {'median_ms': seconds[len(seconds) // 2] * 1000, 'min_ms': seconds[0] * 1000,
+            'heavy': runs[-1]['heavy'], 'created': runs[-1]['created']}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time of the package in fresh interpreters')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--check', action='store_true', help='fail if light cases import heavy libraries or create directories')
+    parser.add_argument('--light-only', action='store_true', help='skip cases which import heavy libraries (no dependencies needed)')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if a light case takes longer (median)')
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'case':<28}{'median ms':>12}{'min ms':>10}  heavy modules")
+    for name, (statement, heavy_allowed, dirs_allowed) in CASES.items():
+        if heavy_allowed and args.light_only:
+            continue
+        result = run_case(statement, args.repeats)
+        print(f"{name:<28}{result['median_ms']:>12.1f}{result['min_ms']:>10.1f}  {', '.join(result['heavy']) or '-'}")
+        if not dirs_allowed and result['created']:
+            failures.append(f"{name}: created {result['created']}")
+        if heavy_allowed:
+            continue
+        if result['heavy']:
+            failures.append(f"{name}: imports {result['heavy']}")
+        if args.max_ms is not None and result['median_ms'] > args.max_ms:
+            failures.append(f"{name}: {result['median_ms']:.1f} ms > {args.max_ms} ms")
+
+    if args.check and failures:
+        print('\nImport check failed:\n' + '\n'.join(failures))
+        sys.exit(1)
@@ -0,0 +1,103 @@
+import argparse
+import json
+import logging
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.fsp_ms.config import Config
+from src.fsp_ms.utils.logger import get_logger
+from src.fsp_ms.models.XGB_model import XGB_model, MODEL_FORMATS
+
+# Compares the pickled XGBRegressor with XGBoost's native UBJSON/JSON formats: file size, cold load
+# (fresh interpreter: import xgboost + load) and warm load (XGB_model.load_model in this process).
+# Needs a trained pickled model (python -m src.scripts.train). To run this file use following command from ROOT:
+# ``python -m src.scripts.model_format_benchmark --repeats 20``
+
+COLD_LOAD = '''
+import json, sys, time
+started = time.perf_counter()
+import xgboost as xgb
+imported = time.perf_counter()
+if sys.argv[1] == 'pickle':
+    import pickle
+    with open(sys.argv[2], 'rb') as f:
+        model = pickle.load(f)
+else:
+    model = xgb.Booster(model_file=sys.argv[2])
+    with open(sys.argv[3], encoding='utf-8') as f:
+        meta = json.load(f)
+loaded = time.perf_counter()
+print(json.dumps({'import_s': imported - started, 'load_s': loaded - imported}))
+'''
+
+
+def quiet_logger(name: str) -> logging.Logger:
+    logger = logging.getLogger(f'model_format_benchmark.{name}')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    return logger
+
+
+def export_native(config: Config, logger: logging.Logger) -> XGB_model:
+    # Pickled model -> native formats; categories for the metadata come from the training frame
+    source = XGB_model(config, logger, model_format='pickle')
+    source.load_model()
+    source.meta = source.model_meta(source.frame_categories(source.select_features(source.get_train_data()[0])))
+    for model_format in MODEL_FORMATS[1:]:
+        native = XGB_model(config, logger, model_format=model_format)
+        native.model, native.meta = source.model, source.meta
+        native.save_model()
+    return source
+
+
+def measure(config: Config, model_format: str, repeats: int, inference: pd.DataFrame, reference: np.ndarray) -> dict:
+    model = XGB_model(config, quiet_logger(model_format), model_format=model_format)
+    files = [model.model_path()] + ([config.get('xgb_model_meta')] if model_format != 'pickle' else [])
+
+    cold = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', COLD_LOAD, model_format, *map(str, files)],
+                                capture_output=True, text=True, check=True).stdout
+        cold.append(json.loads(output))
+    warm = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        model.load_model()
+        warm.append(time.perf_counter() - started)
+
+    predicted = model.predict_values(inference)
+    return {
+        'format': model_format,
+        'file_mb': sum(Path(f).stat().st_size for f in files) / 1024 ** 2,
+        'cold_import_s': float(np.median([c['import_s'] for c in cold])),
+        'cold_load_s': float(np.median([c['load_s'] for c in cold])),
+        'warm_load_s': float(np.median(warm)),
+        'max_abs_diff_vs_pickle': float(np.max(np.abs(predicted - reference))) if len(reference) else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load time and file size of XGB_model formats')
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--out', type=Path, default=None, help='csv with results, default: models_dir/model_format_benchmark.csv')
+    args = parser.parse_args()
+
+    config = Config()
+    logger = get_logger(config=config, name='model_format_benchmark', log_file=config.get('log_file_model'))
+    source = export_native(config, quiet_logger('export'))
+    inference = source.select_features(source.get_inference_data())
+    reference = source.predict_values(inference)
+
+    results = pd.DataFrame([measure(config, model_format, args.repeats, inference, reference) \
+                            for model_format in MODEL_FORMATS]).set_index('format')
+    results['cold_load_speedup'] = results.loc['pickle', 'cold_load_s'] / results['cold_load_s']
+    out = args.out or config.get('models_dir') / 'model_format_benchmark.csv'
+    results.to_csv(out)
+    with pd.option_context('display.width', 250, 'display.max_columns', None, 'display.float_format', '{:.4f}'.format):
+        logger.info(f'\n{results}')
+    logger.info(f'Results saved to {out}')
@@ -1,10 +1,12 @@
 from src.fsp_ms.models.XGB_model import XGB_model
+from src.fsp_ms.data.column_cache import ColumnCache
 from src.fsp_ms.config import Config
 from src.fsp_ms.utils.logger import get_logger
 
 if __name__ == '__main__':
     # python -m src.scripts.predict
     config = Config()
-    logger_predict = get_logger("predict", log_file = config.get('log_file_model'))
-    model = XGB_model(config, logger_predict)
+    logger_predict = get_logger(config=config, name="predict", log_file = config.get('log_file_model'))
+    # Inference columns are memory-mapped from 03_interim/column_cache, parquet is decoded only when it changed
+    model = XGB_model(config, logger_predict, column_cache=ColumnCache(config, logger_predict))
     model.predict(load=True,save=True)
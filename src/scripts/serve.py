@@ -0,0 +1,26 @@
+import argparse
+
+from src.fsp_ms.config import Config
+from src.fsp_ms.utils.logger import get_logger
+from src.fsp_ms.models.XGB_model import XGB_model, MODEL_FORMATS
+from src.fsp_ms.models.server import PredictionService, serve
+
+# Long-lived prediction service: model and inference features stay in memory between requests.
+# To run this file use following command from ROOT in console:  ``python -m src.scripts.serve --port 8008``
+# curl -X POST localhost:8008/predict -d '{"pairs": [[5, 5037], [5, 5320]]}'
+# curl localhost:8008/stats
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prediction service around XGB_model')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8008)
+    parser.add_argument('--threads', type=int, default=8, help='request handling threads')
+    parser.add_argument('--max-batch-rows', type=int, default=65536)
+    parser.add_argument('--batch-wait-ms', type=float, default=2.0, help='how long a batch waits for more requests')
+    parser.add_argument('--model-format', choices=MODEL_FORMATS, default='pickle', help='format the model was saved in')
+    args = parser.parse_args()
+
+    config = Config()
+    logger_serve = get_logger(config=config, name='serve', log_file=config.get('log_file_model'))
+    model = XGB_model(config, logger_serve, model_format=args.model_format)
+    service = PredictionService(config, logger_serve, model=model, max_batch_rows=args.max_batch_rows, batch_wait_ms=args.batch_wait_ms)
+    serve(service, host=args.host, port=args.port, threads=args.threads)
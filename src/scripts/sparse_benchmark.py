@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.fsp_ms.config import Config
+from src.fsp_ms.utils.logger import get_logger
+from src.fsp_ms.utils.profiler import StageProfiler
+from src.fsp_ms.data.feature_matrix import FeatureMatrix
+from src.fsp_ms.models.XGB_model import XGB_model
+
+# Dense vs sparse (CSR) training from the feature matrix: input size, QuantileDMatrix build and fit time, peak RSS
+# and how far predictions move from the dense model. Every run is a fresh process, so peak RSS is per run.
+# Needs the feature matrix (BuildFeatures.run(output_format='matrix')). To run this file use following command from ROOT:
+# ``python -m src.scripts.sparse_benchmark --min-zero-shares 0.5 0.9``
+
+
+def quiet_logger(name: str) -> logging.Logger:
+    logger = logging.getLogger(f'sparse_benchmark.{name}')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    return logger
+
+
+def run(base_dir: Path | None, min_zero_share: float | None, n_estimators: int | None) -> dict:
+    # min_zero_share=None is the dense train_data='matrix' run
+    config = Config() if base_dir is None else Config(base_dir=base_dir)
+    if n_estimators is not None:
+        config.get_xgb('xgb_params')['n_estimators'] = n_estimators
+    profiler = StageProfiler(config, quiet_logger('profiler'), run_name='sparse_benchmark')
+    model = XGB_model(config, quiet_logger('model'))
+    if min_zero_share is None:
+        model.train(profiler=profiler, train_data='matrix')
+    else:
+        model.train_sparse(profiler=profiler, min_zero_share=min_zero_share)
+    stages = {record['stage']: record for record in profiler.report()['stages']}
+    matrix = FeatureMatrix(config, quiet_logger('matrix'))
+    return {
+        'train_data': 'dense' if min_zero_share is None else f'sparse, zeros >= {min_zero_share:g}',
+        'sparse_columns': len(json.loads(model.booster().attr('sparse_features') or '[]')),
+        'input_mb': stages['model.get_train_data'].get('csr_mb', matrix.array('train_x').nbytes / 1024 ** 2),
+        'build_s': stages['model.get_train_data']['wall_s'],
+        'fit_s': stages['model.fit']['wall_s'],
+        'peak_rss_mb': max(stages['model.get_train_data']['peak_rss_mb'] or 0, stages['model.fit']['peak_rss_mb'] or 0),
+        'predicted': np.clip(model.predict_values(matrix.array('inference_x')), 0, 20),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Dense vs sparse training of XGB_model from the feature matrix')
+    parser.add_argument('--min-zero-shares', type=float, nargs='+', default=[0.5, 0.9],
+                        help='one sparse run per value: columns with at least this share of zeros are stored sparse')
+    parser.add_argument('--base-dir', type=Path, default=None, help='data directory of Config, default: Config() defaults')
+    parser.add_argument('--n-estimators', type=int, default=None)
+    parser.add_argument('--out', type=Path, default=None, help='csv with results, default: models_dir/sparse_benchmark.csv')
+    args = parser.parse_args()
+
+    config = Config() if args.base_dir is None else Config(base_dir=args.base_dir)
+    logger = get_logger(config=config, name='sparse_benchmark', log_file=config.get('log_file_model'))
+    results = []
+    for min_zero_share in [None, *args.min_zero_shares]:
+        logger.info(f"Training {'dense' if min_zero_share is None else f'sparse (zeros >= {min_zero_share:g})'}...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results.append(pool.submit(run, args.base_dir, min_zero_share, args.n_estimators).result())
+
+    dense = results[0].pop('predicted')
+    results[0]['mean_abs_diff_vs_dense'] = 0.0
+    for result in results[1:]:
+        predicted = result.pop('predicted')
+        result['mean_abs_diff_vs_dense'] = float(np.mean(np.abs(predicted - dense))) if len(dense) else 0.0
+    results = pd.DataFrame(results).set_index('train_data')
+    out = args.out or config.get('models_dir') / 'sparse_benchmark.csv'
+    results.to_csv(out)
+    with pd.option_context('display.width', 250, 'display.max_columns', None, 'display.float_format', '{:.3f}'.format):
+        logger.info(f'\n{results}')
+    logger.info(f'Results saved to {out}')
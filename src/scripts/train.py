@@ -1,5 +1,7 @@
 from src.fsp_ms.config import Config
 from src.fsp_ms.utils.logger import get_logger
+from src.fsp_ms.utils.cache import StageCache
+from src.fsp_ms.utils.profiler import StageProfiler
 from src.fsp_ms.data.etl import ETL_pipeline
 from src.fsp_ms.validation.schema_cleaned import SchemaSales
 from src.fsp_ms.features.build_features import BuildFeatures
@@ -12,6 +14,12 @@ from src.fsp_ms.models.XGB_model import XGB_model
 if __name__ == '__main__':
     # Common config for all objects
     config = Config()
+    # Intermediate frames cache: unchanged inputs and code -> stages are loaded from 03_interim
+    logger_cache = get_logger(config=config, name = "stage_cache", log_file = config.get('log_file_stage_cache'))
+    cache = StageCache(config, logger_cache)
+    # Per-stage time / memory / rows / bytes, saved as JSON to 07_logs/profiles
+    logger_profiler = get_logger(config=config, name = "profiler", log_file = config.get('log_file_profiler'))
+    profiler = StageProfiler(config, logger_profiler, run_name = 'train')
 
     # ETL
     ## Init: etl object and it's logger
@@ -24,7 +32,7 @@ if __name__ == '__main__':
     ### Init: Schema for Validator
     etl_schema = SchemaSales()
     ## Run: etl transformation with transferring validator and validation schema
-    etl.run(validator_object = etl_validator, validation_schema = etl_schema, dry_run= False)
+    etl.run(validator_object = etl_validator, validation_schema = etl_schema, dry_run= False, cache = cache, profiler = profiler)
 
     # FE
     logger_fe = get_logger(config=config, name = "build_features", \
@@ -33,22 +41,23 @@ if __name__ == '__main__':
     ## Init: Validator and it's logger
     features_validation_logger = get_logger(config=config, name = "validation_schema_features", \
                         log_file = config.get('validation_schema_features'))
-    fe_validator = Validator(features_validation_logger)
+    fe_validator = Validator(features_validation_logger, mode = 'fast') # same schema, numpy checks, frame is not copied
     ### Init: Schema for Validator
     features_schema = SchemaFeatures()
 
-    build_features.run(validator_object = fe_validator, validation_schema = features_schema, dry_run = False )
+    build_features.run(validator_object = fe_validator, validation_schema = features_schema, dry_run = False, cache = cache, profiler = profiler)
 
     # Split
 
     logger_split = get_logger(config=config, name = "split", \
                             log_file = config.get('log_file_split'))
     split = Split(config, logger_split)
-    split.run()
+    split.run(profiler = profiler)
 
     # Model
 
     logger_model = get_logger(config=config, name = "model", log_file= config.get('log_file_model'))
 
     model = XGB_model(config, logger_model)
-    model.train(save = True)
+    model.train(save = True, profiler = profiler)
+    profiler.save()
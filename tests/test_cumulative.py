@@ -0,0 +1,39 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.fsp_ms.config import Config
+from src.fsp_ms.features.build_features import BuildFeatures
+
+
+def synthetic_full_df(months: int = 6, shops: int = 4, items: int = 15, seed: int = 0) -> pd.DataFrame:
+    # Every (shop, item) pair in every month, test month (the last one) without target, as concat_test leaves it
+    rng = np.random.default_rng(seed)
+    month, shop, item = np.meshgrid(np.arange(months), np.arange(shops), np.arange(items), indexing='ij')
+    full_df = pd.DataFrame({'date_block_num': month.ravel(), 'shop_id': shop.ravel(), 'item_id': item.ravel()})
+    full_df['target'] = rng.poisson(1.5, len(full_df)).astype(np.float32)
+    full_df.loc[full_df['date_block_num'] == months - 1, 'target'] = np.nan
+    return full_df.sample(frac=0.8, random_state=seed).sort_values(['date_block_num', 'shop_id', 'item_id'], ignore_index=True)
+
+
+@pytest.fixture
+def build_features(tmp_path):
+    logger = logging.getLogger('test_cumulative')
+    logger.addHandler(logging.NullHandler())
+    return BuildFeatures(Config(base_dir=tmp_path), logger)
+
+
+def test_cumulative_engine_matches_loop(build_features):
+    full_df = synthetic_full_df()
+    loop_df = build_features.expanding_window(full_df.copy(), engine='loop')
+    cumulative_df = build_features.expanding_window(full_df.copy(), engine='cumulative')
+
+    columns = [c for c in loop_df.columns if c not in full_df.columns]
+    assert columns == [c for c in cumulative_df.columns if c not in full_df.columns]
+    assert len(columns) == 2 * len(build_features.aggregating_target_by)
+    for column in columns:
+        np.testing.assert_allclose(cumulative_df[column].to_numpy(dtype=np.float64), loop_df[column].to_numpy(dtype=np.float64),
+                                   rtol=0, atol=1e-6, equal_nan=True, err_msg=column)
+    assert build_features.compare_expanding_engines(full_df)